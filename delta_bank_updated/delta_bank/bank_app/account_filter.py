@@ -0,0 +1,93 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+
+FALSE_POSITIVE_RATE = 0.001
+CONFIRM_CHUNK = 2000
+VALIDATION_BATCH_LIMIT = 10_000
+
+
+class BloomFilter:
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.capacity = max(capacity, 1024)
+        self.size = math.ceil(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, number):
+        # Double hashing, k positions from the two halves of one digest
+        digest = hashlib.blake2b(number.to_bytes(8, 'little', signed=True), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, number):
+        for position in self._positions(number):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, number):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(number))
+
+
+class AccountFilter:
+    """In-process answer to "does this account number exist", for credit account validation.
+
+    Negative answers come from a Bloom filter without touching the database. Positive answers may
+    be false positives or deleted accounts, so they are confirmed with one query per batch. The
+    filter is rebuilt every ACCOUNT_FILTER_TTL seconds and post_save adds accounts created in this
+    process; numbers above the highest account number seen at build time always go to the database,
+    so new accounts created by other processes are found before the next rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._max_number = 0
+        self._built = 0.0
+
+    def _current(self):
+        with self._lock:
+            stale = time.monotonic() - self._built > settings.ACCOUNT_FILTER_TTL
+            if self._bloom is None or stale or self._bloom.count > self._bloom.capacity:
+                self._build()
+            return self._bloom, self._max_number
+
+    def _build(self):
+        from .models import Account
+        numbers = Account.objects.values_list('pk', flat=True)
+        bloom = BloomFilter(numbers.count() * 2)
+        max_number = 0
+        for number in numbers.iterator(chunk_size=10_000):
+            bloom.add(number)
+            max_number = max(max_number, number)
+        self._bloom, self._max_number, self._built = bloom, max_number, time.monotonic()
+
+    def add(self, number):
+        # Only the bits, the build-time maximum stays: another process may create numbers below this one
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(number)
+
+    def invalidate(self):
+        with self._lock:
+            self._bloom = None
+
+    def existing(self, numbers) -> set[int]:
+        from .models import Account
+        bloom, max_number = self._current()
+        parsed = {int(number) for number in numbers if str(number).isdigit()}
+        candidates = [number for number in parsed if number > max_number or number in bloom]
+        found = set()
+        for offset in range(0, len(candidates), CONFIRM_CHUNK):
+            chunk = candidates[offset:offset + CONFIRM_CHUNK]
+            found.update(Account.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+        return found
+
+    def exists(self, number) -> bool:
+        return bool(self.existing([number]))
+
+
+account_filter = AccountFilter()
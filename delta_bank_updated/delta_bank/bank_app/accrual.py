@@ -0,0 +1,135 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from . import sharding
+from .checkpoints import next_period
+from .models import Account, InterestRun, Ledger, RankRate
+from .money import from_minor, to_minor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAYS_PER_YEAR = 365
+
+
+def month_start(year, month) -> datetime:
+    return timezone.make_aware(datetime(year, month, 1))
+
+
+def _balance_day_sums(opening: dict, daily: list, days: int) -> dict:
+    """Sum of the positive and of the negative daily closing balances per account, in øre.
+
+    opening maps account to its balance before the first day, daily holds (account, day, amount)
+    for the days with postings.
+    """
+    accounts = list(opening)
+    if numpy is not None:
+        rows = {account_id: row for row, account_id in enumerate(accounts)}
+        deltas = numpy.zeros((len(accounts), days), dtype=numpy.int64)
+        if daily:
+            numpy.add.at(deltas, ([rows[account_id] for account_id, _, _ in daily], [day for _, day, _ in daily]),
+                         [amount for _, _, amount in daily])
+        closing = numpy.cumsum(deltas, axis=1) + numpy.array([opening[account_id] for account_id in accounts], dtype=numpy.int64)[:, None]
+        positive = numpy.where(closing > 0, closing, 0).sum(axis=1).tolist()
+        negative = numpy.where(closing < 0, closing, 0).sum(axis=1).tolist()
+        return {account_id: (positive[row], negative[row]) for row, account_id in enumerate(accounts)}
+    deltas = {account_id: [0] * days for account_id in accounts}
+    for account_id, day, amount in daily:
+        deltas[account_id][day] += amount
+    sums = {}
+    for account_id in accounts:
+        balance, positive, negative = opening[account_id], 0, 0
+        for delta in deltas[account_id]:
+            balance += delta
+            if balance > 0:
+                positive += balance
+            else:
+                negative += balance
+        sums[account_id] = (positive, negative)
+    return sums
+
+
+def _interest(balance_days: int, rate: Decimal) -> Decimal:
+    return from_minor(to_minor(from_minor(abs(balance_days)) * rate / 100 / DAYS_PER_YEAR))
+
+
+def _post_batch(run, accounts, rates, income_account):
+    start, end = run.period_start, run.period_end
+    days = (end - start).days
+    ids = [account_id for account_id, _ in accounts]
+    with Account.locked(*ids) as balances:
+        # Claims the batch before posting it. When another run for the same month has already moved
+        # past it, the update matches nothing and the batch is left to that run.
+        if not InterestRun.objects.filter(pk=run.pk, last_account=run.last_account).update(last_account=ids[-1]):
+            return False
+        # Current balance minus everything since the period started; the accounts are locked so both agree
+        since = dict(sharding.gather(
+            Ledger.objects.filter(account__in=ids, timestamp__gte=start).values_list('account').annotate(Sum('amount')).order_by()
+        ))
+        opening = {account_id: to_minor(balances[account_id] - since.get(account_id, Decimal(0))) for account_id in ids}
+        daily = [
+            (account_id, (day - start.date()).days, to_minor(amount))
+            for account_id, day, amount in sharding.gather(
+                Ledger.objects.filter(account__in=ids, timestamp__gte=start, timestamp__lt=end)
+                .annotate(day=TruncDate('timestamp')).values_list('account', 'day').annotate(Sum('amount')).order_by()
+            )
+        ]
+        active = {account_id for account_id, _, _ in daily}
+        sums = _balance_day_sums(opening, daily, days)
+
+        label = f'{start:%Y-%m}'
+        rows = []
+        for account_id, rank_id in accounts:
+            rate = rates[rank_id]
+            positive, negative = sums[account_id]
+            charges = [
+                (_interest(positive, rate.deposit_rate), f'Interest {label}'),
+                (-_interest(negative, rate.overdraft_rate), f'Overdraft interest {label}'),
+            ]
+            # Fees only for accounts in use, dormant empty accounts are not charged
+            if opening[account_id] or account_id in active:
+                charges.append((-rate.monthly_fee, f'Account fee {label}'))
+            for amount, text in charges:
+                if amount:
+                    unique_id = uuid.uuid1()
+                    rows.append(Ledger(account_id=account_id, transaction=unique_id, amount=amount, text=text))
+                    rows.append(Ledger(account_id=income_account.pk, transaction=unique_id, amount=-amount, text=f'{text}: {account_id}'))
+        if rows:
+            Ledger.bulk_post(rows)
+            InterestRun.objects.filter(pk=run.pk).update(postings=F('postings') + len(rows))
+    run.last_account = ids[-1]
+    run.postings += len(rows)
+    return True
+
+
+def post_interest(year, month, income_account, batch_size=10_000) -> InterestRun:
+    """Posts interest, overdraft interest and account fees for one month against income_account.
+
+    Accounts of customers whose rank has a RankRate are taken in account number order, in batches
+    that each commit together with the run's progress, so an interrupted run resumes after its last
+    batch and a finished month is not posted twice, also by two runs for the same month. Loan accounts are left out, their interest is
+    part of the installments.
+    """
+    start = month_start(year, month)
+    end = next_period(start, 'month')
+    assert end <= timezone.now(), 'Interest is only posted for complete months.'
+    run, _ = InterestRun.objects.get_or_create(period_start=start, defaults={'period_end': end})
+    if run.finished:
+        return run
+    rates = {rate.rank_id: rate for rate in RankRate.objects.all()}
+    accounts = (Account.objects.filter(user__customer__rank__in=list(rates), loan__isnull=True)
+                .order_by('pk').values_list('pk', 'user__customer__rank'))
+    while True:
+        batch = list(accounts.filter(pk__gt=run.last_account)[:batch_size])
+        if not batch:
+            break
+        if not _post_batch(run, batch, rates, income_account):
+            run.refresh_from_db()
+    InterestRun.objects.filter(pk=run.pk, finished__isnull=True).update(finished=timezone.now())
+    run.refresh_from_db()
+    return run
@@ -1,9 +1,12 @@
 from django.contrib import admin
-from .models import Rank, Customer, Account, Ledger, Message, User
+from .models import Rank, RankRate, Customer, Account, Ledger, Loan, Installment, Message, User
 # Register your models here.
 admin.site.register(Rank)
+admin.site.register(RankRate)
 admin.site.register(Customer)
 admin.site.register(Account)
 admin.site.register(Ledger)
+admin.site.register(Loan)
+admin.site.register(Installment)
 admin.site.register(Message)
 admin.site.register(User)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BankAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bank_app'
+
+    def ready(self):
+        from django.conf import settings
+        from . import signals
+        from .metrics import install_template_timing
+        if 'bank_app.metrics.MetricsMiddleware' in settings.MIDDLEWARE:
+            install_template_timing()
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.utils import timezone
+from .models import BalanceCheckpoint, CheckpointRun, Ledger
+from . import sharding
+
+PERIODS = ('day', 'month')
+
+
+def period_floor(moment: datetime, period: str) -> datetime:
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1) if period == 'month' else moment
+
+
+def next_period(moment: datetime, period: str) -> datetime:
+    if period == 'month':
+        return (moment.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return moment + timedelta(days=1)
+
+
+def recorded_since(mark: datetime) -> datetime:
+    # A posting recorded shortly before mark may have been committed after it
+    return mark - timedelta(seconds=settings.LEDGER_COMMIT_MARGIN_SECONDS)
+
+
+def _invalidate_late_postings(since, last_period_end):
+    # Postings recorded since the last run but dated before its last checkpoint make every later
+    # checkpoint of their account wrong. Returns the earliest such timestamp.
+    late = Ledger.objects.filter(timestamp__lt=last_period_end)
+    if since is not None:
+        late = late.filter(recorded_at__gte=since)
+    late = late.values_list('account').annotate(Min('timestamp')).order_by()
+    earliest = None
+    with transaction.atomic():
+        for account_id, first_late in late:
+            BalanceCheckpoint.objects.filter(account_id=account_id, period_end__gt=first_late).delete()
+            earliest = first_late if earliest is None else min(earliest, first_late)
+    return earliest
+
+
+def _opening_balances(account_ids, start):
+    latest = BalanceCheckpoint.objects.filter(account=OuterRef('account'), period_end__lte=start).order_by('-period_end')
+    checkpoints = (BalanceCheckpoint.objects.filter(account__in=account_ids, period_end__lte=start)
+                   .filter(pk=Subquery(latest.values('pk')[:1])).values_list('account', 'balance'))
+    balances = dict.fromkeys(account_ids, Decimal(0))
+    balances.update(checkpoints)
+    return balances
+
+
+def checkpoint_balances(period='day', now=None, batch_size=2000) -> int:
+    """Write checkpoints for every complete period since the last run and return how many were written.
+
+    Only accounts with postings in a period get a checkpoint for it, balance_as_of falls back to the
+    nearest earlier one. Late postings, found by when they were recorded, invalidate the affected
+    checkpoints, which are then rewritten. Every period commits on its own; the run is only recorded
+    once all are written, so an interrupted run is redone from the same postings.
+    """
+    assert period in PERIODS, f'Unknown checkpoint period: {period}'
+    # The periods are summed with one query on the database next to the accounts
+    assert not sharding.enabled(), 'Balance checkpoints are not supported on a sharded Ledger.'
+    now = now or timezone.now()
+    # Read before any posting is, the next run looks again at everything recorded from shortly before
+    recorded_until = timezone.now()
+    start = BalanceCheckpoint.objects.aggregate(Max('period_end'))['period_end__max']
+    if start is None:
+        first = Ledger.objects.aggregate(Min('timestamp'))['timestamp__min']
+        if first is None:
+            return 0
+        start = period_floor(first, period)
+    else:
+        previous = CheckpointRun.objects.order_by('-recorded_until').first()
+        earliest_late = _invalidate_late_postings(previous and recorded_since(previous.recorded_until), start)
+        if earliest_late is not None:
+            start = min(start, period_floor(earliest_late, period))
+
+    end = period_floor(now, period)
+    balances = {}
+    written = 0
+    period_start = start
+    while period_start < end:
+        period_end = next_period(period_start, period)
+        activity = dict(
+            Ledger.objects.filter(timestamp__gte=period_start, timestamp__lt=period_end)
+            .values_list('account').annotate(Sum('amount')).order_by()
+        )
+        new_accounts = [account_id for account_id in activity if account_id not in balances]
+        if new_accounts:
+            balances.update(_opening_balances(new_accounts, start))
+        checkpoints = []
+        for account_id, amount in activity.items():
+            balances[account_id] += amount
+            checkpoints.append(BalanceCheckpoint(account_id=account_id, period_end=period_end, balance=balances[account_id]))
+        with transaction.atomic():
+            BalanceCheckpoint.objects.bulk_create(
+                checkpoints, batch_size=batch_size, update_conflicts=True,
+                unique_fields=['account', 'period_end'], update_fields=['balance'],
+            )
+        written += len(checkpoints)
+        period_start = period_end
+    CheckpointRun.objects.create(recorded_until=recorded_until, checkpoints=written)
+    return written
@@ -1,2 +1,11 @@
 class InsufficientFunds(Exception):
     pass
+
+
+class HoldNotActive(Exception):
+    pass
+
+
+class SlotUnavailable(Exception):
+    # No slot of a hot account can take the posting, it is retried on the account's row lock
+    pass
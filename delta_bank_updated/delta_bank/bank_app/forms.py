@@ -1,12 +1,15 @@
+from decimal import Decimal
 from django import forms
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
 from .models import Customer, Account, Message
+from .money import MAX_DIGITS, MINOR_UNITS
 
 User = get_user_model()
 
 class TransferForm(forms.Form):
-    amount  = forms.DecimalField(label='Amount', max_digits=10)
+    amount  = forms.DecimalField(label='Amount', max_digits=MAX_DIGITS, decimal_places=MINOR_UNITS)
     debit_account = forms.ModelChoiceField(label='Debit Account', queryset=Customer.objects.none())
     debit_text = forms.CharField(label='Debit Account Text', max_length=25)
     credit_account = forms.CharField(label='Credit Account Number', max_length=20)
@@ -23,7 +26,8 @@ class TransferForm(forms.Form):
         #     self._errors['credit_account'] = self.error_class(['Credit account does not exist.'])
 
         # Ensure positive amount
-        if self.cleaned_data.get('amount') < 0:
+        amount = self.cleaned_data.get('amount')
+        if amount is not None and amount <= 0:
             self._errors['amount'] = self.error_class(['Amount must be positive.'])
 
         return self.cleaned_data
@@ -59,6 +63,35 @@ class NewAccountForm(forms.ModelForm):
         model = Account
         fields = ('name',)
 
+class LoanForm(forms.Form):
+    # The loan account is named 'Loan: <name>', which has to fit Account.name
+    name = forms.CharField(label='Name for loan', max_length=44)
+    amount = forms.DecimalField(label='Amount', min_value=Decimal('0.01'), max_digits=MAX_DIGITS, decimal_places=MINOR_UNITS)
+    installments = forms.IntegerField(label='Monthly installments', required=False, min_value=1, max_value=360)
+
+class HotAccountForm(forms.Form):
+    slots = forms.IntegerField(label='Hot Account Slots', min_value=0, max_value=64)
+
+class CustomerImportForm(forms.Form):
+    file = forms.FileField(label='Customer CSV File')
+
+    def clean_file(self):
+        # Returns the decoded lines. The whole file is checked before the import starts, a large one
+        # is pointed to the command rather than imported inside the request.
+        upload = self.cleaned_data['file']
+        if upload.size > settings.CUSTOMER_IMPORT_UPLOAD_MAX_BYTES:
+            raise forms.ValidationError(f'File larger than {settings.CUSTOMER_IMPORT_UPLOAD_MAX_BYTES // 1024} KB, '
+                                        'import it with manage.py import_customers.')
+        try:
+            lines = upload.read().decode('utf-8-sig').splitlines()
+        except UnicodeDecodeError:
+            raise forms.ValidationError('The file is not UTF-8 encoded text.')
+        # A quoted field can span lines, so this counts at least every row
+        if len(lines) - 1 > settings.CUSTOMER_IMPORT_UPLOAD_MAX_ROWS:
+            raise forms.ValidationError(f'More than {settings.CUSTOMER_IMPORT_UPLOAD_MAX_ROWS} rows, '
+                                        'import the file with manage.py import_customers.')
+        return lines
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from functools import wraps
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from .locking import retry_on_conflict
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request) -> str:
+    # A key may only be replayed for the same request, not reused for a different transfer
+    return hashlib.sha256(json.dumps(sorted(request.POST.lists())).encode()).hexdigest()
+
+
+def _replay(record, request_hash):
+    if record.request_hash != request_hash:
+        return JsonResponse({"message": f"{HEADER} was already used for a different request"}, status=422)
+    response = HttpResponse(record.content, status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+@retry_on_conflict
+def _run_and_store(view, request, key, request_hash, args, kwargs):
+    with transaction.atomic():
+        response = view(request, *args, **kwargs)
+        if response.status_code < 500 and not response.streaming:
+            IdempotencyKey.objects.create(
+                endpoint=request.path, key=key, request_hash=request_hash, status_code=response.status_code,
+                content_type=response.get('Content-Type', ''), content=response.content.decode(),
+            )
+    return response
+
+
+def idempotent(view):
+    """Makes a POST view safe to retry: a repeated Idempotency-Key gets the stored response instead of running it again.
+
+    The response is stored in the same transaction as the view's writes. A request that dies half way leaves
+    neither behind and its retry runs again; of two concurrent requests with one key, the second cannot store
+    the key, is rolled back and replays the first one's response. Failed requests (exceptions and 5xx) store nothing.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return JsonResponse({"message": f"{HEADER} is too long"}, status=400)
+        request_hash = _fingerprint(request)
+
+        record = IdempotencyKey.objects.filter(endpoint=request.path, key=key).first()
+        if record is not None:
+            return _replay(record, request_hash)
+        try:
+            return _run_and_store(view, request, key, request_hash, args, kwargs)
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(endpoint=request.path, key=key).first()
+            if record is None:
+                raise
+            return _replay(record, request_hash)
+    return wrapper
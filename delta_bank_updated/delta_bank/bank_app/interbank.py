@@ -0,0 +1,247 @@
+import asyncio
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import httpx
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .account_filter import account_filter
+from .errors import HoldNotActive, InsufficientFunds
+from .models import Account, Hold, InterbankTransfer, Ledger
+
+logger = logging.getLogger(__name__)
+
+
+class InterbankClient:
+    """HTTP client for the other banks' APIs.
+
+    All requests run on one background event loop, with one AsyncClient per bank prefix,
+    so every transfer to the same bank reuses its pool of keep-alive connections. close() shuts
+    the connections and the loop thread down again.
+    """
+
+    def __init__(self, transport=None):
+        self._transport = transport
+        self._clients = {}
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='interbank-http', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _close_clients(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for bank_client in clients:
+            await bank_client.aclose()
+
+    def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_clients(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def _client(self, prefix):
+        client = self._clients.get(prefix)
+        if client is None:
+            client = self._clients[prefix] = httpx.AsyncClient(
+                base_url=settings.BANK_URLS[prefix],
+                timeout=settings.INTERBANK_TIMEOUT,
+                limits=httpx.Limits(max_connections=settings.INTERBANK_MAX_CONNECTIONS,
+                                    max_keepalive_connections=settings.INTERBANK_MAX_CONNECTIONS),
+                transport=self._transport,
+            )
+        return client
+
+    async def _post(self, prefix, path, data, headers):
+        return await self._client(prefix).post(path, data=data, headers=headers)
+
+    def post(self, prefix, path, data, headers=None) -> httpx.Response:
+        future = asyncio.run_coroutine_threadsafe(self._post(prefix, path, data, headers), self._event_loop())
+        return future.result()
+
+
+client = InterbankClient()
+atexit.register(client.close)
+
+
+class _Superseded(Exception):
+    # Another advance() of the same transfer took the step first
+    pass
+
+
+def bank_prefix(account_number) -> str | None:
+    # None for our own accounts, otherwise the prefix of the remote bank holding the account
+    prefix = str(account_number)[:4]
+    if prefix == settings.BANK_PREFIX or prefix not in settings.BANK_URLS:
+        return None
+    return prefix
+
+
+def submit(debit_account, amount, debit_text, credit_account, credit_text) -> InterbankTransfer:
+    transfer = InterbankTransfer.objects.create(
+        debit_account=debit_account,
+        amount=amount,
+        debit_text=debit_text,
+        credit_account=credit_account,
+        credit_text=credit_text,
+    )
+    return advance(transfer)
+
+
+def advance(transfer: InterbankTransfer) -> InterbankTransfer:
+    # Runs the remaining steps from the persisted state, so it is safe to call again on a stuck transfer.
+    # Each step claims the state it started from, concurrent calls never take the same step twice.
+    prefix = bank_prefix(transfer.credit_account)
+    transfer.attempts += 1
+    try:
+        if transfer.state == InterbankTransfer.PENDING:
+            _validate(transfer, prefix)
+        if transfer.state == InterbankTransfer.VALIDATED:
+            _debit(transfer, prefix)
+        if transfer.state == InterbankTransfer.HELD:
+            _credit_held(transfer, prefix)
+        if transfer.state == InterbankTransfer.DEBITED:
+            _credit(transfer, prefix)
+    except httpx.HTTPError as error:
+        # Remote bank unreachable or slow, leave the transfer open for resume_interbank
+        transfer.error = f'{type(error).__name__}: {error}'
+        transfer.save(update_fields=['attempts', 'error', 'updated'])
+    except _Superseded:
+        transfer.refresh_from_db()
+    except HoldNotActive:
+        # The hold was committed outside the transfer after the other bank took the credit, which needs a person
+        logger.error('Interbank transfer %s: hold %s was committed elsewhere after the credit was accepted', transfer.pk, transfer.transaction)
+        try:
+            with transaction.atomic():
+                _claim(transfer)
+                _set_state(transfer, InterbankTransfer.FAILED, 'Hold committed outside the transfer after the credit was accepted.')
+        except _Superseded:
+            transfer.refresh_from_db()
+    return transfer
+
+
+def _claim(transfer):
+    # Locks the transfer's row until the step commits, provided it is still in the state this call read.
+    # A second caller waits for the lock and then finds the state moved on.
+    if not InterbankTransfer.objects.filter(pk=transfer.pk, state=transfer.state).update(updated=timezone.now()):
+        raise _Superseded
+
+
+def _set_state(transfer, state, error=''):
+    transfer.state = state
+    transfer.error = error
+    transfer.save(update_fields=['state', 'transaction', 'hold', 'attempts', 'error', 'updated'])
+
+
+def _validate(transfer, prefix):
+    if prefix is None:
+        found = account_filter.exists(transfer.credit_account)
+    else:
+        response = client.post(prefix, 'api/v1/credit_acc_validation/', {'credit_account': transfer.credit_account})
+        if response.status_code >= 500:
+            response.raise_for_status()
+        found = response.status_code == 200
+    with transaction.atomic():
+        _claim(transfer)
+        if found:
+            _set_state(transfer, InterbankTransfer.VALIDATED)
+        else:
+            _set_state(transfer, InterbankTransfer.FAILED, 'Credit account not found.')
+
+
+def _debit(transfer, prefix):
+    with transaction.atomic():
+        _claim(transfer)
+        try:
+            if prefix is None:
+                credit_account = Account.objects.get(pk=transfer.credit_account)
+                transfer.transaction = str(Ledger.transfer(
+                    transfer.amount, transfer.debit_account, transfer.debit_text, credit_account, transfer.credit_text
+                ))
+                _set_state(transfer, InterbankTransfer.COMPLETED)
+            else:
+                # Only reserved until the other bank accepts the credit, so a refusal needs no reversal
+                transfer.hold = Hold.reserve(transfer.debit_account, transfer.amount, transfer.debit_text)
+                transfer.transaction = str(transfer.hold.transaction)
+                _set_state(transfer, InterbankTransfer.HELD)
+        except InsufficientFunds:
+            _set_state(transfer, InterbankTransfer.FAILED, 'Insufficient funds for transfer.')
+
+
+def _post_credit(transfer, prefix) -> httpx.Response:
+    # Keyed by the transaction id, so a resumed transfer whose response got lost is not credited twice
+    response = client.post(prefix, 'api/v1/make_transfer/to/', {
+        'amount': str(transfer.amount),
+        'credit_account': transfer.credit_account,
+        'credit_text': transfer.credit_text,
+        'unique_id': transfer.transaction,
+    }, headers={'Idempotency-Key': transfer.transaction})
+    if response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+
+def _credit_held(transfer, prefix):
+    response = _post_credit(transfer, prefix)
+    with transaction.atomic():
+        _claim(transfer)
+        if response.status_code == 200:
+            try:
+                transfer.hold.commit()
+                _set_state(transfer, InterbankTransfer.COMPLETED)
+            except HoldNotActive:
+                # The hold ran out or was released while the other bank was unreachable, but the money has left now
+                transfer.hold.commit(force=True)
+                _set_state(transfer, InterbankTransfer.COMPLETED, 'Hold no longer active when the credit was accepted.')
+        else:
+            transfer.hold.release()
+            _set_state(transfer, InterbankTransfer.FAILED, f'Credit rejected with status {response.status_code}.')
+
+
+def _credit(transfer, prefix):
+    # Transfers debited before holds were introduced
+    response = _post_credit(transfer, prefix)
+    with transaction.atomic():
+        _claim(transfer)
+        if response.status_code == 200:
+            _set_state(transfer, InterbankTransfer.COMPLETED)
+            return
+        # The other bank refused the credit, so the money goes back to the customer
+        Ledger.transfer_to(transfer.amount, transfer.debit_account, f'Reversal: {transfer.debit_text}', transfer.transaction)
+        _set_state(transfer, InterbankTransfer.REVERSED, f'Credit rejected with status {response.status_code}.')
+
+
+def _advance_in_thread(pk):
+    try:
+        return advance(InterbankTransfer.objects.select_related('debit_account', 'hold').get(pk=pk))
+    finally:
+        connection.close()
+
+
+def resume_stuck(older_than=timedelta(minutes=1), workers=8) -> list[InterbankTransfer]:
+    # Database work runs in worker threads, the HTTP calls share the client's event loop and pools
+    stuck = InterbankTransfer.objects.filter(
+        state__in=InterbankTransfer.OPEN_STATES, updated__lt=timezone.now() - older_than
+    ).values_list('pk', flat=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_advance_in_thread, list(stuck)))
@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from weakref import WeakValueDictionary
+from django.conf import settings
+from django.db import OperationalError, connection
+from .errors import SlotUnavailable
+
+# Fallback for backends without SELECT ... FOR UPDATE (SQLite): one lock per account number,
+# dropped again once no transfer holds a reference to it.
+_account_locks = WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+# Postgres serialization failure / deadlock, SQLite writer contention
+_RETRYABLE_PGCODES = {'40001', '40P01'}
+
+
+def _lock_for(account_id):
+    with _registry_lock:
+        lock = _account_locks.get(account_id)
+        if lock is None:
+            lock = _account_locks[account_id] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def account_locks(account_ids):
+    # Always acquired in ascending account number order so two transfers can never deadlock
+    if connection.features.has_select_for_update:
+        yield
+        return
+    locks = [_lock_for(account_id) for account_id in sorted(set(account_ids))]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def is_retryable(error: OperationalError) -> bool:
+    cause = error.__cause__
+    if getattr(cause, 'pgcode', None) in _RETRYABLE_PGCODES:
+        return True
+    return 'is locked' in str(error)
+
+
+def retry_on_conflict(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = settings.TRANSFER_RETRY_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                # Inside an outer transaction the whole unit of work has to be retried by the caller
+                if attempt == attempts or connection.in_atomic_block or not is_retryable(error):
+                    raise
+                time.sleep(random.uniform(0, min(0.005 * 2 ** attempt, 0.5)))
+    return wrapper
+
+
+def slot_fallback(func):
+    # Posting through hot account slots first, and on the locked account rows if no slot can take it
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except SlotUnavailable:
+            return func(*args, **{**kwargs, 'slots': False})
+    return wrapper
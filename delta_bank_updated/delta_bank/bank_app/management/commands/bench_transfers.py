@@ -0,0 +1,71 @@
+import secrets
+import threading
+import time
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from bank_app.models import Account, Ledger
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure Ledger.transfer throughput with concurrent workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--transfers', type=int, default=200, help='Transfers per worker.')
+        parser.add_argument('--contended', action='store_true', help='Let every worker debit the same account.')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts and postings.')
+
+    def handle(self, **options):
+        workers, transfers = options['workers'], options['transfers']
+        print(f'Benchmarking transfers on {connection.vendor} ...')
+
+        user = User.objects.create_user(f'bench-{secrets.token_hex(4)}', password=None, is_active=False)
+        funding = Account.objects.create(user=user, name='Bench funding')
+        sources = [Account.objects.create(user=user, name=f'Bench source {n}') for n in range(max(workers))]
+        sinks = [Account.objects.create(user=user, name=f'Bench sink {n}') for n in range(max(workers))]
+        for source in sources:
+            Ledger.transfer(Decimal(transfers * len(workers) * max(workers)), funding, 'Bench funding', source, 'Bench funding', is_loan=True)
+        try:
+            for count in workers:
+                pairs = [(sources[0 if options['contended'] else n].pk, sinks[n].pk) for n in range(count)]
+                elapsed = self.run(pairs, transfers)
+                print(f'{count:>3} worker(s): {count * transfers / elapsed:10.1f} transfers/s ({elapsed:.2f}s)')
+            overdrawn = Account.objects.filter(pk__in=[a.pk for a in sources], booked_balance__lt=0).count()
+            if overdrawn or Account.rebuild_balances(fix=False):
+                raise CommandError('Benchmark left inconsistent balances.')
+        finally:
+            if not options['keep']:
+                accounts = [funding, *sources, *sinks]
+                Ledger.objects.filter(account__in=accounts).delete()
+                Account.objects.filter(pk__in=[a.pk for a in accounts]).delete()
+                user.delete()
+
+    def run(self, pairs, transfers):
+        barrier = threading.Barrier(len(pairs) + 1)
+        errors = []
+
+        def worker(source_pk, sink_pk):
+            try:
+                source, sink = Account.objects.get(pk=source_pk), Account.objects.get(pk=sink_pk)
+                barrier.wait()
+                for _ in range(transfers):
+                    Ledger.transfer(Decimal(1), source, 'Bench transfer', sink, 'Bench transfer')
+            except Exception as error:
+                errors.append(error)
+                barrier.abort()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=pair) for pair in pairs]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError(f'Worker failed: {errors[0]!r}')
+        return time.perf_counter() - start
@@ -0,0 +1,179 @@
+import json
+import random
+import secrets
+import statistics
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from bank_app import sharding
+from bank_app.models import Account, Customer, Ledger, Loan, Rank
+User = get_user_model()
+
+SEARCH_TERMS = ('Hansen', 'Jensen', 'Laura', 'Mads', 'example.com', '4512', 'xyz')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the ledger and customer hot paths and compare against a stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, metavar='CUSTOMERS', help='Generate a dataset of this many customers first.')
+        parser.add_argument('--postings-per-account', type=int, default=100)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--paths', nargs='+', help='Only run these paths.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Fail if a path got slower or chattier than in this results file.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p95 regression.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, **options):
+        self.random = random.Random(options['seed'])
+        if sharding.enabled():
+            raise CommandError('The benchmark reads the Ledger on the default database, unset LEDGER_SHARDS.')
+        if options['generate']:
+            call_command('generate_data', customers=options['generate'],
+                         postings_per_account=options['postings_per_account'], seed=options['seed'])
+        if not Ledger.objects.exists():
+            raise CommandError('No Ledger data, run with --generate or manage.py generate_data first.')
+
+        paths = {
+            'transfer': self.bench_transfer,
+            'balance': self.bench_balance,
+            'search': self.bench_search,
+            'make_loan': self.bench_make_loan,
+            'transaction_details': self.bench_transaction_details,
+        }
+        selected = options['paths'] or list(paths)
+        unknown = set(selected) - set(paths)
+        if unknown:
+            raise CommandError(f'Unknown path(s): {", ".join(sorted(unknown))}')
+
+        print(f'Benchmarking {", ".join(selected)} on {connection.vendor} ...')
+        self.setup()
+        try:
+            results = {name: self.measure(paths[name](), options['iterations']) for name in selected}
+        finally:
+            self.teardown()
+
+        for name, result in results.items():
+            print(f'{name:<20} p50 {result["p50_ms"]:8.3f}ms  p95 {result["p95_ms"]:8.3f}ms  '
+                  f'p99 {result["p99_ms"]:8.3f}ms  {result["ops_per_sec"]:9.1f} ops/s  {result["queries_per_op"]:5.1f} queries/op')
+
+        report = {
+            'meta': {
+                'vendor': connection.vendor,
+                'ledger_rows': Ledger.objects.count(),
+                'iterations': options['iterations'],
+                'created': timezone.now().isoformat(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def measure(self, operation, iterations):
+        for _ in range(min(10, iterations)):
+            operation()
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                operation()
+                timings.append(time.perf_counter() - start)
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'p50_ms': percentiles[49] * 1000,
+            'p95_ms': percentiles[94] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            'ops_per_sec': iterations / sum(timings),
+            'queries_per_op': len(queries) / iterations,
+        }
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{name}: p95 {before["p95_ms"]:.3f}ms -> {result["p95_ms"]:.3f}ms')
+            if result['queries_per_op'] > before['queries_per_op']:
+                regressions.append(f'{name}: {before["queries_per_op"]:.1f} -> {result["queries_per_op"]:.1f} queries/op')
+        if regressions:
+            raise CommandError('Performance regression against baseline:\n' + '\n'.join(regressions))
+        print('No regressions against baseline.')
+
+    def setup(self):
+        # Writes go to throwaway accounts owned by a benchmark customer, removed again in teardown
+        rank = Rank.objects.filter(value__gte=settings.CUSTOMER_RANK_LOAN).order_by('value').first()
+        if rank is None:
+            rank = Rank.objects.create(name=f'Bench {secrets.token_hex(2)}', value=settings.CUSTOMER_RANK_LOAN)
+        self.user = User.objects.create_user(f'bench-{secrets.token_hex(4)}', password=None, is_staff=True)
+        self.customer = Customer.objects.create(user=self.user, rank=rank, personal_id=0, phone='0')
+        funding = Account.objects.create(user=self.user, name='Bench funding')
+        self.first = Account.objects.create(user=self.user, name='Bench first')
+        self.second = Account.objects.create(user=self.user, name='Bench second')
+        Ledger.transfer(Decimal(1_000_000), funding, 'Bench funding', self.first, 'Bench funding', is_loan=True)
+        self.account_ids = list(Account.objects.values_list('pk', flat=True)[:10_000])
+        max_ledger_id = Ledger.objects.aggregate(Max('pk'))['pk__max']
+        sample = [self.random.randint(1, max_ledger_id) for _ in range(1000)]
+        self.transactions = list(Ledger.objects.filter(pk__in=sample).values_list('transaction', flat=True))
+
+    def teardown(self):
+        accounts = Account.objects.filter(user=self.user)
+        Ledger.objects.filter(account__in=accounts).delete()
+        # Installments go with their loans
+        Loan.objects.filter(account__in=accounts).delete()
+        accounts.delete()
+        self.customer.delete()
+        self.user.delete()
+
+    def bench_transfer(self):
+        # Alternating direction keeps both benchmark accounts funded
+        state = {'forward': True}
+
+        def operation():
+            debit, credit = (self.first, self.second) if state['forward'] else (self.second, self.first)
+            Ledger.transfer(Decimal(1), debit, 'Bench transfer', credit, 'Bench transfer')
+            state['forward'] = not state['forward']
+        return operation
+
+    def bench_balance(self):
+        def operation():
+            return Account.objects.get(pk=self.random.choice(self.account_ids)).balance
+        return operation
+
+    def bench_search(self):
+        def operation():
+            return list(Customer.search(self.random.choice(SEARCH_TERMS)))
+        return operation
+
+    def bench_make_loan(self):
+        def operation():
+            self.customer.make_loan(Decimal(100), 'Bench loan')
+        return operation
+
+    def bench_transaction_details(self):
+        # localhost is only allowed implicitly while DEBUG is on
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        client.force_login(self.user)
+
+        def operation():
+            url = reverse('bank_app:transaction_details', args=(self.random.choice(self.transactions),))
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} failed with status {response.status_code}.')
+        return operation
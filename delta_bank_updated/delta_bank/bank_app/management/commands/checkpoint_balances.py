@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from bank_app.checkpoints import PERIODS, checkpoint_balances
+
+
+class Command(BaseCommand):
+    help = 'Write per-account balance checkpoints for every complete period since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=PERIODS, default='day')
+
+    def handle(self, **options):
+        print(f'Writing {options["period"]} balance checkpoints ...')
+        written = checkpoint_balances(options['period'])
+        print(f'Done, {written} checkpoint(s) written.')
@@ -0,0 +1,25 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from bank_app.models import Account, Installment
+
+
+class Command(BaseCommand):
+    help = 'Collect the loan installments due on or before a date, retrying the ones that failed before.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='YYYY-MM-DD, today by default.')
+        parser.add_argument('--income-account', type=int, default=settings.BANK_INCOME_ACCOUNT)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, **options):
+        try:
+            on = date.fromisoformat(options['date']) if options['date'] else None
+            income_account = Account.objects.get(pk=options['income_account'])
+        except ValueError:
+            raise CommandError(f'Invalid date: {options["date"]}')
+        except Account.DoesNotExist:
+            raise CommandError(f'Income account {options["income_account"]} does not exist.')
+        print(f'Collecting loan repayments against {income_account} ...')
+        paid, failed = Installment.collect(income_account.pk, on, options['batch_size'])
+        print(f'Done, {paid} installment(s) paid, {failed} failed.')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from bank_app.models import AccountSlot
+
+
+class Command(BaseCommand):
+    help = 'Fold the slots of every hot account into its booked balance and spread it evenly over the slots again.'
+
+    def handle(self, **options):
+        print('Consolidating hot accounts ...')
+        count = AccountSlot.consolidate()
+        print(f'Done, {count} hot account(s) consolidated.')
@@ -15,6 +15,7 @@ class Command(BaseCommand):
         bank_user.save()
         ipo_account = Account.objects.create(user=bank_user, account_number = 80750000001, name='Bank IPO Account')
         ops_account = Account.objects.create(user=bank_user, account_number = 80750000002, name='Bank OPS Account')
+        Account.objects.create(user=bank_user, account_number = 80750000003, name='Bank Interest and Fees Account')
         Ledger.transfer(
             10_000_000,
             ipo_account,
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from bank_app.models import Hold
+
+
+class Command(BaseCommand):
+    help = 'Expire holds whose reservation ran out, freeing the funds they held.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, **options):
+        print('Expiring holds ...')
+        expired = Hold.expire_stale(options['batch_size'])
+        print(f'Done, {expired} hold(s) expired.')
@@ -0,0 +1,34 @@
+import sys
+from django.core.exceptions import BadRequest
+from django.core.management.base import BaseCommand, CommandError
+from bank_app.models import Account
+from bank_app.statements import EXPORT_FORMATS, export_lines, export_rows, parse_export_date
+
+
+class Command(BaseCommand):
+    help = 'Stream the postings of an account as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int)
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--start', help='First day to include, YYYY-MM-DD.')
+        parser.add_argument('--end', help='Last day to include, YYYY-MM-DD.')
+        parser.add_argument('--output', help='File to write, defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, **options):
+        try:
+            account = Account.objects.get(pk=options['account'])
+        except Account.DoesNotExist:
+            raise CommandError(f'Account {options["account"]} does not exist.')
+        try:
+            start, end = parse_export_date(options['start']), parse_export_date(options['end'])
+        except BadRequest as error:
+            raise CommandError(error)
+        rows = export_rows(account.movements, start, end, chunk_size=options['chunk_size'])
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            output.writelines(export_lines(rows, options['format']))
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,113 @@
+import random
+import secrets
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from bank_app.account_filter import account_filter
+from bank_app.models import Account, Customer, Ledger, Rank
+from bank_app.search import index_customers
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset of customers, accounts and balanced Ledger postings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--accounts-per-customer', type=int, default=2)
+        parser.add_argument('--postings-per-account', type=int, default=100)
+        parser.add_argument('--days', type=int, default=365, help='Spread postings over this many past days.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='keaumulig123', help='Password shared by all generated users.')
+        parser.add_argument('--prefix', help='Username prefix, random by default.')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix'] or f'gen{secrets.token_hex(2)}-'
+        start = time.perf_counter()
+        print(f'Generating {options["customers"]} customers with prefix {prefix} ...')
+
+        if not Rank.objects.exists():
+            call_command('provision')
+        ranks = list(Rank.objects.values_list('pk', flat=True))
+        # One PBKDF2 run for the whole dataset instead of one per user
+        password = make_password(options['password'])
+
+        bank_user = User.objects.create_user(f'{prefix}bank', password=None, is_active=False)
+        funding = Account.objects.create(user=bank_user, name='Generator Funding Account')
+
+        accounts = []
+        for offset in range(0, options['customers'], self.batch_size):
+            count = min(self.batch_size, options['customers'] - offset)
+            with transaction.atomic():
+                accounts += self.create_customers(prefix, offset, count, password, ranks, options['accounts_per_customer'])
+        print(f'{len(accounts)} accounts created ({time.perf_counter() - start:.1f}s)')
+
+        pairs = len(accounts) * options['postings_per_account'] // 2
+        self.create_postings(funding.pk, accounts, pairs, options['days'])
+        print(f'{pairs * 2} postings created ({time.perf_counter() - start:.1f}s)')
+
+    def create_customers(self, prefix, offset, count, password, ranks, accounts_per_customer):
+        users = User.objects.bulk_create([
+            User(
+                username=f'{prefix}{offset + n}',
+                password=password,
+                first_name=self.random.choice(FIRST_NAMES),
+                last_name=self.random.choice(LAST_NAMES),
+                email=f'{prefix}{offset + n}@example.com',
+            )
+            for n in range(count)
+        ], batch_size=self.batch_size)
+        customers = Customer.objects.bulk_create([
+            Customer(
+                user=user,
+                rank_id=self.random.choice(ranks),
+                personal_id=self.random.randint(1, 2_000_000_000),
+                phone=str(self.random.randint(20_000_000, 99_999_999)),
+            )
+            for user in users
+        ], batch_size=self.batch_size)
+        # bulk_create bypasses the signals that keep the search index in sync
+        index_customers(customers)
+        accounts = Account.objects.bulk_create([
+            Account(user=user, name='Main account' if n == 0 else f'Account {n + 1}')
+            for user in users for n in range(accounts_per_customer)
+        ], batch_size=self.batch_size)
+        for account in accounts:
+            account_filter.add(account.pk)
+        return [account.pk for account in accounts]
+
+    def amount(self, low, high):
+        return Decimal(self.random.randint(low, high)).scaleb(-2)
+
+    def create_postings(self, funding_id, accounts, pairs, days):
+        now = timezone.now()
+        span = timedelta(days=days).total_seconds()
+        for offset in range(0, pairs, self.batch_size // 2):
+            rows = []
+            for n in range(offset, min(pairs, offset + self.batch_size // 2)):
+                # The first pair of every account funds it from the bank, the rest move money between customers
+                if n < len(accounts):
+                    debit, credit, amount = funding_id, accounts[n], self.amount(100_000, 10_000_000)
+                    timestamp = now - timedelta(seconds=span)
+                else:
+                    debit, credit = self.random.sample(accounts, 2)
+                    amount = self.amount(100, 100_000)
+                    timestamp = now - timedelta(seconds=self.random.uniform(0, span))
+                unique_id = uuid.uuid1()
+                rows.append(Ledger(account_id=debit, transaction=unique_id, amount=-amount, timestamp=timestamp, text='Generated transfer'))
+                rows.append(Ledger(account_id=credit, transaction=unique_id, amount=amount, timestamp=timestamp, text='Generated transfer'))
+            Ledger.bulk_post(rows, batch_size=self.batch_size)
+
+
+FIRST_NAMES = ('Anna', 'Bo', 'Clara', 'Emil', 'Freja', 'Ida', 'Karl', 'Laura', 'Mads', 'Noah', 'Oscar', 'Sofie')
+LAST_NAMES = ('Hansen', 'Jensen', 'Larsen', 'Madsen', 'Nielsen', 'Olsen', 'Pedersen', 'Raben', 'Smith', 'Thomsen')
@@ -0,0 +1,30 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from bank_app.onboarding import IMPORT_FIELDS, import_customers
+
+
+class Command(BaseCommand):
+    help = f'Import customers with their users and accounts from a CSV file with the columns {", ".join(IMPORT_FIELDS)}.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, help='Password hashing processes, one per CPU by default.')
+        parser.add_argument('--errors', help='Write the rejected rows to this CSV file instead of printing them.')
+
+    def handle(self, **options):
+        print(f'Importing customers from {options["file"]} ...')
+        try:
+            with open(options['file'], newline='', encoding='utf-8-sig') as lines:
+                report = import_customers(lines, options['batch_size'], options['workers'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        if options['errors']:
+            with open(options['errors'], 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(('line', 'username', 'error'))
+                writer.writerows((error.line, error.username, error.error) for error in report.errors)
+        else:
+            for error in report.errors:
+                print(f'Line {error.line}: {error.username}: {error.error}')
+        print(f'Done, {report.customers} customer(s) with {report.accounts} account(s) created, {len(report.errors)} row(s) rejected.')
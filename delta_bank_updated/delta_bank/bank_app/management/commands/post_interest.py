@@ -0,0 +1,34 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from bank_app.accrual import post_interest
+from bank_app.models import Account
+
+
+def previous_month() -> str:
+    today = date.today()
+    return f'{today.year - 1}-12' if today.month == 1 else f'{today.year}-{today.month - 1:02}'
+
+
+class Command(BaseCommand):
+    help = 'Post interest, overdraft interest and account fees for one month, resuming an interrupted run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', default=previous_month(), help='YYYY-MM, the previous month by default.')
+        parser.add_argument('--income-account', type=int, default=settings.BANK_INCOME_ACCOUNT)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, **options):
+        try:
+            year, month = (int(part) for part in options['month'].split('-'))
+            income_account = Account.objects.get(pk=options['income_account'])
+        except ValueError:
+            raise CommandError(f'Invalid month: {options["month"]}')
+        except Account.DoesNotExist:
+            raise CommandError(f'Income account {options["income_account"]} does not exist.')
+        print(f'Posting interest and fees for {options["month"]} against {income_account} ...')
+        try:
+            run = post_interest(year, month, income_account, options['batch_size'])
+        except AssertionError as error:
+            raise CommandError(error)
+        print(f'Done, {run.postings} postings.')
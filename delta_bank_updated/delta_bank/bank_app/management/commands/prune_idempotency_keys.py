@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from bank_app.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than the replay window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.IDEMPOTENCY_KEY_TTL, help='Age in seconds.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, **options):
+        print('Pruning idempotency keys ...')
+        pruned = IdempotencyKey.prune(timedelta(seconds=options['older_than']), options['batch_size'])
+        print(f'Done, {pruned} key(s) pruned.')
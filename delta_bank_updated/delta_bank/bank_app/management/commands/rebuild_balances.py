@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from bank_app.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Recompute the booked balance of every account from the Ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report mismatches, do not fix them.')
+
+    def handle(self, **options):
+        verify = options['verify']
+        print('Verifying balances ...' if verify else 'Rebuilding balances ...')
+        with transaction.atomic():
+            mismatches = Account.rebuild_balances(fix=not verify)
+        for pk, booked, actual in mismatches:
+            print(f'{pk}: booked {booked} != ledger {actual}')
+        if verify and mismatches:
+            raise CommandError(f'{len(mismatches)} account balance(s) out of sync.')
+        print(f'Done, {len(mismatches)} mismatch(es).')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from bank_app.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Repopulate the customer search index from the customer and user tables.'
+
+    def handle(self, **options):
+        print('Rebuilding customer search index ...')
+        with transaction.atomic():
+            count = rebuild_index()
+        print(f'Indexed {count} customer(s).')
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from bank_app.checkpoints import recorded_since
+from bank_app.models import ReconciliationRun
+from bank_app.reconciliation import numpy, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Check that every Ledger transaction sums to zero and that one-sided interbank legs pair up.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='Only check postings since the last run, and what it left open.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes, 1 runs in this process.')
+        parser.add_argument('--chunk-size', type=int, default=500_000, help='Ledger ids per unit of work.')
+        parser.add_argument('--counterpart', help="The other bank's report, to pair one-sided interbank legs.")
+        parser.add_argument('--output', help='Write the report as JSON to this file.')
+        parser.add_argument('--strict', action='store_true', help='Also fail on orphaned one-sided legs.')
+
+    def handle(self, **options):
+        previous = ReconciliationRun.objects.order_by('-pk').first() if options['incremental'] else None
+        counterpart = None
+        if options['counterpart']:
+            with open(options['counterpart']) as counterpart_file:
+                counterpart = json.load(counterpart_file)
+
+        print(f'Reconciling {"postings since " + str(previous.created) if previous else "the whole Ledger"} '
+              f'with {options["workers"]} worker(s){"" if numpy else ", without NumPy"} ...')
+        start = time.perf_counter()
+        recorded_until = timezone.now()
+        report = reconcile(
+            high_water_marks=previous.high_water_marks if previous else None,
+            recheck=previous.open_transactions if previous else (),
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            counterpart=counterpart,
+            recorded_since=recorded_since(previous.recorded_until) if previous else None,
+        )
+        seconds = time.perf_counter() - start
+        ReconciliationRun.objects.create(
+            recorded_until=recorded_until,
+            incremental=previous is not None,
+            postings=report['postings'],
+            high_water_marks=report['high_water_marks'],
+            open_transactions=[group['transaction'] for group in report['unbalanced']] + report['orphaned'],
+            unbalanced=len(report['unbalanced']),
+            orphaned=len(report['orphaned']),
+        )
+        print(f'{report["postings"]} postings in {seconds:.1f}s: {len(report["unbalanced"])} unbalanced, '
+              f'{len(report["one_sided"])} one-sided of which {len(report["orphaned"])} orphaned.')
+        for group in report['unbalanced']:
+            print(f'Unbalanced {group["transaction"]}: {group["amount"]}')
+
+        if options['output']:
+            report['meta'] = {'created': timezone.now().isoformat(), 'incremental': previous is not None, 'seconds': seconds}
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if report['unbalanced'] or (options['strict'] and report['orphaned']):
+            raise CommandError('The Ledger does not reconcile.')
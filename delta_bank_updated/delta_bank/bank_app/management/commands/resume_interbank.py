@@ -0,0 +1,18 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from bank_app import interbank
+
+
+class Command(BaseCommand):
+    help = 'Drive interbank transfers that stopped half way to completion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=60, help='Only transfers idle for this many seconds.')
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, **options):
+        print('Resuming interbank transfers ...')
+        transfers = interbank.resume_stuck(timedelta(seconds=options['older_than']), options['workers'])
+        for transfer in transfers:
+            print(transfer)
+        print(f'Done, {sum(not transfer.is_open for transfer in transfers)} of {len(transfers)} settled.')
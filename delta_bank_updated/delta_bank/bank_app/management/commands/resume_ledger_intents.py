@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from bank_app import sharding
+
+
+class Command(BaseCommand):
+    help = 'Write the Ledger rows of sharded postings whose second phase did not finish.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=60, help='Only intents older than this many seconds.')
+
+    def handle(self, **options):
+        print('Resuming ledger intents ...')
+        count = sharding.resume_pending(timedelta(seconds=options['older_than']))
+        print(f'Done, {count} intent(s) applied.')
@@ -0,0 +1,22 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the default SQLite database onto the SQLite replicas in DATABASE_REPLICAS, for local replica testing.'
+
+    def handle(self, **options):
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite replicas are synced here, use the database\'s own replication otherwise.')
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            name = connections[alias].settings_dict['NAME']
+            connections[alias].close()
+            print(f'Copying {primary.settings_dict["NAME"]} to {name} ...')
+            # The backup API gives a consistent copy even while the primary is being written to
+            with sqlite3.connect(name) as replica:
+                primary.connection.backup(replica)
+        print(f'Done, {len(settings.DATABASE_REPLICAS)} replica(s) synced.')
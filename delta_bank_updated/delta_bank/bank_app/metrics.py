@@ -0,0 +1,188 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from django.template import base as template_base
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, float('inf'))
+SERIES = {
+    'request_seconds': SECONDS_BUCKETS,
+    'sql_seconds': SECONDS_BUCKETS,
+    'sql_queries': COUNT_BUCKETS,
+    'template_seconds': SECONDS_BUCKETS,
+}
+SLOT_SECONDS = 60
+
+_current = ContextVar('bank_metrics_request', default=None)
+
+
+class Histogram:
+    """Bucketed histogram with cumulative totals for Prometheus and per-minute slots for a rolling window."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.slots = deque()
+
+    def observe(self, value, now):
+        index = bisect_left(self.buckets, value)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        slot = int(now // SLOT_SECONDS)
+        if not self.slots or self.slots[-1][0] != slot:
+            self.slots.append((slot, [0] * len(self.buckets)))
+            while self.slots[0][0] <= slot - settings.METRICS_WINDOW // SLOT_SECONDS:
+                self.slots.popleft()
+        self.slots[-1][1][index] += 1
+
+    def window(self, now):
+        oldest = int(now // SLOT_SECONDS) - settings.METRICS_WINDOW // SLOT_SECONDS
+        counts = [0] * len(self.buckets)
+        for slot, slot_counts in self.slots:
+            if slot > oldest:
+                counts = [a + b for a, b in zip(counts, slot_counts)]
+        return counts
+
+    def quantile(self, counts, q):
+        # Upper bound of the bucket holding the q-th observation
+        total = sum(counts)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            if running >= q * total:
+                return bound if bound != float('inf') else None
+        return None
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, values):
+        now = time.time()
+        with self.lock:
+            series = self.views.get(view)
+            if series is None:
+                series = self.views[view] = {name: Histogram(buckets) for name, buckets in SERIES.items()}
+            for name, value in values.items():
+                series[name].observe(value, now)
+
+    def as_json(self):
+        now = time.time()
+        with self.lock:
+            result = {}
+            for view, series in sorted(self.views.items()):
+                result[view] = {}
+                for name, histogram in series.items():
+                    window = histogram.window(now)
+                    result[view][name] = {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'window_count': sum(window),
+                        'p50': histogram.quantile(window, 0.5),
+                        'p95': histogram.quantile(window, 0.95),
+                        'p99': histogram.quantile(window, 0.99),
+                    }
+            return result
+
+    def as_prometheus(self):
+        lines = []
+        with self.lock:
+            for name in SERIES:
+                lines.append(f'# TYPE bank_{name} histogram')
+                for view, series in sorted(self.views.items()):
+                    histogram = series[name]
+                    running = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        running += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'bank_{name}_bucket{{view="{view}",le="{le}"}} {running}')
+                    lines.append(f'bank_{name}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'bank_{name}_count{{view="{view}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _RequestMetrics:
+    __slots__ = ('sql_count', 'sql_seconds', 'template_seconds', 'template_depth')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    current = _current.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if current is not None:
+            current.sql_count += 1
+            current.sql_seconds += time.perf_counter() - start
+
+
+_template_render = template_base.Template.render
+
+
+def _timed_render(self, context):
+    current = _current.get()
+    if current is None:
+        return _template_render(self, context)
+    # Only the outermost template is timed, included and extended templates are part of it
+    current.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        current.template_depth -= 1
+        if not current.template_depth:
+            current.template_seconds += time.perf_counter() - start
+
+
+def install_template_timing():
+    # Patched once from BankAppConfig.ready(), a render outside a request goes straight through
+    if template_base.Template.render is not _timed_render:
+        template_base.Template.render = _timed_render
+
+
+class MetricsMiddleware:
+    """Records wall time, SQL query count and time, and template render time per URL name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current = _RequestMetrics()
+        token = _current.set(current)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_sql_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        match = getattr(request, 'resolver_match', None)
+        registry.record(match.view_name if match else '<unresolved>', {
+            'request_seconds': time.perf_counter() - start,
+            'sql_seconds': current.sql_seconds,
+            'sql_queries': current.sql_count,
+            'template_seconds': current.template_seconds,
+        })
+        return response
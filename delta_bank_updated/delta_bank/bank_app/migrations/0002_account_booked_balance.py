@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-18 06:54
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_balances(apps, schema_editor):
+    Account = apps.get_model('bank_app', 'Account')
+    Ledger = apps.get_model('bank_app', 'Ledger')
+    db = schema_editor.connection.alias
+    totals = Ledger.objects.using(db).values_list('account').annotate(models.Sum('amount')).order_by()
+    for account_id, total in totals.iterator(chunk_size=2000):
+        Account.objects.using(db).filter(pk=account_id).update(booked_balance=total or Decimal(0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='booked_balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), editable=False, max_digits=14),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0002_account_booked_balance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['account', 'timestamp', 'id'], name='ledger_account_timestamp_idx'),
+        ),
+    ]
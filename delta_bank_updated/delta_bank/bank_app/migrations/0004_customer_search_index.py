@@ -0,0 +1,62 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:31
+
+from django.db import migrations
+
+# The index as it was created here, later changes to bank_app.search belong in a migration of their own
+SQLITE_CREATE = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS bank_app_customer_search '
+    'USING fts5(username, first_name, last_name, email, personal_id, phone, tokenize="trigram")',
+]
+SQLITE_FILL = (
+    'INSERT INTO bank_app_customer_search (rowid, username, first_name, last_name, email, personal_id, phone) '
+    'SELECT c.user_id, u.username, u.first_name, u.last_name, u.email, CAST(c.personal_id AS TEXT), c.phone '
+    'FROM bank_app_customer c JOIN bank_app_user u ON u.id = c.user_id'
+)
+SQLITE_DROP = ['DROP TABLE IF EXISTS bank_app_customer_search']
+
+POSTGRES_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS bank_app_user_username_trgm ON bank_app_user USING gin ((username::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_user_first_name_trgm ON bank_app_user USING gin ((first_name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_user_last_name_trgm ON bank_app_user USING gin ((last_name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_user_email_trgm ON bank_app_user USING gin ((email::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_customer_phone_trgm ON bank_app_customer USING gin ((phone::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_customer_personal_id_trgm ON bank_app_customer USING gin ((personal_id::text) gin_trgm_ops)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS bank_app_user_username_trgm',
+    'DROP INDEX IF EXISTS bank_app_user_first_name_trgm',
+    'DROP INDEX IF EXISTS bank_app_user_last_name_trgm',
+    'DROP INDEX IF EXISTS bank_app_user_email_trgm',
+    'DROP INDEX IF EXISTS bank_app_customer_phone_trgm',
+    'DROP INDEX IF EXISTS bank_app_customer_personal_id_trgm',
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+        schema_editor.execute(SQLITE_FILL)
+    elif vendor == 'postgresql':
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = SQLITE_DROP if vendor == 'sqlite' else POSTGRES_DROP if vendor == 'postgresql' else []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0003_ledger_account_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
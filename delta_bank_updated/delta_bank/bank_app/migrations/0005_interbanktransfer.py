@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0004_customer_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterbankTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('credit_account', models.CharField(max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('debit_text', models.CharField(max_length=25)),
+                ('credit_text', models.CharField(max_length=25)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('validated', 'Validated'), ('debited', 'Debited'), ('completed', 'Completed'), ('reversed', 'Reversed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('transaction', models.CharField(blank=True, max_length=50)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('debit_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='bank_app.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'updated'], name='interbank_state_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0005_interbanktransfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('last_ledger_id', models.BigIntegerField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='bank_app.account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'period_end'), name='checkpoint_account_period_end_uniq'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:12
+
+import uuid
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 5000
+# Remote banks could send any string as unique_id, those are mapped to a stable name based UUID
+LEGACY_NAMESPACE = uuid.UUID('0f6c2d4e-8075-4b8a-9c1e-5d3a7b2e8075')
+
+
+def _batches(Ledger, db, source):
+    last_pk = 0
+    while True:
+        rows = list(Ledger.objects.using(db).filter(pk__gt=last_pk).order_by('pk').only('pk', source)[:BATCH_SIZE])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1].pk
+
+
+def text_to_uuid(apps, schema_editor):
+    Ledger = apps.get_model('bank_app', 'Ledger')
+    db = schema_editor.connection.alias
+    for rows in _batches(Ledger, db, 'transaction'):
+        for row in rows:
+            try:
+                row.transaction_uuid = uuid.UUID(row.transaction)
+            except ValueError:
+                row.transaction_uuid = uuid.uuid5(LEGACY_NAMESPACE, row.transaction)
+        with transaction.atomic(using=db):
+            Ledger.objects.using(db).bulk_update(rows, ['transaction_uuid'])
+
+
+def uuid_to_text(apps, schema_editor):
+    Ledger = apps.get_model('bank_app', 'Ledger')
+    db = schema_editor.connection.alias
+    for rows in _batches(Ledger, db, 'transaction_uuid'):
+        for row in rows:
+            row.transaction = str(row.transaction_uuid)
+        with transaction.atomic(using=db):
+            Ledger.objects.using(db).bulk_update(rows, ['transaction'])
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own so a large ledger is not converted in one huge transaction
+    atomic = False
+
+    dependencies = [
+        ('bank_app', '0006_balancecheckpoint'),
+    ]
+
+    operations = [
+        # Nullable while converting, so the column can be added back and filled again when unapplied
+        migrations.AlterField(
+            model_name='ledger',
+            name='transaction',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledger',
+            name='transaction_uuid',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(text_to_uuid, uuid_to_text),
+        migrations.RemoveField(
+            model_name='ledger',
+            name='transaction',
+        ),
+        migrations.RenameField(
+            model_name='ledger',
+            old_name='transaction_uuid',
+            new_name='transaction',
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='transaction',
+            field=models.UUIDField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:05
+
+from decimal import Decimal
+import bank_app.money
+from django.db import migrations, models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+BATCH_SIZE = 20000
+MONEY_FIELDS = (('ledger', 'amount'), ('account', 'booked_balance'), ('balancecheckpoint', 'balance'))
+
+
+def _convert(apps, db, to_minor):
+    for model_name, name in MONEY_FIELDS:
+        model = apps.get_model('bank_app', model_name)
+        if to_minor:
+            # Rounded before the cast, SQLite keeps the old decimals as floats
+            source, target = name, f'{name}_minor'
+            value = Cast(Round(F(source) * 100), models.BigIntegerField())
+        else:
+            source, target = f'{name}_minor', name
+            value = F(source) / 100.0
+        # Keyset batches, account numbers are far from contiguous
+        last_pk = None
+        while True:
+            rows = model.objects.using(db).order_by('pk')
+            if last_pk is not None:
+                rows = rows.filter(pk__gt=last_pk)
+            upper = list(rows.values_list('pk', flat=True)[BATCH_SIZE - 1:BATCH_SIZE])
+            if upper:
+                rows = rows.filter(pk__lte=upper[0])
+            with transaction.atomic(using=db):
+                rows.update(**{target: value})
+            if not upper:
+                break
+            last_pk = upper[0]
+
+
+def decimal_to_minor(apps, schema_editor):
+    _convert(apps, schema_editor.connection.alias, to_minor=True)
+
+
+def minor_to_decimal(apps, schema_editor):
+    _convert(apps, schema_editor.connection.alias, to_minor=False)
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own so a large ledger is not converted in one huge transaction
+    atomic = False
+
+    dependencies = [
+        ('bank_app', '0007_ledger_transaction_uuid'),
+    ]
+
+    operations = [
+        *[
+            migrations.AddField(model_name=model_name, name=f'{name}_minor', field=models.BigIntegerField(null=True))
+            for model_name, name in MONEY_FIELDS
+        ],
+        # Nullable while converting, so unapplying can add the decimal columns back before refilling them
+        migrations.AlterField(
+            model_name='ledger',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='account',
+            name='booked_balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), editable=False, max_digits=14, null=True),
+        ),
+        migrations.AlterField(
+            model_name='balancecheckpoint',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.RunPython(decimal_to_minor, minor_to_decimal),
+        *[
+            migrations.RemoveField(model_name=model_name, name=name)
+            for model_name, name in MONEY_FIELDS
+        ],
+        *[
+            migrations.RenameField(model_name=model_name, old_name=f'{name}_minor', new_name=name)
+            for model_name, name in MONEY_FIELDS
+        ],
+        migrations.AlterField(
+            model_name='ledger',
+            name='amount',
+            field=bank_app.money.MoneyField(),
+        ),
+        migrations.AlterField(
+            model_name='account',
+            name='booked_balance',
+            field=bank_app.money.MoneyField(default=Decimal('0'), editable=False),
+        ),
+        migrations.AlterField(
+            model_name='balancecheckpoint',
+            name='balance',
+            field=bank_app.money.MoneyField(),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:29
+
+import bank_app.money
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0008_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='interbanktransfer',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('validated', 'Validated'), ('held', 'Held'), ('debited', 'Debited'), ('completed', 'Completed'), ('reversed', 'Reversed'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction', models.UUIDField(default=uuid.uuid1, unique=True)),
+                ('amount', bank_app.money.MoneyField()),
+                ('text', models.TextField()),
+                ('state', models.CharField(choices=[('active', 'Active'), ('committed', 'Committed'), ('released', 'Released'), ('expired', 'Expired')], default='active', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField()),
+                ('settled', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='holds', to='bank_app.account')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='interbanktransfer',
+            name='hold',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='bank_app.hold'),
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('state', 'active')), fields=['account', 'expires', 'amount'], name='hold_active_account_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('state', 'active')), fields=['expires'], name='hold_active_expires_idx'),
+        ),
+    ]
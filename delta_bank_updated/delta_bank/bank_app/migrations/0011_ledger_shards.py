@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedIntent',
+            fields=[
+                ('intent_id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('postings', models.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('applied', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='account',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, to='bank_app.account'),
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:49
+
+import bank_app.money
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0011_ledger_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='hot_slots',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='AccountSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('balance', bank_app.money.MoneyField(default=Decimal('0'))),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='bank_app.account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='accountslot',
+            constraint=models.UniqueConstraint(fields=('account', 'slot'), name='account_slot_uniq'),
+        ),
+    ]
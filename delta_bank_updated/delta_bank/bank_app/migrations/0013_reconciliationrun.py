@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0012_account_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('incremental', models.BooleanField(default=False)),
+                ('postings', models.BigIntegerField()),
+                ('high_water_marks', models.JSONField()),
+                ('open_transactions', models.JSONField(default=list)),
+                ('unbalanced', models.IntegerField()),
+                ('orphaned', models.IntegerField()),
+            ],
+        ),
+    ]
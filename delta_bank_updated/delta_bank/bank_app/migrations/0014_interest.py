@@ -0,0 +1,36 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:56
+
+import bank_app.money
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0013_reconciliationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateTimeField(unique=True)),
+                ('period_end', models.DateTimeField()),
+                ('last_account', models.BigIntegerField(default=0)),
+                ('postings', models.IntegerField(default=0)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RankRate',
+            fields=[
+                ('rank', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rate', serialize=False, to='bank_app.rank')),
+                ('deposit_rate', models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=6)),
+                ('overdraft_rate', models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=6)),
+                ('monthly_fee', bank_app.money.MoneyField(default=Decimal('0'))),
+            ],
+        ),
+    ]
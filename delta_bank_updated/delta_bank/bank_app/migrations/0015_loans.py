@@ -0,0 +1,65 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:59
+
+import bank_app.money
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+def register_legacy_loans(apps, schema_editor):
+    # Loans made before there were schedules were only recognisable by their account name
+    db = schema_editor.connection.alias
+    Account = apps.get_model('bank_app', 'Account')
+    Loan = apps.get_model('bank_app', 'Loan')
+    accounts = Account.objects.using(db)
+    loans = []
+    for account in accounts.filter(name__startswith='Loan:').iterator(chunk_size=2000):
+        repay_account = accounts.filter(user_id=account.user_id).exclude(name__startswith='Loan:').order_by('pk').first()
+        loans.append(Loan(account=account, repay_account=repay_account or account, principal=max(-account.booked_balance, Decimal(0)),
+                          rate=Decimal(0), installments=0))
+    Loan.objects.using(db).bulk_create(loans, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0014_interest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Loan',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, primary_key=True, related_name='loan', serialize=False, to='bank_app.account')),
+                ('principal', bank_app.money.MoneyField()),
+                ('rate', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('installments', models.PositiveSmallIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('repay_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='repaid_loans', to='bank_app.account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Installment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('due', models.DateField()),
+                ('principal', bank_app.money.MoneyField()),
+                ('interest', bank_app.money.MoneyField()),
+                ('state', models.CharField(choices=[('scheduled', 'Scheduled'), ('paid', 'Paid'), ('failed', 'Failed')], default='scheduled', max_length=10)),
+                ('transaction', models.UUIDField(blank=True, null=True)),
+                ('paid', models.DateTimeField(blank=True, null=True)),
+                ('failures', models.PositiveSmallIntegerField(default=0)),
+                ('last_failure', models.DateTimeField(blank=True, null=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='bank_app.loan')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('paid__isnull', True)), fields=['due', 'id'], name='installment_open_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='installment',
+            constraint=models.UniqueConstraint(fields=('loan', 'number'), name='installment_loan_number_uniq'),
+        ),
+        migrations.RunPython(register_legacy_loans, migrations.RunPython.noop),
+    ]
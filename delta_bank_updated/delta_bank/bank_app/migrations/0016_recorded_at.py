@@ -0,0 +1,96 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:20
+
+from django.db import migrations, models, transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+
+BATCH_SIZE = 20000
+
+
+def copy_timestamps(apps, schema_editor):
+    # Existing postings count as recorded when they were made, in keyset batches like 0008
+    Ledger = apps.get_model('bank_app', 'Ledger')
+    db = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        rows = Ledger.objects.using(db).filter(pk__gt=last_pk).order_by('pk')
+        upper = list(rows.values_list('pk', flat=True)[BATCH_SIZE - 1:BATCH_SIZE])
+        if upper:
+            rows = rows.filter(pk__lte=upper[0])
+        with transaction.atomic(using=db):
+            rows.update(recorded_at=F('timestamp'))
+        if not upper:
+            break
+        last_pk = upper[0]
+
+
+def record_checkpoint_run(apps, schema_editor):
+    # The postings after the old id high water mark are the ones the next run has to look at
+    BalanceCheckpoint = apps.get_model('bank_app', 'BalanceCheckpoint')
+    CheckpointRun = apps.get_model('bank_app', 'CheckpointRun')
+    Ledger = apps.get_model('bank_app', 'Ledger')
+    db = schema_editor.connection.alias
+    high_water_mark = BalanceCheckpoint.objects.using(db).aggregate(Max('last_ledger_id'))['last_ledger_id__max']
+    if high_water_mark is None:
+        return
+    first_unseen = Ledger.objects.using(db).filter(pk__gt=high_water_mark).aggregate(Min('recorded_at'))['recorded_at__min']
+    CheckpointRun.objects.using(db).create(recorded_until=first_unseen or timezone.now(), checkpoints=0)
+
+
+def copy_run_created(apps, schema_editor):
+    ReconciliationRun = apps.get_model('bank_app', 'ReconciliationRun')
+    ReconciliationRun.objects.using(schema_editor.connection.alias).update(recorded_until=F('created'))
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own so a large ledger is not updated in one huge transaction
+    atomic = False
+
+    dependencies = [
+        ('bank_app', '0015_loans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledger',
+            name='recorded_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_timestamps, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ledger',
+            name='recorded_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='CheckpointRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('recorded_until', models.DateTimeField()),
+                ('checkpoints', models.IntegerField()),
+            ],
+        ),
+        migrations.RunPython(record_checkpoint_run, migrations.RunPython.noop),
+        # A default so unapplying can add the column back to existing rows
+        migrations.AlterField(
+            model_name='balancecheckpoint',
+            name='last_ledger_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RemoveField(
+            model_name='balancecheckpoint',
+            name='last_ledger_id',
+        ),
+        migrations.AddField(
+            model_name='reconciliationrun',
+            name='recorded_until',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_run_created, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reconciliationrun',
+            name='recorded_until',
+            field=models.DateTimeField(),
+        ),
+    ]
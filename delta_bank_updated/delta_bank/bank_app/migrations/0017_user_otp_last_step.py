@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank_app', '0016_recorded_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='otp_last_step',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:05
+
+import bank_app.money
+from django.db import migrations, models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+BATCH_SIZE = 20000
+
+
+def _convert(apps, db, to_minor):
+    # Same conversion as 0008, in keyset batches that commit on their own
+    InterbankTransfer = apps.get_model('bank_app', 'InterbankTransfer')
+    if to_minor:
+        # Rounded before the cast, SQLite keeps the old decimals as floats
+        target, value = 'amount_minor', Cast(Round(F('amount') * 100), models.BigIntegerField())
+    else:
+        target, value = 'amount', F('amount_minor') / 100.0
+    last_pk = 0
+    while True:
+        rows = InterbankTransfer.objects.using(db).filter(pk__gt=last_pk).order_by('pk')
+        upper = list(rows.values_list('pk', flat=True)[BATCH_SIZE - 1:BATCH_SIZE])
+        if upper:
+            rows = rows.filter(pk__lte=upper[0])
+        with transaction.atomic(using=db):
+            rows.update(**{target: value})
+        if not upper:
+            break
+        last_pk = upper[0]
+
+
+def decimal_to_minor(apps, schema_editor):
+    _convert(apps, schema_editor.connection.alias, to_minor=True)
+
+
+def minor_to_decimal(apps, schema_editor):
+    _convert(apps, schema_editor.connection.alias, to_minor=False)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bank_app', '0017_user_otp_last_step'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interbanktransfer',
+            name='amount_minor',
+            field=models.BigIntegerField(null=True),
+        ),
+        # Nullable while converting, so unapplying can add the decimal column back before refilling it
+        migrations.AlterField(
+            model_name='interbanktransfer',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(decimal_to_minor, minor_to_decimal),
+        migrations.RemoveField(
+            model_name='interbanktransfer',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='interbanktransfer',
+            old_name='amount_minor',
+            new_name='amount',
+        ),
+        migrations.AlterField(
+            model_name='interbanktransfer',
+            name='amount',
+            field=bank_app.money.MoneyField(),
+        ),
+    ]
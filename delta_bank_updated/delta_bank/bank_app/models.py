@@ -1,11 +1,23 @@
 from __future__ import annotations
+import itertools
+import random
+from contextlib import contextmanager
+import calendar
+from datetime import date, timedelta
 from decimal import Decimal
 from django.conf import settings
-from django.db import models, transaction
-from django.db.models import Q
+from django.db import models, transaction, connection
+from django.db.models import Q, F, Value
 from django.db.models.query import QuerySet
 from django.contrib.auth.models import User, AbstractUser
-from .errors import InsufficientFunds
+from django.utils import timezone
+from .errors import HoldNotActive, InsufficientFunds, SlotUnavailable
+from .search import search_customers
+from .locking import account_locks, retry_on_conflict, slot_fallback
+from .money import MoneyField, from_minor, to_minor
+from . import sharding
+from .statements import StatementPage, statement_page
+from .transfers import TransferRequest, TransferResult
 from django_otp.models import Device
 
 import uuid
@@ -15,6 +27,8 @@ class User(AbstractUser):
     otp_verified = models.BooleanField(default=False)
     otp_base32 = models.CharField(max_length=255, null=True)
     otp_auth_url = models.CharField(max_length=255, null=True)
+    # TOTP time step of the last accepted code, a code is only accepted for a later step
+    otp_last_step = models.BigIntegerField(null=True, editable=False)
 
 class Rank(models.Model):
     name        = models.CharField(max_length=35, unique=True, db_index=True)
@@ -28,6 +42,17 @@ class Rank(models.Model):
         return f'{self.value}:{self.name}'
 
 
+class RankRate(models.Model):
+    # Yearly percentages accrued on each day's closing balance, and a fee per account and month
+    rank           = models.OneToOneField(Rank, primary_key=True, on_delete=models.CASCADE, related_name='rate')
+    deposit_rate   = models.DecimalField(max_digits=6, decimal_places=3, default=Decimal(0))
+    overdraft_rate = models.DecimalField(max_digits=6, decimal_places=3, default=Decimal(0))
+    monthly_fee    = MoneyField(default=Decimal(0))
+
+    def __str__(self):
+        return f'{self.rank} :: {self.deposit_rate}% / {self.overdraft_rate}% :: {self.monthly_fee}'
+
+
 class Customer(models.Model):
     user        = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, on_delete=models.PROTECT)
     rank        = models.ForeignKey(Rank, default=2, on_delete=models.PROTECT)
@@ -40,7 +65,8 @@ class Customer(models.Model):
 
     @property
     def accounts(self) -> QuerySet:
-        return Account.objects.filter(user=self.user)
+        # Balances are a column on Account, so listing accounts with balances is a single query
+        return Account.objects.filter(user_id=self.user_id).select_related('user').order_by('pk')
 
     @property
     def can_make_loan(self) -> bool:
@@ -48,31 +74,28 @@ class Customer(models.Model):
 
     @property
     def default_account(self) -> Account:
-        return Account.objects.filter(user=self.user).first()
+        return self.accounts.first()
 
-    def make_loan(self, amount, name):
+    def make_loan(self, amount, name, installments=None) -> Loan:
         assert self.can_make_loan, 'User rank does not allow for making loans.'
         assert amount >= 0, 'Negative amount not allowed for loan.'
-        loan = Account.objects.create(user=self.user, name=f'Loan: {name}')
-        Ledger.transfer(
-            amount,
-            loan,
-            f'Loan paid out to account {self.default_account}',
-            self.default_account,
-            f'Credit from loan {loan.pk}: {loan.name}',
-            is_loan=True
-        )
+        default_account = self.default_account
+        with transaction.atomic():
+            account = Account.objects.create(user=self.user, name=f'Loan: {name}')
+            loan = Loan.open(account, default_account, amount, Decimal(settings.LOAN_RATE), installments or settings.LOAN_INSTALLMENTS)
+            Ledger.transfer(
+                amount,
+                account,
+                f'Loan paid out to account {default_account}',
+                default_account,
+                f'Credit from loan {account.pk}: {account.name}',
+                is_loan=True
+            )
+        return loan
 
     @classmethod
     def search(cls, search_term):
-        return cls.objects.filter(
-            Q(user__username__contains=search_term)   |
-            Q(user__first_name__contains=search_term) |
-            Q(user__last_name__contains=search_term)  |
-            Q(user__email__contains=search_term)      |
-            Q(personal_id__contains=search_term)      |
-            Q(phone__contains=search_term)
-        )[:15]
+        return search_customers(cls.objects.all(), search_term, 15)
 
     def __str__(self):
         return f'{self.personal_id}: {self.full_name}'
@@ -82,66 +105,710 @@ class Account(models.Model):
     account_number = models.AutoField(primary_key=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
     name = models.CharField(max_length=50, db_index=True)
+    # Running total of the account's Ledger postings, maintained by Ledger.save
+    booked_balance = MoneyField(default=Decimal(0), editable=False)
+    # Hot accounts spread their postings over this many AccountSlot rows instead of locking this row
+    hot_slots = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         get_latest_by = 'pk'
 
     @property
     def movements(self) -> QuerySet:
-        return Ledger.objects.filter(account=self)
+        return sharding.for_account(Ledger.objects.filter(account=self), self.pk)
 
     @property
     def balance(self) -> Decimal:
+        if self.hot_slots:
+            # Slots move without this row and are spread back into it, so both are read fresh
+            return self.refresh_balance() + AccountSlot.totals([self.pk]).get(self.pk, Decimal(0))
+        return self.booked_balance
+
+    def statement(self, cursor=None, limit=None) -> StatementPage:
+        return statement_page(self.movements, cursor, limit or settings.STATEMENT_PAGE_SIZE)
+
+    def refresh_balance(self) -> Decimal:
+        self.booked_balance = Account.objects.filter(pk=self.pk).values_list('booked_balance', flat=True).get()
+        return self.booked_balance
+
+    def available_balance(self) -> Decimal:
+        # Booked balance minus the funds reserved by active holds
+        return self.balance - Hold.held_totals([self.pk]).get(self.pk, Decimal(0))
+
+    def ledger_balance(self) -> Decimal:
         return self.movements.aggregate(models.Sum('amount'))['amount__sum'] or Decimal(0)
 
+    def balance_as_of(self, timestamp) -> Decimal:
+        # Nearest checkpoint at or before the timestamp, plus only the postings made since then
+        checkpoint = self.checkpoints.filter(period_end__lte=timestamp).order_by('-period_end').first()
+        movements = self.movements.filter(timestamp__lte=timestamp)
+        if checkpoint is None:
+            return movements.aggregate(models.Sum('amount'))['amount__sum'] or Decimal(0)
+        since = movements.filter(timestamp__gte=checkpoint.period_end).aggregate(models.Sum('amount'))['amount__sum']
+        return checkpoint.balance + (since or Decimal(0))
+
+    @classmethod
+    @contextmanager
+    def locked(cls, *account_ids):
+        # Row locks taken in account number order, held until commit; yields the locked booked balances
+        with account_locks(account_ids), transaction.atomic():
+            locked = cls.objects.filter(pk__in=account_ids)
+            if connection.features.has_select_for_update:
+                locked = locked.select_for_update().order_by('pk')
+            else:
+                # Write first so SQLite takes its write lock up front and queues competing writers
+                locked.update(booked_balance=F('booked_balance'))
+            rows = list(locked.values_list('pk', 'booked_balance', 'hot_slots'))
+            balances = {pk: booked for pk, booked, _ in rows}
+            hot = [pk for pk, _, slots in rows if slots]
+            if hot:
+                # A locked hot account has its slots folded in, so the booked balance is the whole balance
+                for pk, total in AccountSlot.fold(hot).items():
+                    balances[pk] += total
+            yield balances
+            if hot:
+                AccountSlot.spread(hot)
+
+    def make_hot(self, slots):
+        # 0 slots makes it a normal account again
+        with Account.locked(self.pk):
+            AccountSlot.objects.filter(account=self).delete()
+            AccountSlot.objects.bulk_create([AccountSlot(account=self, slot=slot) for slot in range(slots)])
+            Account.objects.filter(pk=self.pk).update(hot_slots=slots)
+            AccountSlot.spread([self.pk])
+        self.hot_slots = slots
+
+    @classmethod
+    def apply_deltas(cls, deltas: dict):
+        # One prepared UPDATE run for every touched account instead of one save() per posting
+        quote = connection.ops.quote_name
+        table, pk = quote(cls._meta.db_table), quote(cls._meta.pk.column)
+        column = quote(cls._meta.get_field('booked_balance').column)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET {column} = {column} + %s WHERE {pk} = %s',
+                [(to_minor(delta), pk) for pk, delta in deltas.items() if delta],
+            )
+
+    @classmethod
+    def rebuild_balances(cls, fix=True) -> list:
+        mismatches = []
+        # An account's postings are all on one shard, so the per-shard totals are complete
+        totals = dict(sharding.gather(Ledger.objects.values_list('account').annotate(models.Sum('amount')).order_by()))
+        slots = AccountSlot.totals()
+        for pk, booked in cls.objects.values_list('pk', 'booked_balance').iterator(chunk_size=2000):
+            booked += slots.get(pk, Decimal(0))
+            actual = totals.get(pk) or Decimal(0)
+            if booked != actual:
+                mismatches.append((pk, booked, actual))
+                if fix:
+                    cls.objects.filter(pk=pk).update(booked_balance=actual)
+                    AccountSlot.objects.filter(account_id=pk).update(balance=Decimal(0))
+        return mismatches
+
     def __str__(self):
         return f'{self.pk} :: {self.user} :: {self.name}'
 
 
+_round_robin = itertools.count()
+
+
+class AccountSlot(models.Model):
+    """Part of a hot account's balance, such as the bank's payout account.
+
+    Postings to a hot account move one slot chosen per posting instead of the account row, so
+    concurrent postings do not queue on a single row lock. A debit with a funds check only takes a
+    slot that covers it on its own, otherwise it falls back to locking the account, which folds all
+    slots into the booked balance. Consolidation spreads the balance evenly over the slots again.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='slots')
+    slot    = models.PositiveSmallIntegerField()
+    balance = MoneyField(default=Decimal(0))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'slot'], name='account_slot_uniq'),
+        ]
+
+    @classmethod
+    def totals(cls, account_ids=None) -> dict:
+        slots = cls.objects.all() if account_ids is None else cls.objects.filter(account_id__in=account_ids)
+        return dict(slots.values_list('account').annotate(models.Sum('balance')).order_by())
+
+    @classmethod
+    def pick(cls, account, amount=None) -> int:
+        # Slots are tried from a random or the next round-robin one. With an amount the slot has to
+        # cover the debit and stays locked until commit.
+        start = next(_round_robin) if settings.HOT_ACCOUNT_SLOT_CHOICE == 'round_robin' else random.randrange(account.hot_slots)
+        order = [(start + n) % account.hot_slots for n in range(account.hot_slots)]
+        if amount is None:
+            return order[0]
+        for slot in order:
+            if cls.objects.filter(account_id=account.pk, slot=slot, balance__gte=amount).update(balance=F('balance')):
+                # Held funds are only checked against the whole balance, on the locked path
+                if Hold.held_totals([account.pk]):
+                    break
+                return slot
+        raise SlotUnavailable
+
+    @classmethod
+    def move(cls, account_id, slot, amount):
+        if not cls.objects.filter(account_id=account_id, slot=slot).update(balance=F('balance') + Value(amount, output_field=MoneyField())):
+            # The account stopped being hot after the caller loaded it
+            raise SlotUnavailable
+
+    @classmethod
+    def fold(cls, account_ids) -> dict:
+        slots = cls.objects.filter(account_id__in=account_ids)
+        if connection.features.has_select_for_update:
+            list(slots.select_for_update().order_by('pk').values_list('pk'))
+        totals = cls.totals(account_ids)
+        Account.apply_deltas(totals)
+        slots.update(balance=Decimal(0))
+        return totals
+
+    @classmethod
+    def spread(cls, account_ids):
+        # Even shares of the whole balance, so each slot can pay out on its own. Only while the
+        # accounts and their slots are locked.
+        totals = cls.totals(account_ids)
+        for pk, booked, slots in Account.objects.filter(pk__in=account_ids).values_list('pk', 'booked_balance', 'hot_slots'):
+            total = booked + totals.get(pk, Decimal(0))
+            share = from_minor(to_minor(total) // slots) if slots and total > 0 else Decimal(0)
+            cls.objects.filter(account_id=pk).update(balance=share)
+            Account.objects.filter(pk=pk).update(booked_balance=total - share * slots)
+
+    @classmethod
+    def consolidate(cls) -> int:
+        hot = list(Account.objects.filter(hot_slots__gt=0).values_list('pk', flat=True))
+        for pk in hot:
+            cls._consolidate(pk)
+        return len(hot)
+
+    @staticmethod
+    @retry_on_conflict
+    def _consolidate(account_id):
+        with Account.locked(account_id):
+            pass
+
+    def __str__(self):
+        return f'{self.account_id} :: {self.slot} :: {self.balance}'
+
+
 class Ledger(models.Model):
-    account     = models.ForeignKey(Account, on_delete=models.PROTECT)
-    transaction = models.CharField(max_length=50)
-    amount      = models.DecimalField(max_digits=10, decimal_places=2)
-    timestamp   = models.DateTimeField(auto_now_add=True, db_index=True)
+    # No foreign key constraint, the rows may live on a shard without the accounts (see sharding.py).
+    # Every database gets the same schema from the migrations, so this holds unsharded too; the ORM
+    # still protects an account with postings from deletion.
+    account     = models.ForeignKey(Account, on_delete=models.PROTECT, db_constraint=False)
+    transaction = models.UUIDField(db_index=True)
+    amount      = MoneyField()
+    # Set when the posting is made rather than on insert, which is later on a sharded ledger
+    timestamp   = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
     text        = models.TextField()
+    # Set on insert, late postings are found by it (see checkpoints.py and reconciliation.py)
+    recorded_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'timestamp', 'id'], name='ledger_account_timestamp_idx'),
+        ]
 
     #Bruges internt til overførelser i samme bank
     @classmethod
-    def transfer(cls, amount, debit_account, debit_text, credit_account, credit_text, is_loan=False) -> int:
+    @retry_on_conflict
+    @slot_fallback
+    def transfer(cls, amount, debit_account, debit_text, credit_account, credit_text, is_loan=False, slots=True) -> int:
         assert amount >= 0, 'Negative amount not allowed for transfer.'
-        with transaction.atomic():
-            if debit_account.balance >= amount or is_loan:
-                unique_id = uuid.uuid1()
-                cls(amount=-amount, transaction=unique_id, account=debit_account, text=debit_text).save()
-                cls(amount=amount, transaction=unique_id, account=credit_account, text=credit_text).save()
+        hot = {account.pk for account in (debit_account, credit_account) if slots and account.hot_slots}
+        with Account.locked(*{debit_account.pk, credit_account.pk} - hot) as balances:
+            if debit_account.pk in hot:
+                debit_slot = AccountSlot.pick(debit_account, None if is_loan else amount)
             else:
-                raise InsufficientFunds
+                debit_slot = None
+                debit_account.booked_balance = balances[debit_account.pk]
+                if not is_loan and debit_account.available_balance() < amount:
+                    raise InsufficientFunds
+            unique_id = uuid.uuid1()
+            cls(amount=-amount, transaction=unique_id, account=debit_account, text=debit_text).save(slot=debit_slot)
+            credit_slot = AccountSlot.pick(credit_account) if credit_account.pk in hot else None
+            cls(amount=amount, transaction=unique_id, account=credit_account, text=credit_text).save(slot=credit_slot)
         return unique_id
 
+    #Mange overførelser i én databasetransaktion, fx lønudbetalinger fra bankens OPS konto
+    @classmethod
+    @retry_on_conflict
+    def bulk_transfer(cls, transfers: list[TransferRequest], atomic=True, batch_size=1000) -> list[TransferResult]:
+        for transfer in transfers:
+            assert transfer.amount >= 0, 'Negative amount not allowed for transfer.'
+        results = [TransferResult(index) for index in range(len(transfers))]
+        debit_ids = {transfer.debit_account.pk for transfer in transfers}
+        credit_ids = {transfer.credit_account.pk for transfer in transfers}
+        with Account.locked(*debit_ids, *credit_ids) as balances:
+            held = Hold.held_totals(debit_ids)
+            available = {pk: balances[pk] - held.get(pk, Decimal(0)) for pk in debit_ids}
+            rows = []
+            for result, transfer in zip(results, transfers):
+                debit_pk, credit_pk = transfer.debit_account.pk, transfer.credit_account.pk
+                if available[debit_pk] < transfer.amount:
+                    result.error = 'Insufficient funds for transfer.'
+                    continue
+                available[debit_pk] -= transfer.amount
+                if credit_pk in available:
+                    available[credit_pk] += transfer.amount
+                result.unique_id = uuid.uuid1()
+                rows.append(cls(amount=-transfer.amount, transaction=result.unique_id, account_id=debit_pk, text=transfer.debit_text))
+                rows.append(cls(amount=transfer.amount, transaction=result.unique_id, account_id=credit_pk, text=transfer.credit_text))
+            if atomic and any(not result.ok for result in results):
+                for result in results:
+                    result.unique_id = None
+                return results
+            cls.bulk_post(rows, batch_size=batch_size)
+        return results
+
     #modtager penge
     @classmethod
-    def transfer_to(cls, amount, credit_account, credit_text, unique_id):
+    @retry_on_conflict
+    @slot_fallback
+    def transfer_to(cls, amount, credit_account, credit_text, unique_id, slots=True):
         assert amount >= 0, 'Negative amount not allowed for transfer.'
-        cls(amount=amount, transaction=unique_id, account=credit_account, text=credit_text).save()
+        if slots and credit_account.hot_slots:
+            with transaction.atomic():
+                cls(amount=amount, transaction=unique_id, account=credit_account, text=credit_text).save(slot=AccountSlot.pick(credit_account))
+            return
+        with Account.locked(credit_account.pk):
+            cls(amount=amount, transaction=unique_id, account=credit_account, text=credit_text).save()
     
     #sender penge
     @classmethod
-    def transfer_from(cls, amount, debit_account, debit_text, is_loan=False) -> int:
+    @retry_on_conflict
+    @slot_fallback
+    def transfer_from(cls, amount, debit_account, debit_text, is_loan=False, slots=True) -> int:
 
         assert amount >= 0, 'Negative amount not allowed for transfer.'
-        
-        if debit_account.balance >= amount or is_loan:
-            unique_id = uuid.uuid1()
-            cls(amount=-amount, transaction=unique_id, account=debit_account, text=debit_text).save()           
-        else:
-            raise InsufficientFunds
+
+        if slots and debit_account.hot_slots:
+            with transaction.atomic():
+                unique_id = uuid.uuid1()
+                debit_slot = AccountSlot.pick(debit_account, None if is_loan else amount)
+                cls(amount=-amount, transaction=unique_id, account=debit_account, text=debit_text).save(slot=debit_slot)
+            return unique_id
+
+        with Account.locked(debit_account.pk) as balances:
+            debit_account.booked_balance = balances[debit_account.pk]
+            if is_loan or debit_account.available_balance() >= amount:
+                unique_id = uuid.uuid1()
+                cls(amount=-amount, transaction=unique_id, account=debit_account, text=debit_text).save()
+            else:
+                raise InsufficientFunds
         return unique_id
 
+    #Mange posteringer på én gang, i kaldets databasetransaktion
+    @classmethod
+    def bulk_post(cls, rows, batch_size=1000):
+        if sharding.enabled():
+            return sharding.post(rows)
+        deltas = {}
+        for row in rows:
+            deltas[row.account_id] = deltas.get(row.account_id, 0) + row.amount
+        with transaction.atomic():
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+            Account.apply_deltas(deltas)
+
+    def save(self, *args, slot=None, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # New postings move the account's booked balance, or the given slot of a hot account, in the same transaction
+        with transaction.atomic():
+            if slot is not None:
+                AccountSlot.move(self.account_id, slot, self.amount)
+            if sharding.enabled():
+                sharding.post([self], book=slot is None)
+            else:
+                super().save(*args, **kwargs)
+                if slot is None:
+                    Account.objects.filter(pk=self.account_id).update(booked_balance=F('booked_balance') + Value(self.amount, output_field=MoneyField()))
+            if slot is None and Ledger.account.is_cached(self):
+                self.account.booked_balance += self.amount
+
     def __str__(self):
         return f'{self.amount} :: {self.transaction} :: {self.timestamp} :: {self.account} :: {self.text}'
 
+class LedgerIntent(models.Model):
+    # Phase one of a sharded posting, kept on the default database until every shard has the rows
+    postings = models.JSONField()
+    created  = models.DateTimeField(auto_now_add=True)
+    applied  = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.pk} :: {len(self.postings)} posting(s) :: {self.applied or "pending"}'
+
+
+class AppliedIntent(models.Model):
+    # Written on a shard in the same transaction as the intent's rows there
+    intent_id = models.BigIntegerField(primary_key=True)
+
+
+class BalanceCheckpoint(models.Model):
+    # Balance of all postings to the account with a timestamp before period_end
+    account        = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='checkpoints')
+    period_end     = models.DateTimeField()
+    balance        = MoneyField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'period_end'], name='checkpoint_account_period_end_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.account_id} :: {self.period_end} :: {self.balance}'
+
+
+class CheckpointRun(models.Model):
+    # A finished checkpoint_balances run, which saw every posting recorded before recorded_until
+    created        = models.DateTimeField(auto_now_add=True)
+    recorded_until = models.DateTimeField()
+    checkpoints    = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.created} :: {self.checkpoints} checkpoints'
+
+
+class Hold(models.Model):
+    """Funds reserved on an account until the transfer they belong to is committed, released or expires."""
+    ACTIVE    = 'active'
+    COMMITTED = 'committed'
+    RELEASED  = 'released'
+    EXPIRED   = 'expired'
+    STATES = [(state, state.capitalize()) for state in (ACTIVE, COMMITTED, RELEASED, EXPIRED)]
+
+    account     = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='holds')
+    transaction = models.UUIDField(unique=True, default=uuid.uuid1)
+    amount      = MoneyField()
+    text        = models.TextField()
+    state       = models.CharField(max_length=10, choices=STATES, default=ACTIVE)
+    created     = models.DateTimeField(auto_now_add=True)
+    expires     = models.DateTimeField()
+    settled     = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only active holds are summed or swept, so settled holds never enter these indexes
+            models.Index(fields=['account', 'expires', 'amount'], condition=Q(state='active'), name='hold_active_account_idx'),
+            models.Index(fields=['expires'], condition=Q(state='active'), name='hold_active_expires_idx'),
+        ]
+
+    @classmethod
+    def active(cls, now=None) -> QuerySet:
+        # Expired holds stop counting right away, even before expire_holds has swept them
+        return cls.objects.filter(state=cls.ACTIVE, expires__gt=now or timezone.now())
+
+    @classmethod
+    def held_totals(cls, account_ids) -> dict:
+        return dict(cls.active().filter(account_id__in=account_ids).values_list('account').annotate(models.Sum('amount')).order_by())
+
+    #reserverer penge til en overførelse der afsluttes senere
+    @classmethod
+    @retry_on_conflict
+    def reserve(cls, account, amount, text, ttl=None) -> Hold:
+        assert amount >= 0, 'Negative amount not allowed for hold.'
+        with Account.locked(account.pk) as balances:
+            account.booked_balance = balances[account.pk]
+            if account.available_balance() < amount:
+                raise InsufficientFunds
+            expires = timezone.now() + timedelta(seconds=ttl or settings.HOLD_TTL)
+            return cls.objects.create(account=account, amount=amount, text=text, expires=expires)
+
+    @retry_on_conflict
+    def commit(self, credit_account=None, credit_text=None, force=False) -> uuid.UUID:
+        # Posts the held amount under the hold's transaction id. force also commits an expired or released
+        # hold, for when the money has already left the bank and the debit has to be booked regardless.
+        states = (self.ACTIVE, self.EXPIRED, self.RELEASED) if force else (self.ACTIVE,)
+        now = timezone.now()
+        with Account.locked(self.account_id, *([credit_account.pk] if credit_account else [])):
+            holds = Hold.objects.filter(pk=self.pk, state__in=states)
+            if not force:
+                holds = holds.filter(expires__gt=now)
+            if not holds.update(state=self.COMMITTED, settled=now):
+                raise HoldNotActive
+            Ledger(amount=-self.amount, transaction=self.transaction, account_id=self.account_id, text=self.text).save()
+            if credit_account is not None:
+                Ledger(amount=self.amount, transaction=self.transaction, account=credit_account, text=credit_text).save()
+        self.state, self.settled = self.COMMITTED, now
+        return self.transaction
+
+    def release(self) -> bool:
+        now = timezone.now()
+        if not Hold.objects.filter(pk=self.pk, state=self.ACTIVE).update(state=self.RELEASED, settled=now):
+            return False
+        self.state, self.settled = self.RELEASED, now
+        return True
+
+    @classmethod
+    def expire_stale(cls, batch_size=1000, now=None) -> int:
+        now = now or timezone.now()
+        expired = 0
+        while True:
+            with transaction.atomic():
+                batch = list(cls.objects.filter(state=cls.ACTIVE, expires__lte=now).values_list('pk', flat=True)[:batch_size])
+                if not batch:
+                    return expired
+                expired += cls.objects.filter(pk__in=batch, state=cls.ACTIVE).update(state=cls.EXPIRED, settled=now)
+
+    def __str__(self):
+        return f'{self.transaction} :: {self.account_id} :: {self.amount} :: {self.state}'
+
+
+class InterbankTransfer(models.Model):
+    PENDING   = 'pending'
+    VALIDATED = 'validated'
+    HELD      = 'held'
+    DEBITED   = 'debited'
+    COMPLETED = 'completed'
+    REVERSED  = 'reversed'
+    FAILED    = 'failed'
+    STATES = [(state, state.capitalize()) for state in (PENDING, VALIDATED, HELD, DEBITED, COMPLETED, REVERSED, FAILED)]
+    OPEN_STATES = (PENDING, VALIDATED, HELD, DEBITED)
+
+    debit_account  = models.ForeignKey(Account, on_delete=models.PROTECT)
+    credit_account = models.CharField(max_length=20)
+    amount         = MoneyField()
+    debit_text     = models.CharField(max_length=25)
+    credit_text    = models.CharField(max_length=25)
+    state          = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    transaction    = models.CharField(max_length=50, blank=True)
+    hold           = models.OneToOneField(Hold, on_delete=models.PROTECT, null=True, blank=True)
+    attempts       = models.IntegerField(default=0)
+    error          = models.TextField(blank=True)
+    created        = models.DateTimeField(auto_now_add=True)
+    updated        = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'updated'], name='interbank_state_updated_idx'),
+        ]
+
+    @property
+    def is_open(self) -> bool:
+        return self.state in self.OPEN_STATES
+
+    def __str__(self):
+        return f'{self.pk} :: {self.debit_account_id} -> {self.credit_account} :: {self.amount} :: {self.state}'
+
+
+class IdempotencyKey(models.Model):
+    # Stored response of an API request, replayed when a client retries it with the same Idempotency-Key
+    endpoint     = models.CharField(max_length=100)
+    key          = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code  = models.IntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    content      = models.TextField(blank=True)
+    created      = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'key'], name='idempotency_endpoint_key_uniq'),
+        ]
+
+    @classmethod
+    def prune(cls, older_than: timedelta, batch_size=1000) -> int:
+        cutoff = timezone.now() - older_than
+        pruned = 0
+        while True:
+            batch = list(cls.objects.filter(created__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return pruned
+            pruned += cls.objects.filter(pk__in=batch).delete()[0]
+
+    def __str__(self):
+        return f'{self.endpoint} :: {self.key} :: {self.status_code}'
+
+
+def _add_months(day: date, months: int) -> date:
+    # Same day of the month, or the last day of a shorter month
+    year, month = divmod(day.month - 1 + months, 12)
+    year, month = day.year + year, month + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+class Loan(models.Model):
+    """A loan paid out from its own account, which stays negative by what is still owed.
+
+    The whole amortization schedule is stored as Installment rows when the loan is opened, and
+    collect_repayments books the installments from repay_account as they fall due.
+    """
+    account       = models.OneToOneField(Account, primary_key=True, on_delete=models.PROTECT, related_name='loan')
+    repay_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='repaid_loans')
+    principal     = MoneyField()
+    # Yearly percentage, charged monthly on the remaining principal
+    rate          = models.DecimalField(max_digits=6, decimal_places=3)
+    installments  = models.PositiveSmallIntegerField()
+    created       = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def amortize(principal, rate, installments) -> list[tuple[Decimal, Decimal]]:
+        # Annuity: equal monthly payments of (principal, interest), the last one takes the rounding rest
+        monthly = rate / 100 / 12
+        if monthly:
+            payment = from_minor(to_minor(principal * monthly / (1 - (1 + monthly) ** -installments)))
+        else:
+            payment = from_minor(to_minor(principal / installments))
+        schedule = []
+        remaining = principal
+        for number in range(installments):
+            interest = from_minor(to_minor(remaining * monthly))
+            repaid = remaining if number == installments - 1 else min(payment - interest, remaining)
+            remaining -= repaid
+            schedule.append((repaid, interest))
+        return schedule
+
+    @classmethod
+    def open(cls, account, repay_account, principal, rate, installments, first_due=None) -> Loan:
+        assert installments > 0, 'A loan needs at least one installment.'
+        first_due = first_due or _add_months(timezone.localdate(), 1)
+        with transaction.atomic():
+            loan = cls.objects.create(account=account, repay_account=repay_account, principal=principal, rate=rate, installments=installments)
+            Installment.objects.bulk_create([
+                Installment(loan=loan, number=number + 1, due=_add_months(first_due, number), principal=repaid, interest=interest)
+                for number, (repaid, interest) in enumerate(cls.amortize(principal, rate, installments))
+            ])
+        return loan
+
+    def __str__(self):
+        return f'{self.account} :: {self.principal} :: {self.rate}% :: {self.installments} installments'
+
+
+class Installment(models.Model):
+    SCHEDULED = 'scheduled'
+    PAID      = 'paid'
+    FAILED    = 'failed'
+    STATES = [(state, state.capitalize()) for state in (SCHEDULED, PAID, FAILED)]
+    # Failed installments stay unpaid and are tried again by the next repayment run
+
+    loan         = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='schedule')
+    number       = models.PositiveSmallIntegerField()
+    due          = models.DateField()
+    principal    = MoneyField()
+    interest     = MoneyField()
+    state        = models.CharField(max_length=10, choices=STATES, default=SCHEDULED)
+    transaction  = models.UUIDField(null=True, blank=True)
+    paid         = models.DateTimeField(null=True, blank=True)
+    failures     = models.PositiveSmallIntegerField(default=0)
+    last_failure = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'number'], name='installment_loan_number_uniq'),
+        ]
+        indexes = [
+            # Paid installments, most of the table, never enter the index the repayment run reads. The
+            # condition has no parameters, so SQLite can match it against the query too.
+            models.Index(fields=['due', 'id'], condition=Q(paid__isnull=True), name='installment_open_due_idx'),
+        ]
+
+    @property
+    def amount(self) -> Decimal:
+        return self.principal + self.interest
+
+    @classmethod
+    def collect(cls, income_account_id, on=None, batch_size=5000) -> tuple[int, int]:
+        """Books the open installments due on or before on (today), returns (paid, failed).
+
+        Installments are read oldest due first in keyset batches from the open due index, so a
+        loan's earlier installments are collected before its later ones. Each batch locks its
+        repayment accounts, checks their available balance installment by installment and books the
+        repayments with one bulk_post: principal to the loan account, interest to income_account_id.
+        Installments an account cannot cover are marked failed.
+        """
+        due = (cls.objects.filter(paid__isnull=True, due__lte=on or timezone.localdate()).order_by('due', 'pk')
+               .values_list('due', 'pk', 'number', 'loan', 'loan__repay_account', 'principal', 'interest'))
+        paid = failed = 0
+        batch = list(due[:batch_size])
+        while batch:
+            last_due, last_pk = batch[-1][:2]
+            batch_paid, batch_failed = cls._collect_batch([row[1:] for row in batch], income_account_id)
+            paid += batch_paid
+            failed += batch_failed
+            batch = list(due.filter(Q(due__gt=last_due) | Q(due=last_due, pk__gt=last_pk))[:batch_size])
+        return paid, failed
+
+    @classmethod
+    @retry_on_conflict
+    def _collect_batch(cls, batch, income_account_id) -> tuple[int, int]:
+        now = timezone.now()
+        repay_ids = {repay_id for _, _, _, repay_id, _, _ in batch}
+        with Account.locked(*repay_ids) as balances:
+            held = Hold.held_totals(repay_ids)
+            available = {pk: balances[pk] - held.get(pk, Decimal(0)) for pk in repay_ids}
+            rows, paid, failed = [], [], []
+            for pk, number, loan_id, repay_id, principal, interest in batch:
+                amount = principal + interest
+                if available[repay_id] < amount:
+                    failed.append(pk)
+                    continue
+                available[repay_id] -= amount
+                unique_id = uuid.uuid1()
+                text = f'Installment {number} on loan {loan_id}'
+                rows.append(Ledger(account_id=repay_id, transaction=unique_id, amount=-amount, text=text))
+                rows.append(Ledger(account_id=loan_id, transaction=unique_id, amount=principal, text=text))
+                if interest:
+                    rows.append(Ledger(account_id=income_account_id, transaction=unique_id, amount=interest, text=f'{text}: interest'))
+                paid.append((pk, unique_id))
+            if rows:
+                Ledger.bulk_post(rows)
+            cls._mark_paid(paid, now)
+            cls.objects.filter(pk__in=failed).update(state=cls.FAILED, failures=F('failures') + 1, last_failure=now)
+        return len(paid), len(failed)
+
+    @classmethod
+    def _mark_paid(cls, paid, now):
+        # One prepared UPDATE run, bulk_update would build a CASE over every row of the batch
+        quote = connection.ops.quote_name
+        table, pk = quote(cls._meta.db_table), quote(cls._meta.pk.column)
+        fields = [cls._meta.get_field(name) for name in ('state', 'transaction', 'paid')]
+        state, unique_id, paid_at = (quote(field.column) for field in fields)
+        paid_value = fields[2].get_db_prep_value(now, connection)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET {state} = %s, {unique_id} = %s, {paid_at} = %s WHERE {pk} = %s',
+                [(cls.PAID, fields[1].get_db_prep_value(transaction_id, connection), paid_value, installment_id)
+                 for installment_id, transaction_id in paid],
+            )
+
+    def __str__(self):
+        return f'{self.loan_id} :: {self.number} :: {self.due} :: {self.amount} :: {self.state}'
+
+
+class InterestRun(models.Model):
+    # One per month, last_account is the end of the last batch post_interest committed
+    period_start = models.DateTimeField(unique=True)
+    period_end   = models.DateTimeField()
+    last_account = models.BigIntegerField(default=0)
+    postings     = models.IntegerField(default=0)
+    finished     = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.period_start:%Y-%m} :: {self.postings} postings :: {self.finished or f"at account {self.last_account}"}'
+
+
+class ReconciliationRun(models.Model):
+    # Where reconcile_ledger got to, so an incremental run only reads the postings added since
+    created           = models.DateTimeField(auto_now_add=True)
+    # When the run started reading, postings recorded from shortly before then are read again by the next
+    recorded_until    = models.DateTimeField()
+    incremental       = models.BooleanField(default=False)
+    postings          = models.BigIntegerField()
+    high_water_marks  = models.JSONField()
+    open_transactions = models.JSONField(default=list)
+    unbalanced        = models.IntegerField()
+    orphaned          = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.created} :: {self.postings} postings :: {self.unbalanced} unbalanced :: {self.orphaned} orphaned'
+
+
 class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    timestamp = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,54 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+MINOR_UNITS = 2
+# Digits of the largest amount with MINOR_UNITS decimals whose øre fit a BIGINT, for DecimalField form fields
+MAX_DIGITS = 18
+_CENT = Decimal(1).scaleb(-MINOR_UNITS)
+
+
+def to_minor(amount) -> int:
+    # Rounded to whole øre the same way the old DecimalField(decimal_places=2) did on save
+    return int(Decimal(amount).quantize(_CENT, rounding=ROUND_HALF_EVEN).scaleb(MINOR_UNITS))
+
+
+def from_minor(value: int) -> Decimal:
+    return Decimal(value).scaleb(-MINOR_UNITS)
+
+
+class MoneyField(models.BigIntegerField):
+    """Kroner amount stored as a BIGINT of øre.
+
+    Sums are plain integer arithmetic in the database, while the model, filters and
+    aggregates still see Decimal values with two decimal places.
+    """
+    description = 'Amount in kroner stored as integer øre'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_minor(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value))
+        except ArithmeticError:
+            raise exceptions.ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return value
+        try:
+            return to_minor(value)
+        except ArithmeticError as error:
+            raise error.__class__(f"Field '{self.name}' expected an amount but got {value!r}.") from error
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField, 'max_digits': MAX_DIGITS, 'decimal_places': MINOR_UNITS, **kwargs,
+        })
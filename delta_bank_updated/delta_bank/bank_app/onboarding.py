@@ -0,0 +1,198 @@
+from __future__ import annotations
+import csv
+import django
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from .account_filter import account_filter
+from .models import Account, Customer, Rank
+from .search import index_customers
+
+User = get_user_model()
+
+IMPORT_FIELDS = ('username', 'first_name', 'last_name', 'email', 'password', 'personal_id', 'phone', 'rank', 'accounts')
+REQUIRED_FIELDS = ('username', 'personal_id', 'phone')
+DEFAULT_ACCOUNT = 'Main account'
+
+_validate_username = UnicodeUsernameValidator()
+
+
+@dataclass
+class ImportRow:
+    line: int
+    username: str
+    first_name: str
+    last_name: str
+    email: str
+    password: str | None
+    personal_id: int
+    phone: str
+    rank_id: int
+    accounts: list[str]
+
+
+@dataclass
+class RowError:
+    line: int
+    username: str
+    error: str
+
+
+@dataclass
+class ImportReport:
+    customers: int = 0
+    accounts: int = 0
+    errors: list[RowError] = field(default_factory=list)
+
+
+def read_rows(lines):
+    """(line number, record) for every CSV record in lines, read as they come.
+
+    Raises ValueError right away when a required column is missing from the header.
+    """
+    reader = csv.DictReader(lines)
+    missing = [name for name in REQUIRED_FIELDS if name not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError(f'Missing column(s): {", ".join(missing)}.')
+    return ((reader.line_num, record) for record in reader)
+
+
+def _parse(line, record, ranks, default_rank) -> ImportRow:
+    values = {name: (record.get(name) or '').strip() for name in IMPORT_FIELDS}
+    for name in REQUIRED_FIELDS:
+        if not values[name]:
+            raise ValueError(f'Missing {name}.')
+    try:
+        _validate_username(values['username'])
+        if values['email']:
+            validate_email(values['email'])
+    except ValidationError as error:
+        raise ValueError(' '.join(error.messages))
+    if len(values['username']) > 150 or len(values['first_name']) > 150 or len(values['last_name']) > 150:
+        raise ValueError('Name too long.')
+    try:
+        personal_id = int(values['personal_id'])
+    except ValueError:
+        raise ValueError('Invalid personal_id.')
+    if len(values['phone']) > 35:
+        raise ValueError('Phone too long.')
+    rank_id = ranks.get(values['rank']) if values['rank'] else default_rank
+    if rank_id is None:
+        raise ValueError(f'Unknown rank: {values["rank"]}.' if values['rank'] else 'No rank given and no ranks set up.')
+    accounts = [name.strip() for name in values['accounts'].split(';') if name.strip()] or [DEFAULT_ACCOUNT]
+    if any(len(name) > 50 for name in accounts):
+        raise ValueError('Account name too long.')
+    return ImportRow(line, values['username'], values['first_name'], values['last_name'], values['email'],
+                     values['password'] or None, personal_id, values['phone'], rank_id, accounts)
+
+
+def _hash_passwords(passwords, executor, workers):
+    # No password gives an unusable one, the customer has to have it set by staff. On the pool the
+    # hashes are computed in the background while the caller goes on.
+    if executor is None:
+        return [make_password(password) for password in passwords]
+    return executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (4 * workers)))
+
+
+def _check_batch(batch, seen_usernames, seen_personal_ids, report) -> list[ImportRow]:
+    # One query per batch for each uniqueness check, every row is then checked against sets
+    taken_usernames = set(User.objects.filter(username__in=[row.username for row in batch]).values_list('username', flat=True))
+    taken_personal_ids = set(Customer.objects.filter(personal_id__in={row.personal_id for row in batch})
+                             .values_list('personal_id', flat=True))
+    valid = []
+    for row in batch:
+        if row.username in taken_usernames or row.username in seen_usernames:
+            report.errors.append(RowError(row.line, row.username, 'Username already exists.'))
+        elif row.personal_id in taken_personal_ids or row.personal_id in seen_personal_ids:
+            report.errors.append(RowError(row.line, row.username, 'Personal ID already registered.'))
+        else:
+            seen_usernames.add(row.username)
+            seen_personal_ids.add(row.personal_id)
+            valid.append(row)
+    return valid
+
+
+def _create_batch(valid, hashes, report):
+    try:
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=row.username, password=password, first_name=row.first_name, last_name=row.last_name, email=row.email)
+                for row, password in zip(valid, hashes)
+            ])
+            customers = Customer.objects.bulk_create([
+                Customer(user=user, rank_id=row.rank_id, personal_id=row.personal_id, phone=row.phone)
+                for row, user in zip(valid, users)
+            ])
+            # bulk_create bypasses the signals that keep the search index in sync
+            index_customers(customers)
+            accounts = Account.objects.bulk_create([
+                Account(user=user, name=name) for row, user in zip(valid, users) for name in row.accounts
+            ])
+    except IntegrityError as error:
+        # Someone created one of the usernames since the check, the batch is rolled back as a whole
+        report.errors += [RowError(row.line, row.username, f'Not imported, batch rolled back: {error}') for row in valid]
+        return
+    for account in accounts:
+        account_filter.add(account.pk)
+    report.customers += len(customers)
+    report.accounts += len(accounts)
+
+
+def import_customers(lines, batch_size=2000, workers=None) -> ImportReport:
+    """Creates customers, their users and accounts from CSV lines.
+
+    Columns are IMPORT_FIELDS, of which REQUIRED_FIELDS must be filled in. rank is a Rank name,
+    the lowest rank when empty, and accounts a ;-separated list of account names, one
+    DEFAULT_ACCOUNT when empty. Rows are read as a stream and imported in batches of batch_size:
+    checked against the existing users and customers, passwords hashed on workers processes
+    (CUSTOMER_IMPORT_WORKERS, else one per CPU), then bulk created in one transaction per batch.
+    A batch is inserted while the next one's passwords are hashed. Rejected rows are reported
+    with their line number and do not stop the import.
+    """
+    rows = read_rows(lines)
+    ranks = dict(Rank.objects.values_list('name', 'pk'))
+    default_rank = Rank.objects.order_by('value').values_list('pk', flat=True).first()
+    report = ImportReport()
+    seen_usernames, seen_personal_ids = set(), set()
+    workers = workers or settings.CUSTOMER_IMPORT_WORKERS or os.cpu_count() or 1
+    # Spawned rather than forked, so no worker inherits the caller's database connections. The
+    # workers only import the password hashers, not this module, which needs the app registry.
+    executor = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+                if workers > 1 else None)
+    pending = None
+
+    def import_batch(batch):
+        # Starts hashing this batch, then inserts the previous one; an empty batch only flushes
+        nonlocal pending
+        valid = _check_batch(batch, seen_usernames, seen_personal_ids, report) if batch else []
+        hashes = _hash_passwords([row.password for row in valid], executor, workers) if valid else None
+        if pending is not None:
+            _create_batch(*pending, report)
+        pending = (valid, hashes) if valid else None
+
+    try:
+        batch = []
+        for line, record in rows:
+            try:
+                batch.append(_parse(line, record, ranks, default_rank))
+            except ValueError as error:
+                report.errors.append(RowError(line, (record.get('username') or '').strip(), str(error)))
+            if len(batch) == batch_size:
+                import_batch(batch)
+                batch = []
+        import_batch(batch)
+        import_batch([])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    # Parse errors are reported as rows are read, the others when their batch is checked
+    report.errors.sort(key=lambda error: error.line)
+    return report
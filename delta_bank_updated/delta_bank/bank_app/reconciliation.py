@@ -0,0 +1,164 @@
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
+from . import sharding
+from .money import from_minor, to_minor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CONFIRM_CHUNK = 2000
+
+
+def _key(value) -> str:
+    # SQLite stores UUIDField as 32 hex characters, Postgres returns uuid.UUID
+    return value.hex if isinstance(value, uuid.UUID) else value
+
+
+def _sums_numpy(rows) -> dict:
+    keys = numpy.array([_key(transaction) for transaction, _ in rows])
+    amounts = numpy.fromiter((amount for _, amount in rows), dtype=numpy.int64, count=len(rows))
+    transactions, groups = numpy.unique(keys, return_inverse=True)
+    sums = numpy.zeros(len(transactions), dtype=numpy.int64)
+    numpy.add.at(sums, groups, amounts)
+    open_groups = numpy.nonzero(sums)[0]
+    return dict(zip(transactions[open_groups].tolist(), sums[open_groups].tolist()))
+
+
+def _sums_python(rows) -> dict:
+    sums = {}
+    for transaction, amount in rows:
+        key = _key(transaction)
+        sums[key] = sums.get(key, 0) + amount
+    return {key: total for key, total in sums.items() if total}
+
+
+def sum_range(db, low, high):
+    """Sums the postings with low < id <= high on one database per transaction, in øre.
+
+    Returns the number of postings and the sums that are not zero. Groups balanced within the
+    range are left out, so only groups split over ranges or actually unbalanced are sent back.
+    """
+    from .models import Ledger
+    connection = connections[db]
+    quote = connection.ops.quote_name
+    table, pk = quote(Ledger._meta.db_table), quote(Ledger._meta.pk.column)
+    transaction, amount = (quote(Ledger._meta.get_field(name).column) for name in ('transaction', 'amount'))
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {transaction}, {amount} FROM {table} WHERE {pk} > %s AND {pk} <= %s', [low, high])
+        rows = cursor.fetchall()
+    if not rows:
+        return 0, {}
+    return len(rows), (_sums_numpy if numpy is not None else _sums_python)(rows)
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _ranges(high_water_marks, chunk_size, recorded_since):
+    from .models import Ledger
+    ranges = []
+    marks = {}
+    for db in settings.LEDGER_SHARDS or ['default']:
+        mark = start = high_water_marks.get(db, 0)
+        if start and recorded_since is not None:
+            # Ids are taken on insert, a posting below the mark may have committed after the last run read past it
+            late = Ledger.objects.using(db).filter(pk__lte=start, recorded_at__gte=recorded_since).aggregate(Min('pk'))['pk__min']
+            if late is not None:
+                start = late - 1
+        end = Ledger.objects.using(db).aggregate(Max('pk'))['pk__max'] or mark
+        marks[db] = max(mark, end)
+        ranges += [(db, low, min(low + chunk_size, end)) for low in range(start, end, chunk_size)]
+    return ranges, marks
+
+
+def reconcile(high_water_marks=None, recheck=(), workers=0, chunk_size=500_000, counterpart=None, recorded_since=None) -> dict:
+    """Checks that every Ledger.transaction group sums to zero.
+
+    The ledger is read in primary key ranges after high_water_marks ({alias: last id}, empty for
+    the whole ledger), starting lower for postings recorded since recorded_since, and fanned out
+    to a process pool when workers > 1. Transactions whose partial
+    sums do not cancel out, plus the recheck ids left open by an earlier run, are then summed in
+    full. Groups with legs of both signs are unbalanced. One-sided groups are interbank legs and
+    are paired with the InterbankTransfer that made them, or with the opposite leg in the other
+    bank's report (counterpart); the rest are orphaned.
+    """
+    from .models import InterbankTransfer, Ledger
+    ranges, marks = _ranges(high_water_marks or {}, chunk_size, recorded_since)
+    candidates = {}
+    postings = 0
+
+    def merge(result):
+        nonlocal postings
+        count, sums = result
+        postings += count
+        for key, total in sums.items():
+            total += candidates.get(key, 0)
+            if total:
+                candidates[key] = total
+            else:
+                candidates.pop(key, None)
+
+    if workers > 1 and len(ranges) > 1:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            for result in executor.map(sum_range, *zip(*ranges)):
+                merge(result)
+    else:
+        for db, low, high in ranges:
+            merge(sum_range(db, low, high))
+
+    legs = {}
+    keys = list({uuid.UUID(key) for key in candidates} | {uuid.UUID(transaction) for transaction in recheck})
+    for offset in range(0, len(keys), CONFIRM_CHUNK):
+        chunk = Ledger.objects.filter(transaction__in=keys[offset:offset + CONFIRM_CHUNK])
+        for transaction, account_id, amount in sharding.gather(chunk.values_list('transaction', 'account', 'amount')):
+            legs.setdefault(transaction, []).append((account_id, amount))
+
+    counterpart_legs = {
+        uuid.UUID(leg['transaction']): to_minor(leg['amount']) for leg in (counterpart or {}).get('one_sided', [])
+    }
+    outgoing = {}
+    transfers = InterbankTransfer.objects.filter(state=InterbankTransfer.COMPLETED)
+    for offset in range(0, len(keys), CONFIRM_CHUNK):
+        chunk = [str(key) for key in keys[offset:offset + CONFIRM_CHUNK]]
+        for transaction, amount in transfers.filter(transaction__in=chunk).values_list('transaction', 'amount'):
+            outgoing[uuid.UUID(transaction)] = amount
+
+    unbalanced, one_sided = [], []
+    for transaction, group in legs.items():
+        total = sum(to_minor(amount) for _, amount in group)
+        if not total:
+            continue
+        if any(amount > 0 for _, amount in group) and any(amount < 0 for _, amount in group):
+            unbalanced.append({
+                'transaction': str(transaction),
+                'amount': str(from_minor(total)),
+                'legs': [{'account': account_id, 'amount': str(amount)} for account_id, amount in group],
+            })
+            continue
+        paired_with = None
+        if transaction in outgoing and to_minor(outgoing[transaction]) == -total:
+            paired_with = 'interbank_transfer'
+        elif counterpart_legs.get(transaction) == -total:
+            paired_with = 'counterpart'
+        one_sided.append({
+            'transaction': str(transaction),
+            'amount': str(from_minor(total)),
+            'account': group[0][0],
+            'paired_with': paired_with,
+        })
+    return {
+        'postings': postings,
+        'high_water_marks': marks,
+        'unbalanced': unbalanced,
+        'one_sided': one_sided,
+        'orphaned': [leg['transaction'] for leg in one_sided if leg['paired_with'] is None],
+    }
@@ -0,0 +1,73 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+PIN_COOKIE = 'db_pinned'
+
+_request = ContextVar('bank_routing_request', default=None)
+
+
+def read_only(view):
+    """Marks a view that only reads, so ReplicaRoutingMiddleware may serve it from a read replica.
+
+    Put it above the other decorators, it has to be on the function the URLconf points at.
+    """
+    view.read_only = True
+    return view
+
+
+class _RequestRouting:
+    __slots__ = ('use_replica', 'wrote')
+
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """Sends reads of read_only views to settings.DATABASE_REPLICAS and everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        current = _request.get()
+        if current is None or not current.use_replica or not settings.DATABASE_REPLICAS:
+            return 'default'
+        # Reads inside a transaction on the primary must see its uncommitted writes
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        current = _request.get()
+        if current is not None:
+            # Read-your-writes: the rest of this request and the session's next requests use the primary
+            current.use_replica = False
+            current.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """Enables replica reads for read_only views, and pins a session to the primary for
+    REPLICA_PIN_SECONDS after it wrote, long enough for the replicas to catch up."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current = _RequestRouting()
+        token = _request.set(current)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if current.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current = _request.get()
+        if current is not None and getattr(view_func, 'read_only', False) and PIN_COOKIE not in request.COOKIES:
+            current.use_replica = not current.wrote
@@ -0,0 +1,108 @@
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+# Search index over the customer fields the staff portal searches on.
+# SQLite: an FTS5 shadow table with the trigram tokenizer, kept in sync by signals (see signals.py).
+# Postgres: pg_trgm GIN indexes on the columns as text, which is what Django's contains lookups compare.
+FTS_TABLE = 'bank_app_customer_search'
+USER_COLUMNS = ('username', 'first_name', 'last_name', 'email')
+FTS_COLUMNS = (*USER_COLUMNS, 'personal_id', 'phone')
+MIN_TERM_LENGTH = 3
+
+SQLITE_CREATE = [
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({", ".join(FTS_COLUMNS)}, tokenize="trigram")',
+]
+SQLITE_DROP = [f'DROP TABLE IF EXISTS {FTS_TABLE}']
+
+POSTGRES_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    *(f'CREATE INDEX IF NOT EXISTS bank_app_user_{column}_trgm ON bank_app_user USING gin (({column}::text) gin_trgm_ops)'
+      for column in USER_COLUMNS),
+    'CREATE INDEX IF NOT EXISTS bank_app_customer_phone_trgm ON bank_app_customer USING gin ((phone::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS bank_app_customer_personal_id_trgm ON bank_app_customer USING gin ((personal_id::text) gin_trgm_ops)',
+]
+POSTGRES_DROP = [
+    *(f'DROP INDEX IF EXISTS bank_app_user_{column}_trgm' for column in USER_COLUMNS),
+    'DROP INDEX IF EXISTS bank_app_customer_phone_trgm',
+    'DROP INDEX IF EXISTS bank_app_customer_personal_id_trgm',
+]
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _row(customer):
+    user = customer.user
+    return (customer.pk, user.username, user.first_name, user.last_name, user.email, str(customer.personal_id), customer.phone)
+
+
+def index_customers(customers):
+    if not uses_fts():
+        return
+    rows = [_row(customer) for customer in customers]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s, %s)', rows
+        )
+
+
+def unindex_customer(pk):
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def rebuild_index(batch_size=5000):
+    from .models import Customer
+    if not uses_fts():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    count = 0
+    customers = Customer.objects.select_related('user').order_by('pk')
+    batch = []
+    for customer in customers.iterator(chunk_size=batch_size):
+        batch.append(customer)
+        if len(batch) == batch_size:
+            index_customers(batch)
+            count, batch = count + len(batch), []
+    index_customers(batch)
+    return count + len(batch)
+
+
+def _fallback(queryset, term):
+    return queryset.filter(
+        Q(user__username__contains=term)   |
+        Q(user__first_name__contains=term) |
+        Q(user__last_name__contains=term)  |
+        Q(user__email__contains=term)      |
+        Q(personal_id__contains=term)      |
+        Q(phone__contains=term)
+    )
+
+
+def search_customers(queryset, term, limit):
+    queryset = queryset.select_related('user')
+    if len(term) < MIN_TERM_LENGTH:
+        # Trigram indexes cannot serve one and two character terms
+        return list(_fallback(queryset, term)[:limit])
+
+    if uses_fts():
+        phrase = '"' + term.replace('"', '""') + '"'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s', [phrase, limit])
+            pks = [row[0] for row in cursor.fetchall()]
+        customers = queryset.in_bulk(pks)
+        return [customers[pk] for pk in pks if pk in customers]
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        queryset = _fallback(queryset, term).annotate(similarity=Greatest(
+            *(TrigramSimilarity(field, term) for field in ('user__username', 'user__first_name', 'user__last_name', 'user__email', 'phone'))
+        ))
+        return list(queryset.order_by('-similarity')[:limit])
+
+    return list(_fallback(queryset, term)[:limit])
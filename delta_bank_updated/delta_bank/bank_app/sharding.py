@@ -0,0 +1,161 @@
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .money import from_minor, to_minor
+
+logger = logging.getLogger(__name__)
+
+
+def enabled() -> bool:
+    return bool(settings.LEDGER_SHARDS)
+
+
+def shard_for(account_id) -> str:
+    # Every posting of an account lives on the same shard, so statements and balances stay single-shard
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    return settings.LEDGER_SHARDS[int(account_id) % len(settings.LEDGER_SHARDS)]
+
+
+def for_account(queryset, account_id):
+    return queryset.using(shard_for(account_id))
+
+
+def _select_related_paths(related, prefix=''):
+    for name, nested in related.items():
+        yield prefix + name
+        yield from _select_related_paths(nested, f'{prefix}{name}__')
+
+
+def _fetch(queryset):
+    try:
+        return list(queryset)
+    finally:
+        connections[queryset.db].close()
+
+
+def gather(queryset) -> list:
+    """Runs a Ledger queryset on every shard and concatenates the rows, for queries that are not
+    limited to one account such as staff lookups by transaction id.
+
+    The shards are queried in parallel unless one of them is inside a transaction, which the worker
+    threads could not see. Accounts live on the default database, so select_related('account...')
+    is done with one extra query there instead of a join. Ordering and slicing apply per shard.
+    """
+    if not enabled():
+        return list(queryset)
+    from .models import Account
+    related = queryset.query.select_related
+    if related:
+        queryset = queryset.select_related(None)
+    querysets = [queryset.using(db) for db in settings.LEDGER_SHARDS]
+    if any(connections[db].in_atomic_block for db in settings.LEDGER_SHARDS):
+        parts = [list(part) for part in querysets]
+    else:
+        with ThreadPoolExecutor(max_workers=len(querysets)) as executor:
+            parts = list(executor.map(_fetch, querysets))
+    rows = [row for part in parts for row in part]
+    if related and rows and isinstance(rows[0], queryset.model):
+        nested = related.get('account', {}) if isinstance(related, dict) else {}
+        accounts = Account.objects.select_related(*_select_related_paths(nested)).in_bulk({row.account_id for row in rows})
+        for row in rows:
+            row.account = accounts[row.account_id]
+    return rows
+
+
+def post(rows, book=True):
+    """Books new Ledger rows on a sharded ledger with a local two-phase protocol.
+
+    Phase one runs in the caller's transaction on the default database: the booked balances move
+    and the postings are written to a LedgerIntent. Once that commits, phase two inserts the rows
+    on each shard together with an AppliedIntent marker, so replaying an intent after a crash never
+    books a row twice. Intents left unapplied are finished by resume_ledger_intents. book=False
+    leaves the balances alone, for postings that already moved a hot account slot.
+    """
+    from .models import Account, LedgerIntent
+    deltas = {}
+    postings = []
+    for row in rows:
+        if book:
+            deltas[row.account_id] = deltas.get(row.account_id, 0) + row.amount
+        postings.append({
+            'account': row.account_id,
+            'transaction': str(row.transaction),
+            'amount': to_minor(row.amount),
+            'timestamp': row.timestamp.isoformat(),
+            'text': row.text,
+        })
+    with transaction.atomic():
+        Account.apply_deltas(deltas)
+        intent = LedgerIntent.objects.create(postings=postings)
+        transaction.on_commit(partial(_apply_committed_intent, intent.pk))
+    return intent
+
+
+def _apply_committed_intent(intent_id):
+    # The caller's transaction is already committed, a shard that is down must not fail it.
+    # The intent stays unapplied and resume_ledger_intents books it later.
+    try:
+        apply_intent(intent_id)
+    except Exception:
+        logger.exception('Ledger intent %s not applied, left for resume_ledger_intents', intent_id)
+
+
+def apply_intent(intent_id):
+    from .models import AppliedIntent, Ledger, LedgerIntent
+    intent = LedgerIntent.objects.get(pk=intent_id)
+    if intent.applied is not None:
+        return
+    by_shard = {}
+    for posting in intent.postings:
+        by_shard.setdefault(shard_for(posting['account']), []).append(Ledger(
+            account_id=posting['account'],
+            transaction=uuid.UUID(posting['transaction']),
+            amount=from_minor(posting['amount']),
+            timestamp=parse_datetime(posting['timestamp']),
+            text=posting['text'],
+        ))
+    for db, rows in by_shard.items():
+        with transaction.atomic(using=db):
+            _, created = AppliedIntent.objects.using(db).get_or_create(intent_id=intent_id)
+            if created:
+                Ledger.objects.using(db).bulk_create(rows)
+    LedgerIntent.objects.filter(pk=intent_id).update(applied=timezone.now())
+
+
+def resume_pending(older_than=timedelta(seconds=60)) -> int:
+    from .models import LedgerIntent
+    pending = (LedgerIntent.objects.filter(applied__isnull=True, created__lt=timezone.now() - older_than)
+               .order_by('pk').values_list('pk', flat=True))
+    count = 0
+    for intent_id in pending.iterator(chunk_size=1000):
+        apply_intent(intent_id)
+        count += 1
+    return count
+
+
+class LedgerShardRouter:
+    """Sends a Ledger instance to the shard of its account. Querysets are placed explicitly with
+    for_account() or gather(), everything else falls through to the next router."""
+
+    def _db_for_instance(self, model, instance=None, **hints):
+        if model._meta.label != 'bank_app.Ledger' or instance is None or not enabled():
+            return None
+        if instance._meta.label == 'bank_app.Ledger':
+            return instance._state.db or shard_for(instance.account_id)
+        if instance._meta.label == 'bank_app.Account':
+            # account.ledger_set
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, **hints)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .account_filter import account_filter
+from .models import Account, Customer
+from .search import USER_COLUMNS, index_customers, unindex_customer
+
+
+@receiver(post_save, sender=Customer)
+def index_saved_customer(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_customers([instance])
+
+
+@receiver(post_delete, sender=Customer)
+def unindex_deleted_customer(sender, instance, **kwargs):
+    unindex_customer(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_customer_user(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Names and email live on the user, so edits there must reach the index too. A save of other
+    # fields only, like last_login at every login, leaves the index alone.
+    if created or raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(USER_COLUMNS):
+        return
+    customer = Customer.objects.filter(pk=instance.pk).first()
+    if customer is not None:
+        customer.user = instance
+        index_customers([customer])
+
+
+@receiver(post_save, sender=Account)
+def add_account_to_filter(sender, instance, created, **kwargs):
+    if created:
+        account_filter.add(instance.pk)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import csv
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+EXPORT_FIELDS = ('timestamp', 'transaction', 'amount', 'text')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+@dataclass
+class StatementPage:
+    movements: list
+    next_cursor: str | None
+
+
+def encode_cursor(timestamp: datetime, pk: int) -> str:
+    return urlsafe_b64encode(f'{timestamp.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        raise BadRequest('Invalid statement cursor.')
+
+
+def statement_page(movements: QuerySet, cursor: str | None, limit: int) -> StatementPage:
+    # Newest first; (timestamp, id) keeps the order total so each page is one index range scan
+    movements = movements.order_by('-timestamp', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        movements = movements.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    page = list(movements[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].timestamp, page[-1].pk)
+    return StatementPage(page, next_cursor)
+
+
+def parse_export_date(value: str | None) -> date | None:
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise BadRequest(f'Invalid date: {value}')
+    return parsed
+
+
+def export_rows(movements: QuerySet, start: date | None = None, end: date | None = None, chunk_size=2000):
+    # Oldest first, both dates inclusive; values_list + iterator keeps memory flat for any account size
+    if start:
+        movements = movements.filter(timestamp__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        movements = movements.filter(timestamp__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    return movements.order_by('timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+class _Line:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_FIELDS)
+    for timestamp, transaction, amount, text in rows:
+        yield writer.writerow((timestamp.isoformat(), transaction, amount, text))
+
+
+def ndjson_lines(rows):
+    for timestamp, transaction, amount, text in rows:
+        yield json.dumps({
+            'timestamp': timestamp.isoformat(),
+            'transaction': str(transaction),
+            'amount': str(amount),
+            'text': text,
+        }) + '\n'
+
+
+def export_lines(rows, export_format: str):
+    if export_format not in EXPORT_FORMATS:
+        raise BadRequest(f'Unknown export format: {export_format}')
+    return csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
@@ -1,3 +1,1050 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest.mock import patch
+from urllib.parse import parse_qs
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .errors import HoldNotActive, InsufficientFunds
+from .account_filter import BloomFilter, account_filter
+from .locking import retry_on_conflict
+from . import sharding
+from .metrics import MetricsMiddleware
+from .routing import PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, read_only
+from . import accrual, interbank, reconciliation
+from .accrual import month_start, post_interest
+from .onboarding import import_customers
+from .checkpoints import checkpoint_balances
+from .models import (Account, AccountSlot, AppliedIntent, Customer, Hold, IdempotencyKey, Installment, InterbankTransfer, InterestRun,
+                     Ledger, LedgerIntent, Loan, Rank, RankRate, ReconciliationRun)
+from .forms import TransferForm
+from .transfers import TransferRequest
 
-# Create your tests here.
+User = get_user_model()
+
+
+class BankTestCase(TestCase):
+    def setUp(self):
+        self.bank_user = User.objects.create_user('bank', password='bank')
+        self.ops = Account.objects.create(user=self.bank_user, name='Bank OPS Account')
+        self.user = User.objects.create_user('evelyn', password='evelyn')
+        self.account = Account.objects.create(user=self.user, name='Main account')
+        Ledger.transfer(Decimal(1000), Account.objects.create(user=self.bank_user, name='Bank IPO Account'),
+                        'Operational Credit', self.ops, 'Operational Credit', is_loan=True)
+
+
+class BalanceTest(BankTestCase):
+    def test_postings_maintain_balance(self):
+        Ledger.transfer(Decimal('250.50'), self.ops, 'Payout', self.account, 'Payout from bank')
+        Ledger.transfer_from(Decimal('50.50'), self.account, 'Interbank')
+        self.assertEqual(self.account.balance, Decimal(200))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(200))
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal('749.50'))
+
+    def test_funds_check_uses_stored_balance(self):
+        stale = Account.objects.get(pk=self.account.pk)
+        Ledger.transfer(Decimal(100), self.ops, 'Payout', self.account, 'Payout from bank')
+        Ledger.transfer(Decimal(100), stale, 'Spend', self.ops, 'Spend')
+        with self.assertRaises(InsufficientFunds):
+            Ledger.transfer(Decimal(1), stale, 'Spend', self.ops, 'Spend')
+
+    def test_rebuild_balances(self):
+        Account.objects.filter(pk=self.ops.pk).update(booked_balance=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True)
+        call_command('rebuild_balances')
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(1000))
+        call_command('rebuild_balances', verify=True)
+
+
+class MoneyTest(BankTestCase):
+    def test_amounts_are_stored_as_minor_units(self):
+        Ledger.transfer(Decimal('0.10'), self.ops, 'Payout', self.account, 'Payout')
+        Ledger.transfer(Decimal('0.20'), self.ops, 'Payout', self.account, 'Payout')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT SUM(amount) FROM bank_app_ledger WHERE account_id = %s', [self.account.pk])
+            self.assertEqual(cursor.fetchone()[0], 30)
+        self.assertEqual(self.account.ledger_balance(), Decimal('0.30'))
+        self.assertEqual(Ledger.objects.filter(account=self.account, amount__gt=Decimal('0.15')).count(), 1)
+
+    def test_amounts_beyond_old_precision(self):
+        ipo = Account.objects.create(user=self.bank_user, name='Bank IPO Account')
+        Ledger.transfer(Decimal('1000000000000.01'), ipo, 'IPO', self.ops, 'IPO', is_loan=True)
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal('1000000001000.01'))
+
+    def test_interbank_amounts_are_stored_as_minor_units(self):
+        transfer = InterbankTransfer.objects.create(debit_account=self.ops, credit_account='20400000001', amount=Decimal('123456789012.34'),
+                                                    debit_text='Interbank', credit_text='Interbank')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT amount FROM bank_app_interbanktransfer WHERE id = %s', [transfer.pk])
+            self.assertEqual(cursor.fetchone()[0], 12345678901234)
+        self.assertEqual(InterbankTransfer.objects.get(pk=transfer.pk).amount, Decimal('123456789012.34'))
+        form = TransferForm({'amount': '0', 'debit_account': self.ops.pk, 'debit_text': 'x', 'credit_account': '1', 'credit_text': 'x'})
+        form.fields['debit_account'].queryset = Account.objects.all()
+        self.assertEqual(form.errors['amount'], ['Amount must be positive.'])
+        form = TransferForm({'amount': '123456789012.345', 'debit_account': self.ops.pk, 'debit_text': 'x', 'credit_account': '1', 'credit_text': 'x'})
+        form.fields['debit_account'].queryset = Account.objects.all()
+        self.assertIn('amount', form.errors)
+
+
+class StatementTest(BankTestCase):
+    def test_keyset_pages_cover_history_once(self):
+        for n in range(7):
+            Ledger.transfer(Decimal(n + 1), self.ops, f'Payout {n}', self.account, f'Payout {n}')
+        seen, cursor = [], None
+        while True:
+            page = self.account.statement(cursor, limit=3)
+            seen += [movement.pk for movement in page.movements]
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        self.assertEqual(seen, list(self.account.movements.order_by('-timestamp', '-id').values_list('pk', flat=True)))
+        self.assertEqual(len(seen), 7)
+
+    def test_account_details_paginates(self):
+        self.client.force_login(self.user)
+        Ledger.transfer(Decimal(1), self.ops, 'Payout', self.account, 'Payout')
+        with self.settings(STATEMENT_PAGE_SIZE=1):
+            response = self.client.get(reverse('bank_app:account_details', args=(self.account.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['statement'].movements), 1)
+        self.assertEqual(self.client.get(reverse('bank_app:account_details', args=(self.account.pk,)),
+                                         {'cursor': 'bogus'}).status_code, 400)
+
+    def test_statement_api(self):
+        Ledger.transfer(Decimal(5), self.ops, 'Payout', self.account, 'Payout')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bank_app:account_statement', args=(self.account.pk,)))
+        self.assertEqual(response.json()['movements'][0]['amount'], '5.00')
+        self.assertEqual(self.client.get(reverse('bank_app:account_statement', args=(self.ops.pk,))).status_code, 404)
+
+
+class TransactionIdTest(BankTestCase):
+    def test_transaction_is_stored_as_uuid(self):
+        unique_id = Ledger.transfer(Decimal(10), self.ops, 'Payout', self.account, 'Payout')
+        self.assertEqual(set(Ledger.objects.filter(transaction=str(unique_id)).values_list('transaction', flat=True)), {unique_id})
+
+    def test_transfer_to_rejects_malformed_unique_id(self):
+        data = {'amount': '10', 'credit_account': self.account.pk, 'credit_text': 'From abroad'}
+        response = self.client.post('/api/v1/make_transfer/to/', {**data, 'unique_id': 'not-a-uuid'})
+        self.assertEqual(response.status_code, 400)
+        unique_id = uuid.uuid1()
+        response = self.client.post('/api/v1/make_transfer/to/', {**data, 'unique_id': str(unique_id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Ledger.objects.get(account=self.account).transaction, unique_id)
+
+
+class HoldTest(BankTestCase):
+    def test_hold_reserves_funds_until_committed(self):
+        hold = Hold.reserve(self.ops, Decimal(600), 'Interbank')
+        self.assertEqual(self.ops.available_balance(), Decimal(400))
+        with self.assertRaises(InsufficientFunds):
+            Ledger.transfer(Decimal(500), self.ops, 'Payout', self.account, 'Payout')
+        self.assertEqual(hold.commit(self.account, 'Interbank'), hold.transaction)
+        self.assertEqual(Ledger.objects.filter(transaction=hold.transaction).count(), 2)
+        ops = Account.objects.get(pk=self.ops.pk)
+        self.assertEqual((ops.balance, ops.available_balance()), (Decimal(400), Decimal(400)))
+        with self.assertRaises(HoldNotActive):
+            hold.commit()
+
+    def test_released_and_expired_holds_free_funds(self):
+        released = Hold.reserve(self.ops, Decimal(300), 'Interbank')
+        self.assertTrue(released.release())
+        self.assertFalse(released.release())
+        stale = Hold.reserve(self.ops, Decimal(300), 'Interbank', ttl=60)
+        Hold.objects.filter(pk=stale.pk).update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.ops.available_balance(), Decimal(1000))
+        with self.assertRaises(HoldNotActive):
+            stale.commit()
+        call_command('expire_holds')
+        self.assertEqual(Hold.objects.get(pk=stale.pk).state, Hold.EXPIRED)
+
+    def test_hold_api(self):
+        url = reverse('bank_app:reserve_funds')
+        self.assertEqual(self.client.post(url, {'amount': '1', 'debit_account': self.ops.pk, 'debit_text': 'x'}).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(url, {'amount': '1', 'debit_account': self.ops.pk, 'debit_text': 'x'}).status_code, 404)
+        self.assertEqual(self.client.post(url, {'amount': 'abc', 'debit_account': self.account.pk, 'debit_text': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'amount': '-5', 'debit_account': self.account.pk, 'debit_text': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'amount': '5'}).status_code, 400)
+        foreign = Hold.reserve(self.ops, Decimal(1), 'Interbank')
+        self.assertEqual(self.client.post(reverse('bank_app:release_hold', args=(foreign.transaction,))).status_code, 404)
+        self.client.force_login(self.bank_user)
+        response = self.client.post(reverse('bank_app:reserve_funds'), {'amount': '2000', 'debit_account': self.ops.pk, 'debit_text': 'Too much'})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(reverse('bank_app:reserve_funds'), {'amount': '250', 'debit_account': self.ops.pk, 'debit_text': 'Interbank'})
+        unique_id = response.json()['unique_id']
+        self.assertEqual(self.client.post(reverse('bank_app:commit_hold', args=(unique_id,))).status_code, 200)
+        self.assertEqual(self.client.post(reverse('bank_app:release_hold', args=(unique_id,))).status_code, 409)
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(750))
+        self.assertTrue(foreign.release())
+
+
+class HotAccountTest(BankTestCase):
+    def slots(self):
+        return list(self.ops.slots.order_by('slot').values_list('balance', flat=True))
+
+    def test_postings_use_slots(self):
+        self.ops.make_hot(4)
+        self.assertEqual(self.slots(), [Decimal(250)] * 4)
+        Ledger.transfer(Decimal(100), self.ops, 'Payout', self.account, 'Payout')
+        Ledger.transfer(Decimal(30), self.account, 'Repayment', self.ops, 'Repayment')
+        self.assertEqual(self.ops.refresh_balance(), Decimal(0))
+        self.assertEqual(sum(self.slots()), Decimal(930))
+        self.assertEqual(self.ops.balance, Decimal(930))
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+
+    def test_debit_no_slot_covers_falls_back_to_lock(self):
+        self.ops.make_hot(4)
+        Ledger.transfer(Decimal(300), self.ops, 'Payout', self.account, 'Payout')
+        self.assertEqual(self.slots(), [Decimal(175)] * 4)
+        self.assertEqual(self.ops.balance, Decimal(700))
+        with self.assertRaises(InsufficientFunds):
+            Ledger.transfer(Decimal('700.01'), self.ops, 'Payout', self.account, 'Payout')
+        Hold.reserve(self.ops, Decimal(600), 'Held')
+        with self.assertRaises(InsufficientFunds):
+            Ledger.transfer_from(Decimal(150), self.ops, 'Interbank')
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+
+    def test_consolidate_and_unmark(self):
+        self.ops.make_hot(3)
+        Ledger.transfer_to(Decimal(10), self.ops, 'Deposit', uuid.uuid1())
+        self.assertEqual(AccountSlot.consolidate(), 1)
+        self.assertEqual(self.slots(), [Decimal('336.66')] * 3)
+        self.assertEqual(self.ops.refresh_balance(), Decimal('0.02'))
+        staff = User.objects.create_user('thomas', is_staff=True)
+        self.client.force_login(staff)
+        self.client.post(reverse('bank_app:staff_hot_account', args=(self.ops.pk,)), {'slots': 0})
+        self.ops.refresh_from_db()
+        self.assertEqual((self.ops.hot_slots, self.ops.balance, self.slots()), (0, Decimal(1010), []))
+
+
+class IdempotencyTest(BankTestCase):
+    def post(self, key, amount='10', path='/api/v1/make_transfer/from/'):
+        data = {'amount': amount, 'debit_account': self.ops.pk, 'debit_text': 'Interbank'}
+        return self.client.post(path, data, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_request_is_replayed(self):
+        first = self.post('retry-1')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.post('retry-1')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((second.status_code, second.content), (first.status_code, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(990))
+        self.assertEqual(self.post('retry-2').status_code, 200)
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(980))
+
+    def test_key_reused_for_different_request(self):
+        self.post('retry-1')
+        self.assertEqual(self.post('retry-1', amount='20').status_code, 422)
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(990))
+
+    def test_request_that_dies_leaves_no_key_behind(self):
+        transfer_from = Ledger.transfer_from
+
+        def dies_after_posting(*args):
+            transfer_from(*args)
+            raise RuntimeError('worker killed')
+
+        with patch.object(Ledger, 'transfer_from', side_effect=dies_after_posting), self.assertRaises(RuntimeError):
+            self.post('retry-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(1000))
+        self.assertEqual(self.post('retry-1').status_code, 200)
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(990))
+
+    def test_old_keys_are_pruned(self):
+        self.post('retry-1')
+        IdempotencyKey.objects.update(created=timezone.now() - timedelta(days=2))
+        self.post('retry-2')
+        call_command('prune_idempotency_keys')
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['retry-2'])
+
+
+class AccountFilterTest(BankTestCase):
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(10_000)
+        for number in range(80750000000, 80750010000):
+            bloom.add(number)
+        self.assertTrue(all(number in bloom for number in range(80750000000, 80750010000)))
+        false_positives = sum(number in bloom for number in range(10_000))
+        self.assertLess(false_positives, 50)
+
+    def test_new_and_deleted_accounts(self):
+        account_filter.invalidate()
+        self.assertTrue(account_filter.exists(self.account.pk))
+        created = Account.objects.create(user=self.user, name='Savings')
+        self.assertTrue(account_filter.exists(str(created.pk)))
+        created.delete()
+        self.assertFalse(account_filter.exists(created.pk))
+        self.assertFalse(account_filter.exists('not-a-number'))
+
+    def test_account_created_by_another_process(self):
+        account_filter.invalidate()
+        account_filter.exists(self.account.pk)
+        # bulk_create skips post_save, as if another process had created the account
+        other, = Account.objects.bulk_create([Account(user=self.user, account_number=80759999990, name='Other')])
+        Account.objects.create(user=self.user, account_number=80759999999, name='Local')
+        self.assertTrue(account_filter.exists(other.pk))
+        self.assertTrue(account_filter.exists(80759999999))
+
+    def test_batch_validation(self):
+        Account.objects.create(user=self.bank_user, account_number=80759999999, name='Bank Clearing Account')
+        account_filter.invalidate()
+        account_filter.exists(self.account.pk)
+        # Numbers above the highest known account always go to the database, these are below it
+        accounts = [str(self.account.pk), str(self.ops.pk)] + [str(number) for number in range(80750000000, 80750005000)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bank_app:credit_acc_validation_batch'), {'accounts': accounts}, content_type='application/json')
+        self.assertLessEqual(len(queries), 1)
+        self.assertEqual(response.json()['found'], accounts[:2])
+        self.assertEqual(len(response.json()['missing']), 5000)
+
+    def test_batch_validation_rejects_malformed_body(self):
+        url = reverse('bank_app:credit_acc_validation_batch')
+        for body in ([str(self.account.pk)], {'accounts': str(self.account.pk)}, {'accounts': [{'number': 1}]}, {'accounts': [True]}):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        response = self.client.post(url, {'accounts': [self.account.pk]}, content_type='application/json')
+        self.assertEqual(response.json(), {'found': [str(self.account.pk)], 'missing': []})
+
+
+class BulkTransferTest(BankTestCase):
+    def payroll(self, *amounts):
+        return [TransferRequest(Decimal(amount), self.ops, 'Payroll', self.account, 'Salary') for amount in amounts]
+
+    def test_atomic_batch_is_all_or_nothing(self):
+        results = Ledger.bulk_transfer(self.payroll(600, 600))
+        self.assertFalse(any(result.ok for result in results))
+        self.assertEqual(results[1].error, 'Insufficient funds for transfer.')
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(1000))
+
+    def test_partial_batch_posts_what_is_funded(self):
+        results = Ledger.bulk_transfer(self.payroll(600, 600, 400), atomic=False)
+        self.assertEqual([result.ok for result in results], [True, False, True])
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(0))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(1000))
+        self.assertEqual(Ledger.objects.filter(transaction=results[0].unique_id).count(), 2)
+
+    def test_bulk_transfer_api(self):
+        self.client.force_login(self.user)
+        payload = {'atomic': False, 'transfers': [
+            {'amount': '10', 'debit_account': self.ops.pk, 'credit_account': self.account.pk},
+        ]}
+        response = self.client.post(reverse('bank_app:bulk_transfer'), payload, content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['error'], 'Debit account does not belong to user.')
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(reverse('bank_app:bulk_transfer'), payload, content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['status'], 'ok')
+        response = self.client.post(reverse('bank_app:bulk_transfer'), payload['transfers'], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_transfer_api_rejects_bad_input(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        url = reverse('bank_app:bulk_transfer')
+        self.assertEqual(self.client.post(url, {'transfers': 'x'}).status_code, 400)
+        for body in ('"transfers"', '{"transfers": "x"}', '{"transfers": [1]}', '{"atomic": "no", "transfers": []}'):
+            self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 400)
+        transfer = {'amount': '0', 'debit_account': self.ops.pk, 'credit_account': [self.account.pk]}
+        response = self.client.post(url, {'transfers': [transfer]}, content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['error'], 'Account not found.')
+        transfer['credit_account'] = self.account.pk
+        response = self.client.post(url, {'transfers': [transfer]}, content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['error'], 'Amount must be positive.')
+        self.assertEqual(Account.objects.get(pk=self.ops.pk).balance, Decimal(1000))
+
+
+class ReconciliationTest(BankTestCase):
+    def reconcile(self, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.json')
+            with redirect_stdout(io.StringIO()):
+                try:
+                    call_command('reconcile_ledger', workers=1, chunk_size=3, output=output, **options)
+                except CommandError:
+                    pass
+            with open(output) as report:
+                return json.load(report)
+
+    def test_reports_unbalanced_and_orphaned_transactions(self):
+        Ledger.transfer(Decimal(100), self.ops, 'Payout', self.account, 'Payout')
+        unbalanced = uuid.uuid1()
+        Ledger(amount=Decimal(5), transaction=unbalanced, account=self.account, text='Broken').save()
+        Ledger(amount=Decimal(-3), transaction=unbalanced, account=self.ops, text='Broken').save()
+        outgoing = Ledger.transfer_from(Decimal(10), self.account, 'Interbank')
+        InterbankTransfer.objects.create(debit_account=self.account, credit_account='20400000001', amount=Decimal(10), debit_text='Interbank',
+                                         credit_text='Interbank', state=InterbankTransfer.COMPLETED, transaction=str(outgoing))
+        incoming = uuid.uuid1()
+        Ledger.transfer_to(Decimal(7), self.account, 'From Danske Bank', incoming)
+
+        report = self.reconcile()
+        self.assertEqual(report['postings'], 8)
+        self.assertEqual([group['transaction'] for group in report['unbalanced']], [str(unbalanced)])
+        self.assertEqual({leg['transaction']: leg['paired_with'] for leg in report['one_sided']},
+                         {str(outgoing): 'interbank_transfer', str(incoming): None})
+        self.assertEqual(report['orphaned'], [str(incoming)])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as counterpart:
+            json.dump({'one_sided': [{'transaction': str(incoming), 'amount': '-7.00'}]}, counterpart)
+            counterpart.flush()
+            Ledger.transfer(Decimal(1), self.ops, 'Payout', self.account, 'Payout')
+            with self.settings(LEDGER_COMMIT_MARGIN_SECONDS=0):
+                report = self.reconcile(incremental=True, counterpart=counterpart.name)
+        self.assertEqual(report['postings'], 2)
+        self.assertEqual(len(report['unbalanced']), 1)
+        self.assertEqual(report['orphaned'], [])
+        self.assertEqual(ReconciliationRun.objects.latest('pk').open_transactions, [str(unbalanced)])
+
+    def test_incremental_rereads_postings_committed_below_the_mark(self):
+        self.reconcile()
+        late = uuid.uuid1()
+        Ledger(amount=Decimal(2), transaction=late, account=self.account, text='Committed late').save()
+        # As if the last run had read past the posting's id before its transaction committed
+        ReconciliationRun.objects.update(high_water_marks={'default': Ledger.objects.latest('pk').pk})
+        with self.settings(LEDGER_COMMIT_MARGIN_SECONDS=0):
+            self.assertEqual(self.reconcile(incremental=True)['orphaned'], [str(late)])
+
+    def test_reports_without_numpy(self):
+        self.assertIsNotNone(reconciliation.numpy)
+        with patch('bank_app.reconciliation.numpy', None):
+            self.test_reports_unbalanced_and_orphaned_transactions()
+
+
+class InterestTest(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        rank = Rank.objects.create(name='Silver', value=50)
+        RankRate.objects.create(rank=rank, deposit_rate=Decimal(1), overdraft_rate=Decimal(10), monthly_fee=Decimal(5))
+        Customer.objects.create(user=self.user, rank=rank, personal_id=1, phone='1')
+        self.dormant = Account.objects.create(user=self.user, name='Savings')
+        self.income = Account.objects.create(user=self.bank_user, name='Bank Interest and Fees Account')
+        deposit = Ledger.transfer(Decimal(365), self.ops, 'Payout', self.account, 'Payout')
+        spend = Ledger.transfer(Decimal(730), self.account, 'Spend', self.ops, 'Spend', is_loan=True)
+        Ledger.objects.filter(transaction=deposit).update(timestamp=timezone.make_aware(datetime(2024, 12, 31, 12)))
+        Ledger.objects.filter(transaction=spend).update(timestamp=timezone.make_aware(datetime(2025, 1, 16, 12)))
+
+    def test_posts_interest_and_fees_once(self):
+        run = post_interest(2025, 1, self.income, batch_size=1)
+        self.assertEqual(run.period_start, month_start(2025, 1))
+        self.assertIsNotNone(run.finished)
+        # 365 for 15 days at 1%, -365 for 16 days at 10%
+        self.assertEqual(dict(self.account.ledger_set.filter(text__endswith='2025-01').values_list('text', 'amount')), {
+            'Interest 2025-01': Decimal('0.15'),
+            'Overdraft interest 2025-01': Decimal('-1.60'),
+            'Account fee 2025-01': Decimal(-5),
+        })
+        self.assertFalse(self.dormant.ledger_set.exists())
+        self.assertEqual(Account.objects.get(pk=self.income.pk).balance, Decimal('6.45'))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('-371.45'))
+
+        post_interest(2025, 1, self.income)
+        self.assertEqual(InterestRun.objects.get().postings, 6)
+        self.assertEqual(Ledger.objects.filter(account=self.income).count(), 3)
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+
+    def test_posts_interest_without_numpy(self):
+        self.assertIsNotNone(accrual.numpy)
+        with patch('bank_app.accrual.numpy', None):
+            self.test_posts_interest_and_fees_once()
+
+    def test_overlapping_run_skips_claimed_batch(self):
+        stale = InterestRun.objects.create(period_start=month_start(2025, 1), period_end=month_start(2025, 2))
+        post_interest(2025, 1, self.income)
+        rates = {rate.rank_id: rate for rate in RankRate.objects.all()}
+        self.assertFalse(accrual._post_batch(stale, [(self.account.pk, self.user.customer.rank_id)], rates, self.income))
+        self.assertEqual(Ledger.objects.filter(account=self.income).count(), 3)
+        self.assertEqual(InterestRun.objects.get().postings, 6)
+
+    def test_incomplete_month_is_refused(self):
+        today = timezone.now()
+        with self.assertRaises(AssertionError):
+            post_interest(today.year, today.month, self.income)
+
+
+class LoanTest(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        Customer.objects.create(user=self.user, rank=Rank.objects.create(name='Gold', value=50), personal_id=1, phone='1')
+        self.income = Account.objects.create(user=self.bank_user, name='Bank Interest and Fees Account')
+
+    def test_make_loan_stores_schedule(self):
+        loan = self.user.customer.make_loan(Decimal(1200), 'Car', 12)
+        schedule = list(loan.schedule.order_by('number'))
+        self.assertEqual(len(schedule), 12)
+        self.assertEqual(sum(installment.principal for installment in schedule), Decimal(1200))
+        self.assertEqual(loan.repay_account, self.account)
+        self.assertEqual(Account.objects.get(pk=loan.pk).balance, Decimal(-1200))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(1200))
+
+    def test_make_loan_view_validates_installments(self):
+        self.client.force_login(self.user)
+        url = reverse('bank_app:make_loan')
+        for installments in ('twelve', '-1', '0', '100000'):
+            response = self.client.post(url, {'name': 'Car', 'amount': '1200', 'installments': installments})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Loan.objects.exists())
+        self.assertEqual(self.client.post(url, {'name': 'Car', 'amount': '1200', 'installments': '24'}).status_code, 302)
+        self.assertEqual(Loan.objects.get().schedule.count(), 24)
+
+    def test_amortize(self):
+        schedule = Loan.amortize(Decimal(1200), Decimal(12), 12)
+        self.assertEqual(schedule[0], (Decimal('94.62'), Decimal('12.00')))
+        self.assertTrue(all(principal + interest == Decimal('106.62') for principal, interest in schedule[:-1]))
+        self.assertEqual(sum(principal for principal, _ in schedule), Decimal(1200))
+        self.assertEqual([principal for principal, _ in Loan.amortize(Decimal(100), Decimal(0), 3)],
+                         [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')])
+
+    def test_collect_records_failures_and_retries(self):
+        loan_account = Account.objects.create(user=self.user, name='Loan: Car')
+        loan = Loan.open(loan_account, self.account, Decimal(300), Decimal(12), 3, first_due=date(2025, 1, 31))
+        self.assertEqual(list(loan.schedule.order_by('number').values_list('due', flat=True)),
+                         [date(2025, 1, 31), date(2025, 2, 28), date(2025, 3, 31)])
+        Ledger.transfer(Decimal(300), loan_account, 'Payout', self.account, 'Payout', is_loan=True)
+        Ledger.transfer(Decimal(150), self.account, 'Spend', self.ops, 'Spend')
+
+        self.assertEqual(Installment.collect(self.income.pk, date(2025, 2, 28), batch_size=1), (1, 1))
+        second = loan.schedule.get(number=2)
+        self.assertEqual((second.state, second.failures), (Installment.FAILED, 1))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('47.99'))
+
+        Ledger.transfer(Decimal(100), self.ops, 'Payout', self.account, 'Payout')
+        with redirect_stdout(io.StringIO()):
+            call_command('collect_repayments', date='2025-03-31', income_account=self.income.pk)
+        self.assertEqual(list(loan.schedule.order_by('number').values_list('state', flat=True)),
+                         [Installment.PAID, Installment.PAID, Installment.FAILED])
+        self.assertEqual(Account.objects.get(pk=loan_account.pk).balance, Decimal('-100.99'))
+        self.assertEqual(Account.objects.get(pk=self.income.pk).balance, Decimal('5.01'))
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+        with self.assertRaises(CommandError):
+            call_command('collect_repayments', income_account=0)
+
+
+class LockingTest(BankTestCase):
+    def test_locked_yields_current_balances(self):
+        with Account.locked(self.account.pk, self.ops.pk) as balances:
+            self.assertEqual(balances, {self.account.pk: Decimal(0), self.ops.pk: Decimal(1000)})
+
+    def test_retry_on_conflict(self):
+        calls = []
+
+        @retry_on_conflict
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        with patch('bank_app.locking.connection') as connection:
+            connection.in_atomic_block = False
+            self.assertEqual(flaky(), 'done')
+        self.assertEqual(len(calls), 3)
+
+
+class CustomerSearchTest(TestCase):
+    def setUp(self):
+        rank = Rank.objects.create(name='Silver', value=50)
+        for username, first_name, personal_id, phone in (
+            ('evelyn', 'Evelyn', 10001, '87351233'),
+            ('soren', 'Søren', 10003, '51245682'),
+            ('paul', 'Paul', 10002, '20456123'),
+        ):
+            user = User.objects.create_user(username, first_name=first_name, email=f'{username}@example.com')
+            Customer.objects.create(user=user, rank=rank, personal_id=personal_id, phone=phone)
+
+    def usernames(self, term):
+        return {customer.user.username for customer in Customer.search(term)}
+
+    def test_search_matches_substrings_of_every_field(self):
+        self.assertEqual(self.usernames('VELY'), {'evelyn'})
+        self.assertEqual(self.usernames('10002'), {'paul'})
+        self.assertEqual(self.usernames('245'), {'soren'})
+        self.assertEqual(self.usernames('example.com'), {'evelyn', 'soren', 'paul'})
+        self.assertEqual(self.usernames('nobody'), set())
+
+    def test_index_follows_user_changes(self):
+        user = User.objects.get(username='paul')
+        user.last_name = 'Jackson'
+        user.save()
+        self.assertEqual(self.usernames('jackson'), {'paul'})
+        Customer.objects.get(pk=user.pk).delete()
+        self.assertEqual(self.usernames('jackson'), set())
+
+    def test_login_leaves_index_alone(self):
+        user = User.objects.get(username='evelyn')
+        user.last_login = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            user.save(update_fields=['last_login'])
+        self.assertEqual(len(queries), 1)
+        user.first_name = 'Genevieve'
+        user.save(update_fields=['first_name'])
+        self.assertEqual(self.usernames('genev'), {'evelyn'})
+
+    def test_short_terms(self):
+        self.assertEqual(self.usernames('ø'), {'soren'})
+
+
+class CustomerImportTest(TestCase):
+    CSV = (
+        'username,first_name,last_name,email,password,personal_id,phone,rank,accounts\n'
+        'alice,Alice,Hansen,alice@example.com,alice-secret,20001,11111111,Gold,Budget; Savings\n'
+        'taken,Tom,Olsen,,,20002,22222222,,\n'
+        'bob,Bob,Jensen,,,20001,33333333,,\n'
+        'carl,Carl,Madsen,not-an-email,,20003,44444444,,\n'
+        'dora,Dora,Nielsen,,,abc,55555555,,\n'
+        'erik,Erik,Larsen,,,20004,66666666,Platinum,\n'
+        'frida,Frida,Smith,,,20005,77777777,,\n'
+    )
+
+    def setUp(self):
+        Rank.objects.create(name='Silver', value=20)
+        Rank.objects.create(name='Gold', value=50)
+        Customer.objects.create(user=User.objects.create_user('taken'), rank=Rank.objects.get(name='Silver'), personal_id=1, phone='1')
+
+    def test_import_reports_rejected_rows(self):
+        report = import_customers(io.StringIO(self.CSV), batch_size=2, workers=1)
+        self.assertEqual((report.customers, report.accounts), (2, 3))
+        self.assertEqual([(error.line, error.username) for error in report.errors],
+                         [(3, 'taken'), (4, 'bob'), (5, 'carl'), (6, 'dora'), (7, 'erik')])
+        alice = Customer.objects.get(user__username='alice')
+        self.assertEqual((alice.rank.name, alice.personal_id), ('Gold', 20001))
+        self.assertTrue(alice.user.check_password('alice-secret'))
+        self.assertEqual(list(alice.accounts.values_list('name', flat=True)), ['Budget', 'Savings'])
+        frida = Customer.objects.get(user__username='frida')
+        self.assertEqual(frida.rank.name, 'Silver')
+        self.assertFalse(frida.user.has_usable_password())
+        self.assertEqual(frida.default_account.name, 'Main account')
+        self.assertTrue(account_filter.exists(frida.default_account.pk))
+        self.assertEqual({customer.user.username for customer in Customer.search('frida')}, {'frida'})
+
+    def test_command_hashes_on_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'customers.csv')
+            with open(path, 'w') as customers:
+                customers.write(self.CSV)
+            with redirect_stdout(io.StringIO()):
+                call_command('import_customers', path, workers=2, errors=os.path.join(directory, 'errors.csv'))
+            with open(os.path.join(directory, 'errors.csv')) as errors:
+                self.assertEqual(len(list(csv.DictReader(errors))), 5)
+        self.assertTrue(User.objects.get(username='alice').check_password('alice-secret'))
+
+    @override_settings(CUSTOMER_IMPORT_WORKERS=1)
+    def test_staff_upload(self):
+        self.client.force_login(User.objects.create_user('thomas', is_staff=True))
+        response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                    {'file': SimpleUploadedFile('customers.csv', self.CSV.encode('utf-8-sig'))})
+        self.assertContains(response, '2 customer(s) with 3 account(s) created, 5 row(s) rejected.')
+        self.assertContains(response, 'Personal ID already registered.')
+        response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                    {'file': SimpleUploadedFile('customers.csv', b'username,email\nx,y\n')})
+        self.assertContains(response, 'Missing column(s): personal_id, phone.')
+        response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                    {'file': SimpleUploadedFile('customers.csv', self.CSV.encode('utf-16'))})
+        self.assertContains(response, 'not UTF-8')
+        with self.settings(CUSTOMER_IMPORT_UPLOAD_MAX_ROWS=3):
+            response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                        {'file': SimpleUploadedFile('customers.csv', self.CSV.encode())})
+        self.assertContains(response, 'manage.py import_customers')
+        with self.settings(CUSTOMER_IMPORT_UPLOAD_MAX_BYTES=10):
+            response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                        {'file': SimpleUploadedFile('customers.csv', self.CSV.encode())})
+        self.assertContains(response, 'manage.py import_customers')
+        self.assertEqual(Customer.objects.count(), 3)
+
+    @override_settings(CUSTOMER_IMPORT_WORKERS=2)
+    def test_staff_upload_hashes_on_worker_processes(self):
+        self.client.force_login(User.objects.create_user('thomas', is_staff=True))
+        with patch('bank_app.onboarding.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+            response = self.client.post(reverse('bank_app:staff_import_customers'),
+                                        {'file': SimpleUploadedFile('customers.csv', self.CSV.encode())})
+        self.assertContains(response, '2 customer(s) with 3 account(s) created, 5 row(s) rejected.')
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 2)
+        self.assertTrue(User.objects.get(username='alice').check_password('alice-secret'))
+
+
+class StandInBank:
+    # Plays the remote bank on port 8200 (prefix 2040) for the interbank coordinator
+    def __init__(self, accounts=('20401234567',), fail_credits=0, refuse_credits=False):
+        self.accounts = set(accounts)
+        self.fail_credits = fail_credits
+        self.refuse_credits = refuse_credits
+        self.credits = []
+        self.idempotency_keys = []
+
+    def __call__(self, request):
+        data = parse_qs(request.content.decode())
+        if request.url.path == '/api/v1/credit_acc_validation/':
+            return httpx.Response(200 if data['credit_account'][0] in self.accounts else 403)
+        if self.fail_credits:
+            self.fail_credits -= 1
+            return httpx.Response(503)
+        if self.refuse_credits:
+            return httpx.Response(403)
+        self.credits.append((data['credit_account'][0], Decimal(data['amount'][0]), data['unique_id'][0]))
+        self.idempotency_keys.append(request.headers.get('Idempotency-Key'))
+        return httpx.Response(200, json={'message': 'money transfered to account'})
+
+
+class InterbankTest(BankTestCase):
+    def transfer(self, bank, credit_account='20401234567', amount=Decimal(100)):
+        Ledger.transfer(Decimal(500), self.ops, 'Payout', self.account, 'Payout')
+        with interbank.InterbankClient(httpx.MockTransport(bank)) as bank_client, patch.object(interbank, 'client', bank_client):
+            return interbank.submit(self.account, amount, 'To Danske', credit_account, 'From Delta')
+
+    def test_remote_transfer_completes(self):
+        bank = StandInBank()
+        transfer = self.transfer(bank)
+        self.assertEqual(transfer.state, InterbankTransfer.COMPLETED)
+        self.assertEqual(bank.credits, [('20401234567', Decimal(100), transfer.transaction)])
+        self.assertEqual(bank.idempotency_keys, [transfer.transaction])
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(400))
+
+    def test_unreachable_bank_is_resumed(self):
+        bank = StandInBank(fail_credits=1)
+        transfer = self.transfer(bank)
+        self.assertEqual(transfer.state, InterbankTransfer.HELD)
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual((account.balance, account.available_balance()), (Decimal(500), Decimal(400)))
+        with interbank.InterbankClient(httpx.MockTransport(bank)) as bank_client, patch.object(interbank, 'client', bank_client):
+            transfer = interbank.advance(InterbankTransfer.objects.get(pk=transfer.pk))
+        self.assertEqual(transfer.state, InterbankTransfer.COMPLETED)
+        self.assertEqual(len(bank.credits), 1)
+
+    def test_stale_advance_does_not_repeat_a_step(self):
+        Ledger.transfer(Decimal(500), self.ops, 'Payout', self.account, 'Payout')
+        transfer = InterbankTransfer.objects.create(debit_account=self.account, amount=Decimal(100), debit_text='To Danske',
+                                                    credit_account='20401234567', credit_text='From Delta',
+                                                    state=InterbankTransfer.VALIDATED)
+        stale = InterbankTransfer.objects.get(pk=transfer.pk)
+        bank = StandInBank()
+        with interbank.InterbankClient(httpx.MockTransport(bank)) as bank_client, patch.object(interbank, 'client', bank_client):
+            self.assertEqual(interbank.advance(transfer).state, InterbankTransfer.COMPLETED)
+            # A second resume that read VALIDATED before the first one moved on
+            self.assertEqual(interbank.advance(stale).state, InterbankTransfer.COMPLETED)
+        self.assertEqual(Hold.objects.filter(account=self.account).count(), 1)
+        self.assertEqual(len(bank.credits), 1)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(400))
+
+    def test_customer_cannot_settle_transfer_hold(self):
+        bank = StandInBank(fail_credits=1)
+        transfer = self.transfer(bank)
+        self.assertEqual(transfer.state, InterbankTransfer.HELD)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(reverse('bank_app:release_hold', args=(transfer.transaction,))).status_code, 404)
+        self.assertEqual(self.client.post(reverse('bank_app:commit_hold', args=(transfer.transaction,))).status_code, 404)
+        # Released some other way, the debit is still booked once the other bank takes the credit
+        transfer.hold.release()
+        with interbank.InterbankClient(httpx.MockTransport(bank)) as bank_client, patch.object(interbank, 'client', bank_client):
+            transfer = interbank.advance(InterbankTransfer.objects.get(pk=transfer.pk))
+        self.assertEqual(transfer.state, InterbankTransfer.COMPLETED)
+        self.assertEqual(len(bank.credits), 1)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(400))
+
+    def test_hold_committed_elsewhere_fails_transfer(self):
+        bank = StandInBank(fail_credits=1)
+        transfer = self.transfer(bank)
+        transfer.hold.commit()
+        with interbank.InterbankClient(httpx.MockTransport(bank)) as bank_client, patch.object(interbank, 'client', bank_client), \
+                self.assertLogs('bank_app.interbank', 'ERROR'):
+            transfer = interbank.advance(InterbankTransfer.objects.get(pk=transfer.pk))
+        self.assertEqual(transfer.state, InterbankTransfer.FAILED)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(400))
+
+    def test_refused_credit_releases_hold(self):
+        transfer = self.transfer(StandInBank(refuse_credits=True))
+        self.assertEqual(transfer.state, InterbankTransfer.FAILED)
+        self.assertEqual(transfer.hold.state, Hold.RELEASED)
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual((account.balance, account.available_balance()), (Decimal(500), Decimal(500)))
+        self.assertFalse(Ledger.objects.filter(transaction=transfer.transaction).exists())
+
+    def test_unknown_credit_account_is_not_debited(self):
+        transfer = self.transfer(StandInBank(), credit_account='20409999999')
+        self.assertEqual(transfer.state, InterbankTransfer.FAILED)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal(500))
+
+    def test_local_transfer_through_form(self):
+        Ledger.transfer(Decimal(500), self.ops, 'Payout', self.account, 'Payout')
+        Customer.objects.create(user=self.user, rank=Rank.objects.create(name='Silver', value=50), personal_id=1, phone='1')
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('bank_app:submit_transfer'), {
+            'amount': '20.50', 'debit_account': self.account.pk, 'debit_text': 'Rent',
+            'credit_account': str(self.ops.pk), 'credit_text': 'Rent',
+        })
+        self.assertRedirects(response, reverse('bank_app:dashboard'))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('479.50'))
+
+
+class StatementExportTest(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        Ledger.transfer(Decimal('12.50'), self.ops, 'Payout', self.account, 'Payout, "bonus"')
+        Ledger.transfer(Decimal(3), self.account, 'Coffee', self.ops, 'Coffee')
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('bank_app:statement_export', args=(self.account.pk,)), params)
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_csv_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['timestamp', 'transaction', 'amount', 'text'])
+        self.assertEqual([row[2:] for row in rows[1:]], [['12.50', 'Payout, "bonus"'], ['-3.00', 'Coffee']])
+
+    def test_ndjson_export_with_date_range(self):
+        today = timezone.now().date()
+        _, content = self.export(format='ndjson', start=today.isoformat(), end=today.isoformat())
+        self.assertEqual([json.loads(line)['amount'] for line in content.splitlines()], ['12.50', '-3.00'])
+        _, content = self.export(format='ndjson', end=(today - timedelta(days=1)).isoformat())
+        self.assertEqual(content, '')
+        self.assertEqual(self.export(format='xml')[0].status_code, 400)
+        self.assertEqual(self.export(start='yesterday')[0].status_code, 400)
+
+    def test_export_command(self):
+        output = io.StringIO()
+        with patch('sys.stdout', output):
+            call_command('export_statement', self.account.pk, format='ndjson')
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+
+
+class BalanceCheckpointTest(BankTestCase):
+    def post(self, amount, when):
+        Ledger.transfer(Decimal(amount), self.ops, 'Payout', self.account, 'Payout')
+        Ledger.objects.filter(pk__gte=Ledger.objects.latest('pk').pk - 1).update(timestamp=when)
+
+    def day(self, n, hour=12):
+        return datetime(2026, 1, n, hour, tzinfo=dt_timezone.utc)
+
+    def test_balance_as_of_uses_checkpoints(self):
+        Ledger.objects.update(timestamp=self.day(1))
+        self.post(10, self.day(2))
+        self.post(20, self.day(4))
+        self.assertEqual(checkpoint_balances('day', now=self.day(6)), 6)
+        self.assertEqual(self.account.checkpoints.count(), 2)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.account.balance_as_of(self.day(3)), Decimal(10))
+        self.assertEqual(self.account.balance_as_of(self.day(4, 13)), Decimal(30))
+        self.assertEqual(self.account.balance_as_of(self.day(1)), Decimal(0))
+
+    def test_late_postings_rebuild_later_checkpoints(self):
+        Ledger.objects.update(timestamp=self.day(1))
+        self.post(10, self.day(2))
+        self.post(20, self.day(4))
+        checkpoint_balances('day', now=self.day(6))
+        self.post(5, self.day(3))
+        self.post(1, self.day(6))
+        checkpoint_balances('day', now=self.day(8))
+        checkpoints = dict(self.account.checkpoints.values_list('period_end', 'balance'))
+        self.assertEqual(checkpoints, {
+            self.day(3, 0): Decimal(10), self.day(4, 0): Decimal(15),
+            self.day(5, 0): Decimal(35), self.day(7, 0): Decimal(36),
+        })
+        self.assertEqual(self.account.balance_as_of(self.day(5)), Decimal(35))
+        # Nothing recorded since, the postings of the last run are only read again within the margin
+        with self.settings(LEDGER_COMMIT_MARGIN_SECONDS=0):
+            self.assertEqual(checkpoint_balances('day', now=self.day(8)), 0)
+        self.assertGreater(checkpoint_balances('day', now=self.day(8)), 0)
+        self.assertEqual(dict(self.account.checkpoints.values_list('period_end', 'balance')), checkpoints)
+
+
+class QueryCountTest(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(user=self.user, rank=Rank.objects.create(name='Silver', value=50), personal_id=1, phone='1')
+        self.staff = User.objects.create_user('thomas', is_staff=True)
+
+    def queries(self, user, url):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context)
+
+    def assertBounded(self, user, url):
+        before = self.queries(user, url)
+        for n in range(5):
+            account = Account.objects.create(user=self.user, name=f'Savings {n}')
+            Ledger.transfer(Decimal(1), self.ops, 'Payout', account, 'Payout')
+        self.assertEqual(self.queries(user, url), before)
+        return before
+
+    def test_dashboard(self):
+        self.assertLessEqual(self.assertBounded(self.user, reverse('bank_app:dashboard')), 4)
+
+    def test_make_transfer(self):
+        self.assertBounded(self.user, reverse('bank_app:make_transfer'))
+
+    def test_staff_account_list(self):
+        url = reverse('bank_app:staff_account_list_partial', args=(self.customer.pk,))
+        self.assertLessEqual(self.assertBounded(self.staff, url), 4)
+
+    def test_staff_customer_details(self):
+        self.assertBounded(self.staff, reverse('bank_app:staff_customer_details', args=(self.customer.pk,)))
+
+    def test_transaction_details(self):
+        unique_id = Ledger.transfer(Decimal(1), self.ops, 'Payout', self.account, 'Payout')
+        self.assertLessEqual(self.queries(self.user, reverse('bank_app:transaction_details', args=(unique_id,))), 6)
+
+
+@override_settings(LEDGER_SHARDS=['ledger_0', 'ledger_1'])
+class ShardingTest(TestCase):
+    databases = {'default', 'ledger_0', 'ledger_1'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('evelyn', password='evelyn')
+        Customer.objects.create(user=self.user, rank=Rank.objects.create(name='Silver', value=50), personal_id=1, phone='1')
+        self.even = Account.objects.create(account_number=80750000010, user=self.user, name='Even')
+        self.odd = Account.objects.create(account_number=80750000011, user=self.user, name='Odd')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ledger.transfer(Decimal(100), self.even, 'Funding', self.odd, 'Funding', is_loan=True)
+
+    def test_cross_shard_transfer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            unique_id = Ledger.transfer(Decimal(40), self.odd, 'Rent', self.even, 'Rent')
+        self.assertEqual(Ledger.objects.using('ledger_0').filter(transaction=unique_id).get().account_id, self.even.pk)
+        self.assertEqual(Ledger.objects.using('ledger_1').filter(transaction=unique_id).get().account_id, self.odd.pk)
+        self.assertFalse(Ledger.objects.using('default').exists())
+        self.assertEqual(self.odd.ledger_balance(), Decimal(60))
+        self.assertEqual(self.even.refresh_balance(), Decimal(-60))
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+        movements = sharding.gather(Ledger.objects.filter(transaction=unique_id).select_related('account__user'))
+        self.assertEqual({movement.account.name for movement in movements}, {'Even', 'Odd'})
+
+    def test_unapplied_intent_is_resumed_once(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            unique_id = Ledger.transfer(Decimal(10), self.odd, 'Rent', self.even, 'Rent')
+        self.assertEqual(Account.objects.get(pk=self.odd.pk).balance, Decimal(90))
+        self.assertEqual(len(sharding.gather(Ledger.objects.filter(transaction=unique_id))), 0)
+        sharding.apply_intent(LedgerIntent.objects.filter(applied__isnull=True).first().pk)
+        # As if every intent crashed after phase two wrote its shard rows
+        LedgerIntent.objects.update(applied=None)
+        self.assertEqual(sharding.resume_pending(timedelta(0)), 4)
+        self.assertEqual(len(sharding.gather(Ledger.objects.filter(transaction=unique_id))), 2)
+        self.assertEqual(len(sharding.gather(Ledger.objects.all())), 4)
+        self.assertEqual(AppliedIntent.objects.using('ledger_0').count() + AppliedIntent.objects.using('ledger_1').count(), 4)
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+
+    def test_down_shard_does_not_fail_committed_transfer(self):
+        with patch.object(sharding, 'apply_intent', side_effect=OperationalError('shard down')), \
+                self.assertLogs('bank_app.sharding', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            unique_id = Ledger.transfer(Decimal(10), self.odd, 'Rent', self.even, 'Rent')
+        self.assertEqual(Account.objects.get(pk=self.odd.pk).balance, Decimal(90))
+        self.assertEqual(sharding.resume_pending(timedelta(0)), 2)
+        self.assertEqual(len(sharding.gather(Ledger.objects.filter(transaction=unique_id))), 2)
+
+    def test_transaction_details_gathers_shards(self):
+        unique_id = Ledger.objects.using('ledger_0').get(account=self.even).transaction
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bank_app:transaction_details', args=(unique_id,)))
+        self.assertEqual(len(response.context['movements']), 2)
+        self.assertEqual(self.even.statement().movements[0].transaction, unique_id)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def route(self, view, cookies=None, write=False):
+        # Returns the alias a read inside the view would use, and whether the response pins the session
+        router = ReplicaRouter()
+        seen = {}
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            if write:
+                router.db_for_write(Account)
+            seen['read'] = router.db_for_read(Account)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        return seen['read'], PIN_COOKIE in response.cookies
+
+    def test_read_only_views_use_replica(self):
+        view = read_only(lambda request: None)
+        self.assertEqual(self.route(view), ('replica', False))
+        self.assertEqual(self.route(lambda request: None), ('default', False))
+        self.assertEqual(ReplicaRouter().db_for_read(Account), 'default')
+
+    def test_writes_pin_session_to_primary(self):
+        view = read_only(lambda request: None)
+        self.assertEqual(self.route(view, write=True), ('default', True))
+        self.assertEqual(self.route(view, cookies={PIN_COOKIE: '1'}), ('default', False))
+
+
+class MetricsTest(BankTestCase):
+    def test_views_are_recorded_per_url_name(self):
+        staff = User.objects.create_user('thomas', is_staff=True)
+        self.client.force_login(self.user)
+        self.client.get(reverse('bank_app:account_details', args=(self.account.pk,)))
+        self.assertEqual(self.client.get(reverse('bank_app:metrics')).status_code, 403)
+        self.client.force_login(staff)
+        metrics = self.client.get(reverse('bank_app:metrics'), {'format': 'json'}).json()
+        account_details = metrics['bank_app:account_details']
+        self.assertGreaterEqual(account_details['request_seconds']['count'], 1)
+        self.assertGreater(account_details['sql_queries']['sum'], 0)
+        self.assertGreater(account_details['template_seconds']['sum'], 0)
+        self.assertIsNotNone(account_details['request_seconds']['p99'])
+        text = self.client.get(reverse('bank_app:metrics')).content.decode()
+        self.assertIn('bank_sql_queries_bucket{view="bank_app:account_details",le="+Inf"}', text)
+
+    def test_middleware_leaves_template_render_alone(self):
+        render = Template.render
+        MetricsMiddleware(lambda request: HttpResponse())
+        self.assertIs(Template.render, render)
+        self.assertEqual(Template('{{ value }}').render(Context({'value': 1})), '1')
+
+
+class GenerateDataTest(TestCase):
+    def test_generated_postings_are_balanced(self):
+        call_command('generate_data', customers=5, accounts_per_customer=2, postings_per_account=10, batch_size=8, prefix='gen-', seed=1)
+        self.assertEqual(Customer.objects.filter(user__username__startswith='gen-').count(), 5)
+        self.assertEqual(Ledger.objects.count(), 100)
+        self.assertEqual(Ledger.objects.aggregate(Sum('amount'))['amount__sum'], 0)
+        self.assertEqual(Account.rebuild_balances(fix=False), [])
+        self.assertGreater(len({timestamp.date() for timestamp in Ledger.objects.values_list('timestamp', flat=True)}), 1)
+        self.assertTrue(User.objects.get(username='gen-3').check_password('keaumulig123'))
+        self.assertEqual(len(Customer.search('gen-3')), 1)
+
+
+class BenchmarkTest(TestCase):
+    def test_benchmark_writes_report_and_cleans_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'baseline.json')
+            with redirect_stdout(io.StringIO()):
+                call_command('benchmark', generate=3, postings_per_account=4, iterations=5, output=output)
+            with open(output) as report:
+                results = json.load(report)['results']
+            self.assertEqual(set(results), {'transfer', 'balance', 'search', 'make_loan', 'transaction_details'})
+            self.assertEqual(results['balance']['queries_per_op'], 1)
+            self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+            self.assertEqual(Account.rebuild_balances(fix=False), [])
+
+            # A path that suddenly needs more queries than the baseline is a regression
+            results['balance']['queries_per_op'] = 0
+            with open(output, 'w') as report:
+                json.dump({'results': results}, report)
+            with redirect_stdout(io.StringIO()), self.assertRaises(CommandError):
+                call_command('benchmark', paths=['balance'], iterations=5, baseline=output, tolerance=100)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any
+
+
+@dataclass
+class TransferRequest:
+    amount: Decimal
+    debit_account: Any
+    debit_text: str
+    credit_account: Any
+    credit_text: str
+
+
+@dataclass
+class TransferResult:
+    index: int
+    unique_id: Any = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.unique_id is not None
+
+    def as_dict(self) -> dict:
+        if self.ok:
+            return {'index': self.index, 'status': 'ok', 'unique_id': str(self.unique_id)}
+        return {'index': self.index, 'status': 'error', 'error': self.error or 'Not posted, batch rolled back.'}
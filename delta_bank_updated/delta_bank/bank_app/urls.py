@@ -14,8 +14,10 @@ urlpatterns = [
 
     path('dashboard/', views.dashboard, name='dashboard'),
     path('account_details/<int:pk>/', views.account_details, name='account_details'),
+    path('account_details/<int:pk>/export/', views.statement_export, name='statement_export'),
     path('transaction_details/<uuid:transaction>/', views.transaction_details, name='transaction_details'),
     path('make_transfer/', views.make_transfer, name='make_transfer'),
+    path('make_transfer/submit/', views.submit_transfer, name='submit_transfer'),
     path('make_loan/', views.make_loan, name='make_loan'),
     path('settings/', views.settings, name='settings'),
 
@@ -24,15 +26,25 @@ urlpatterns = [
     path('staff_customer_details/<int:pk>/', views.staff_customer_details, name='staff_customer_details'),
     path('staff_account_list_partial/<int:pk>/', views.staff_account_list_partial, name='staff_account_list_partial'),
     path('staff_account_details/<int:pk>/', views.staff_account_details, name='staff_account_details'),
+    path('staff_hot_account/<int:pk>/', views.staff_hot_account, name='staff_hot_account'),
     path('staff_new_account_partial/<int:user>/', views.staff_new_account_partial, name='staff_new_account_partial'),
     path('staff_new_customer/', views.staff_new_customer, name='staff_new_customer'),
+    path('staff_import_customers/', views.staff_import_customers, name='staff_import_customers'),
 
     #messages
     path('message/', views.message, name='message'),
     path('message_detail/<int:pk>/', views.message_detail, name='message_detail'),
 
+    path('metrics/', views.metrics, name='metrics'),
+
     #API
     path('api/v1/make_transfer/from/', views.transfer_money_from),
     path('api/v1/make_transfer/to/', views.transfer_money_to),
+    path('api/v1/holds/', views.reserve_funds, name='reserve_funds'),
+    path('api/v1/holds/<uuid:transaction>/commit/', views.commit_hold, name='commit_hold'),
+    path('api/v1/holds/<uuid:transaction>/release/', views.release_hold, name='release_hold'),
     path('api/v1/credit_acc_validation/', views.credit_acc_validation),
+    path('api/v1/credit_acc_validation/batch/', views.credit_acc_validation_batch, name='credit_acc_validation_batch'),
+    path('api/v1/bulk_transfer/', views.bulk_transfer, name='bulk_transfer'),
+    path('api/v1/statement/<int:pk>/', views.account_statement, name='account_statement'),
 ]
\ No newline at end of file
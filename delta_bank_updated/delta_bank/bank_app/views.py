@@ -1,19 +1,28 @@
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from secrets import token_urlsafe
-from django.http import HttpResponseRedirect, JsonResponse
+import uuid
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, QueryDict, StreamingHttpResponse
 from django.shortcuts import render, reverse, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, get_user_model
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from django.db import IntegrityError
-from .forms import TransferForm, UserForm, CustomerForm, NewUserForm, NewAccountForm, MessageForm, Otp_form
-from .models import Account, Ledger, Customer, Message, User
-from .errors import InsufficientFunds
+from .forms import TransferForm, UserForm, CustomerForm, NewUserForm, NewAccountForm, HotAccountForm, LoanForm, CustomerImportForm, MessageForm, Otp_form
+from .models import Account, Hold, Installment, Ledger, Customer, Message, User
+from .errors import HoldNotActive, InsufficientFunds
+from .transfers import TransferRequest, TransferResult
+from . import interbank, sharding
+from .account_filter import VALIDATION_BATCH_LIMIT, account_filter
+from .idempotency import idempotent
+from .metrics import registry
+from .onboarding import IMPORT_FIELDS, import_customers
+from .routing import read_only
+from .statements import EXPORT_FORMATS, export_lines, export_rows, parse_export_date
 from .serializers import UserSerializer
 import pyotp
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 
 User = get_user_model()
 
@@ -28,6 +37,7 @@ def index(request):
 
 # Customer views
 
+@read_only
 @login_required
 def dashboard(request):
     assert not request.user.is_staff, 'Staff user routing customer view.'
@@ -39,6 +49,7 @@ def dashboard(request):
     return render(request, 'bank_app/dashboard.html', context)
 
 
+@read_only
 @login_required
 def account_details(request, pk):
     assert not request.user.is_staff, 'Staff user routing customer view.'
@@ -46,15 +57,37 @@ def account_details(request, pk):
     account = get_object_or_404(Account, user=request.user, pk=pk)
     context = {
         'account': account,
+        'statement': account.statement(request.GET.get('cursor')),
+        # Empty unless the account is a loan account
+        'schedule': Installment.objects.filter(loan_id=account.pk).order_by('number'),
     }
     return render(request, 'bank_app/account_details.html', context)
 
 
+@read_only
+@login_required
+def statement_export(request, pk):
+    if request.user.is_staff:
+        account = get_object_or_404(Account, pk=pk)
+    else:
+        account = get_object_or_404(Account, user=request.user, pk=pk)
+    export_format = request.GET.get('format', 'csv')
+    start = parse_export_date(request.GET.get('start'))
+    end = parse_export_date(request.GET.get('end'))
+    lines = export_lines(export_rows(account.movements, start, end), export_format)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="statement-{account.pk}.{export_format}"'
+    return response
+
+
+@read_only
 @login_required
 def transaction_details(request, transaction):
-    movements = Ledger.objects.filter(transaction=transaction)
+    # The legs of a transfer may be on different shards
+    movements = sharding.gather(Ledger.objects.filter(transaction=transaction).select_related('account__user'))
     if not request.user.is_staff:
-        if not movements.filter(account__in=request.user.customer.accounts):
+        own = set(request.user.customer.accounts.values_list('pk', flat=True))
+        if not any(movement.account_id in own for movement in movements):
             raise PermissionDenied('Customer is not part of the transaction.')
     context = {
         'movements': movements,
@@ -62,6 +95,7 @@ def transaction_details(request, transaction):
     return render(request, 'bank_app/transaction_details.html', context)
 
 
+@read_only
 @login_required
 def make_transfer(request):
     assert not request.user.is_staff, 'Staff user routing customer view.'
@@ -74,6 +108,33 @@ def make_transfer(request):
     return render(request, 'bank_app/make_transfer.html', context)
 
 
+@login_required
+def submit_transfer(request):
+    assert not request.user.is_staff, 'Staff user routing customer view.'
+
+    form = TransferForm(request.POST or None)
+    form.fields['debit_account'].queryset = request.user.customer.accounts
+    if request.method == 'POST' and form.is_valid():
+        transfer = interbank.submit(
+            form.cleaned_data['debit_account'],
+            form.cleaned_data['amount'],
+            form.cleaned_data['debit_text'],
+            form.cleaned_data['credit_account'],
+            form.cleaned_data['credit_text'],
+        )
+        if transfer.state in (transfer.FAILED, transfer.REVERSED):
+            context = {
+                'title': 'Transfer Error',
+                'error': transfer.error,
+            }
+            return render(request, 'bank_app/error.html', context)
+        return HttpResponseRedirect(reverse('bank_app:dashboard'))
+    context = {
+        'form': form,
+    }
+    return render(request, 'bank_app/make_transfer.html', context)
+
+
 @login_required
 def make_loan(request):
     assert not request.user.is_staff, 'Staff user routing customer view.'
@@ -85,13 +146,17 @@ def make_loan(request):
         }
         return render(request, 'bank_app/error.html', context)
     if request.method == 'POST':
-        request.user.customer.make_loan(Decimal(request.POST['amount']), request.POST['name'])
-        return HttpResponseRedirect(reverse('bank_app:dashboard'))
-    return render(request, 'bank_app/make_loan.html', {})
+        form = LoanForm(request.POST)
+        if form.is_valid():
+            request.user.customer.make_loan(form.cleaned_data['amount'], form.cleaned_data['name'], form.cleaned_data['installments'])
+            return HttpResponseRedirect(reverse('bank_app:dashboard'))
+        return render(request, 'bank_app/make_loan.html', {'form': form}, status=400)
+    return render(request, 'bank_app/make_loan.html', {'form': LoanForm()})
 
 
 # Staff views
 
+@read_only
 @login_required
 def staff_dashboard(request):
     assert request.user.is_staff, 'Customer user routing staff view.'
@@ -99,6 +164,7 @@ def staff_dashboard(request):
     return render(request, 'bank_app/staff_dashboard.html')
 
 
+@read_only
 @login_required
 def staff_search_partial(request):
     assert request.user.is_staff, 'Customer user routing staff view.'
@@ -115,7 +181,7 @@ def staff_search_partial(request):
 def staff_customer_details(request, pk):
     assert request.user.is_staff, 'Customer user routing staff view.'
 
-    customer = get_object_or_404(Customer, pk=pk)
+    customer = get_object_or_404(Customer.objects.select_related('user', 'rank'), pk=pk)
     if request.method == 'GET':
         user_form = UserForm(instance=customer.user)
         customer_form = CustomerForm(instance=customer)
@@ -135,6 +201,7 @@ def staff_customer_details(request, pk):
     return render(request, 'bank_app/staff_customer_details.html', context)
 
 
+@read_only
 @login_required
 def staff_account_list_partial(request, pk):
     assert request.user.is_staff, 'Customer user routing staff view.'
@@ -147,6 +214,7 @@ def staff_account_list_partial(request, pk):
     return render(request, 'bank_app/staff_account_list_partial.html', context)
 
 
+@read_only
 @login_required
 def staff_account_details(request, pk):
     assert request.user.is_staff, 'Customer user routing staff view.'
@@ -154,10 +222,25 @@ def staff_account_details(request, pk):
     account = get_object_or_404(Account, pk=pk)
     context = {
         'account': account,
+        'statement': account.statement(request.GET.get('cursor')),
+        'schedule': Installment.objects.filter(loan_id=account.pk).order_by('number'),
+        'hot_account_form': HotAccountForm(initial={'slots': account.hot_slots}),
     }
     return render(request, 'bank_app/account_details.html', context)
 
 
+@login_required
+def staff_hot_account(request, pk):
+    assert request.user.is_staff, 'Customer user routing staff view.'
+
+    account = get_object_or_404(Account, pk=pk)
+    if request.method == 'POST':
+        hot_account_form = HotAccountForm(request.POST)
+        if hot_account_form.is_valid():
+            account.make_hot(hot_account_form.cleaned_data['slots'])
+    return HttpResponseRedirect(reverse('bank_app:staff_account_details', args=(pk,)))
+
+
 @login_required
 def staff_new_account_partial(request, user):
     assert request.user.is_staff, 'Customer user routing staff view.'
@@ -211,6 +294,33 @@ def staff_new_customer(request):
     }
     return render(request, 'bank_app/staff_new_customer.html', context)
 
+
+@login_required
+def staff_import_customers(request):
+    assert request.user.is_staff, 'Customer user routing staff view.'
+
+    report = None
+    if request.method == 'POST':
+        import_form = CustomerImportForm(request.POST, request.FILES)
+        if import_form.is_valid():
+            try:
+                # Passwords are hashed on the worker processes, the form keeps the file small enough for a request
+                report = import_customers(import_form.cleaned_data['file'])
+            except ValueError as error:
+                context = {
+                    'title': 'Import Error',
+                    'error': str(error),
+                }
+                return render(request, 'bank_app/error.html', context)
+    else:
+        import_form = CustomerImportForm()
+    context = {
+        'import_form': import_form,
+        'fields': IMPORT_FIELDS,
+        'report': report,
+    }
+    return render(request, 'bank_app/staff_import_customers.html', context)
+
 @login_required
 def message(request):
     
@@ -254,29 +364,58 @@ def settings(request):
     return render(request, 'bank_app/settings.html', context)
 
 
+@login_required
+def metrics(request):
+    if not request.user.is_staff:
+        raise PermissionDenied('Metrics are restricted to staff.')
+    if request.GET.get('format') == 'json':
+        return JsonResponse(registry.as_json())
+    return HttpResponse(registry.as_prometheus(), content_type='text/plain; version=0.0.4')
+
+
 # --------------API-------------
 
 #Check om credit konto eksisterer før der fortages en overførelse
+@read_only
 @api_view(['POST'])
 def credit_acc_validation(request):
 
     if request.method == 'POST':
 
         credit_account = request.POST['credit_account']
-        print(credit_account)
-        try:
-            if Account.objects.get(pk=credit_account):
-                return JsonResponse({"message": "account found"}, status=200)
-        except ObjectDoesNotExist:
-            return JsonResponse({"message": "account not found"}, status=403)
+        if account_filter.exists(credit_account):
+            return JsonResponse({"message": "account found"}, status=200)
+        return JsonResponse({"message": "account not found"}, status=403)
+
+
+#Check af mange credit konti på én gang, fx en hel lønfil. Body: {"accounts": ["80750000001", ...]}
+@read_only
+@api_view(['POST'])
+def credit_acc_validation_batch(request):
+
+    if not isinstance(request.data, dict) or isinstance(request.data, QueryDict):
+        return JsonResponse({"message": "Body must be a JSON object with a list of accounts"}, status=400)
+    accounts = request.data.get('accounts', [])
+    # bool er en int i Python, men ikke et kontonummer
+    if not isinstance(accounts, list) or not all(isinstance(account, (str, int)) and not isinstance(account, bool) for account in accounts):
+        return JsonResponse({"message": "accounts must be a list of account numbers"}, status=400)
+    accounts = [str(account) for account in accounts]
+    if len(accounts) > VALIDATION_BATCH_LIMIT:
+        return JsonResponse({"message": f"at most {VALIDATION_BATCH_LIMIT} accounts per request"}, status=400)
+    found = account_filter.existing(accounts)
+    return JsonResponse({
+        "found": [account for account in accounts if account.isdigit() and int(account) in found],
+        "missing": [account for account in accounts if not account.isdigit() or int(account) not in found],
+    }, status=200)
 
 
 #API der fratrækker penge fra senders konto
 @api_view(['POST'])
+@idempotent
 def transfer_money_from(request):
 
     if request.method == 'POST':
-        amount = int(request.POST['amount'])
+        amount = Decimal(request.POST['amount'])
         debit_account = Account.objects.get(pk=request.POST['debit_account'])
         debit_text = request.POST['debit_text']
 
@@ -293,13 +432,17 @@ def transfer_money_from(request):
 
 #API der sætte penge ind på modtagers konto       
 @api_view(['POST'])
+@idempotent
 def transfer_money_to(request):
     
     if request.method == 'POST':
-        amount = int(request.POST['amount'])
+        amount = Decimal(request.POST['amount'])
         credit_account =  Account.objects.get(pk=request.POST['credit_account'])
         credit_text = request.POST['credit_text']
-        unique_id = request.POST['unique_id']
+        try:
+            unique_id = uuid.UUID(request.POST['unique_id'])
+        except ValueError:
+            return JsonResponse({"message": "unique_id is not a valid UUID"}, status=400)
 
         try:
             Ledger.transfer_to(amount, credit_account, credit_text, unique_id)
@@ -309,4 +452,126 @@ def transfer_money_to(request):
                 'title': 'Transfer Error',
                 'error': 'Insufficient funds for transfer.'
             }
-            return render(request, 'bank_app/error.html', context)
\ No newline at end of file
+            return render(request, 'bank_app/error.html', context)
+
+
+#API der reserverer penge på senders konto. Pengene trækkes først når holdet commits
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def reserve_funds(request):
+
+    try:
+        amount = Decimal(request.POST['amount'])
+        debit_account_id = int(request.POST['debit_account'])
+        debit_text = request.POST['debit_text']
+    except (KeyError, ValueError, InvalidOperation):
+        return JsonResponse({"message": "amount, debit_account and debit_text are required"}, status=400)
+    if not amount.is_finite() or amount <= 0:
+        return JsonResponse({"message": "amount must be positive"}, status=400)
+    accounts = Account.objects.all() if request.user.is_staff else Account.objects.filter(user=request.user)
+    debit_account = get_object_or_404(accounts, pk=debit_account_id)
+    try:
+        hold = Hold.reserve(amount=amount, account=debit_account, text=debit_text)
+    except InsufficientFunds:
+        return JsonResponse({"message": "insufficient funds"}, status=409)
+    return JsonResponse({"unique_id": hold.transaction, "expires": hold.expires.isoformat()}, status=200)
+
+
+def _own_hold(request, transaction) -> Hold:
+    # Customers only see holds on their own accounts, staff see all. A hold taken by an interbank
+    # transfer is settled by the transfer only, the other bank may already have been credited.
+    holds = Hold.objects.all() if request.user.is_staff else Hold.objects.filter(account__user=request.user)
+    holds = holds.filter(interbanktransfer__isnull=True)
+    return get_object_or_404(holds, transaction=transaction)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def commit_hold(request, transaction):
+
+    hold = _own_hold(request, transaction)
+    try:
+        hold.commit()
+    except HoldNotActive:
+        return JsonResponse({"message": "hold is not active"}, status=409)
+    return JsonResponse({"unique_id": hold.transaction}, status=200)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def release_hold(request, transaction):
+
+    hold = _own_hold(request, transaction)
+    if not hold.release():
+        return JsonResponse({"message": "hold is not active"}, status=409)
+    return JsonResponse({"message": "hold released"}, status=200)
+
+
+#API der returnerer en side af kontoens posteringer, nyeste først
+@read_only
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def account_statement(request, pk):
+
+    if request.user.is_staff:
+        account = get_object_or_404(Account, pk=pk)
+    else:
+        account = get_object_or_404(Account, user=request.user, pk=pk)
+    statement = account.statement(request.GET.get('cursor'))
+    movements = [
+        {
+            'transaction': movement.transaction,
+            'amount': str(movement.amount),
+            'timestamp': movement.timestamp.isoformat(),
+            'text': movement.text,
+        }
+        for movement in statement.movements
+    ]
+    return JsonResponse({"movements": movements, "next_cursor": statement.next_cursor}, status=200)
+
+
+#API til batch overførelser. Body: {"atomic": true, "transfers": [{amount, debit_account, debit_text, credit_account, credit_text}, ...]}
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_transfer(request):
+
+    # A JSON object as above, or just the list of transfers. A form-encoded body parses to a QueryDict.
+    data = {'transfers': request.data} if isinstance(request.data, list) else request.data
+    if not isinstance(data, dict) or isinstance(data, QueryDict):
+        return JsonResponse({"message": "Body must be a JSON object with a list of transfers"}, status=400)
+    items = data.get('transfers', [])
+    atomic = data.get('atomic', True)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items) or not isinstance(atomic, bool):
+        return JsonResponse({"message": "transfers must be a list of objects and atomic a boolean"}, status=400)
+    account_ids = {str(item.get(key)) for item in items for key in ('debit_account', 'credit_account')}
+    accounts = Account.objects.in_bulk([int(pk) for pk in account_ids if pk.isdigit()])
+    lookup = lambda pk: accounts.get(int(pk)) if str(pk).isdigit() else None
+
+    errors = {}
+    transfers = []
+    for index, item in enumerate(items):
+        debit_account = lookup(item.get('debit_account'))
+        credit_account = lookup(item.get('credit_account'))
+        try:
+            amount = Decimal(str(item.get('amount')))
+        except InvalidOperation:
+            amount = None
+        if debit_account is None or credit_account is None:
+            errors[index] = 'Account not found.'
+        elif not request.user.is_staff and debit_account.user_id != request.user.pk:
+            errors[index] = 'Debit account does not belong to user.'
+        elif amount is None or not amount.is_finite() or amount <= 0:
+            errors[index] = 'Amount must be positive.'
+        else:
+            transfers.append((index, TransferRequest(amount, debit_account, item.get('debit_text', ''), credit_account, item.get('credit_text', ''))))
+
+    if errors and atomic:
+        results = [TransferResult(index, error=errors.get(index)) for index in range(len(items))]
+        return JsonResponse({"results": [result.as_dict() for result in results]}, status=400)
+
+    posted = Ledger.bulk_transfer([transfer for _, transfer in transfers], atomic=atomic)
+    results = [TransferResult(index, error=error) for index, error in errors.items()]
+    results += [TransferResult(index, result.unique_id, result.error) for (index, _), result in zip(transfers, posted)]
+    results.sort(key=lambda result: result.index)
+    status = 200 if all(result.ok for result in results) or not atomic else 409
+    return JsonResponse({"results": [result.as_dict() for result in results]}, status=status)
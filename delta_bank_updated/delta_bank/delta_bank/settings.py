@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bank_app.metrics.MetricsMiddleware',
+    'bank_app.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,9 +91,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
 }
 
+# Aliases in DATABASES that hold the Ledger rows, an account's postings go to LEDGER_SHARDS[account number % len].
+# Empty keeps the Ledger on default. Every shard needs manage.py migrate --database <alias> before it is listed,
+# and changing the list requires moving the existing rows. manage.py test runs with delta_bank.test_settings,
+# which declares two SQLite shards for the sharding tests.
+LEDGER_SHARDS = []
+
+# Aliases in DATABASES that views marked read_only may read from. To try it with two local SQLite files:
+#   DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3'}
+#   DATABASE_REPLICAS = ['replica']
+# and refresh the copy with manage.py sync_sqlite_replicas.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['bank_app.sharding.LedgerShardRouter', 'bank_app.routing.ReplicaRouter']
+
+# Seconds a session reads from the primary after it wrote, covers the replication lag
+REPLICA_PIN_SECONDS = 5
+
+# Seconds a transaction writing Ledger rows may stay open. checkpoint_balances and reconcile_ledger --incremental
+# read again the postings recorded this long before their previous run, which may have committed after it.
+LEDGER_COMMIT_MARGIN_SECONDS = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -152,6 +174,51 @@ LOGOUT_REDIRECT_URL = '/'
 
 CUSTOMER_RANK_LOAN = 50
 
+# Processes hashing passwords in a customer import, None for one per CPU
+CUSTOMER_IMPORT_WORKERS = None
+
+# Limits of an import uploaded by staff, which runs inside the request. A password hash takes about
+# 0.2 s, so 100 rows are hashed in a few seconds on the CUSTOMER_IMPORT_WORKERS processes.
+# Larger files are imported with manage.py import_customers.
+CUSTOMER_IMPORT_UPLOAD_MAX_BYTES = 32 * 1024
+CUSTOMER_IMPORT_UPLOAD_MAX_ROWS = 100
+
+# Yearly percentage and number of monthly installments of a new loan
+LOAN_RATE = '7.500'
+LOAN_INSTALLMENTS = 12
+
+STATEMENT_PAGE_SIZE = 50
+
+# Seconds of history in the rolling percentiles of /metrics/?format=json
+METRICS_WINDOW = 300
+
+# Interbank transfers. The first four digits of an account number identify its bank.
+BANK_PREFIX = '8075'
+BANK_URLS = {
+    '8075': 'http://localhost:8100/',  # delta bank
+    '2040': 'http://localhost:8200/',  # danske bank
+}
+INTERBANK_TIMEOUT = 10
+INTERBANK_MAX_CONNECTIONS = 20
+
+# Bank account that pays deposit interest and receives overdraft interest and fees (post_interest)
+BANK_INCOME_ACCOUNT = 80750000003
+
+# Seconds a hold reserves funds before expire_holds releases them
+HOLD_TTL = 60 * 60
+
+# How a posting to a hot account picks its AccountSlot: 'random' or 'round_robin'
+HOT_ACCOUNT_SLOT_CHOICE = 'random'
+
+# Seconds a stored Idempotency-Key response is replayed before prune_idempotency_keys removes it
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# Seconds before the in-process account number filter used by credit_acc_validation is rebuilt
+ACCOUNT_FILTER_TTL = 300
+
+# Attempts for a transfer that hits a serialization failure or a locked SQLite database
+TRANSFER_RETRY_ATTEMPTS = 10
+
 # REST_FRAMEWORK = {
 #    'DEFAULT_PERMISSION_CLASSES': [
 #       'bank_app.permissions.IsOwnerOrNoAccess',
@@ -0,0 +1,9 @@
+# Settings for manage.py test: the sharding tests turn LEDGER_SHARDS on per test, so the shard
+# databases are declared here rather than in the production settings.
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    **DATABASES,
+    'ledger_0': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'ledger_0.sqlite3'},
+    'ledger_1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'ledger_1.sqlite3'},
+}
@@ -5,8 +5,13 @@ import sys
 
 
 def main():
-    """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'delta_bank.settings')
+    """Run administrative tasks.
+
+    manage.py test defaults to delta_bank.test_settings, which adds the ledger shard databases
+    the sharding tests need. DJANGO_SETTINGS_MODULE still wins for every command.
+    """
+    settings_module = 'delta_bank.test_settings' if sys.argv[1:2] == ['test'] else 'delta_bank.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,61 @@
+import secrets
+import time
+from unittest.mock import patch
+import pyotp
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from mfa_app.otp import forget_accepted
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare OTP login throughput of in-process validation against the old HTTP loopback call.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=100)
+        parser.add_argument('--loopback-url', default='http://localhost:8100/api/auth/otp/validate',
+                            help='ValidateOTP endpoint of a running server on the same database.')
+        parser.add_argument('--skip-loopback', action='store_true')
+
+    def handle(self, **options):
+        print('Benchmarking OTP logins ...')
+        password = secrets.token_urlsafe(16)
+        user = User.objects.create_user(f'bench-{secrets.token_hex(4)}', password=password)
+        user.otp_base32 = pyotp.random_base32()
+        user.otp_enabled = user.otp_verified = True
+        user.save()
+        try:
+            rate = self.run(user, password, options['logins'])
+            print(f'in-process: {rate:8.1f} logins/s')
+            if not options['skip_loopback']:
+                with patch('mfa_app.views.validate_otp', self.loopback(options['loopback_url'])):
+                    loopback_rate = self.run(user, password, options['logins'])
+                print(f'loopback:   {loopback_rate:8.1f} logins/s ({rate / loopback_rate:.2f}x slower)')
+        finally:
+            user.delete()
+
+    def loopback(self, url):
+        def validate(user, token):
+            # What login_view used to do: a blocking request back into its own server.
+            # That server rejects the replayed benchmark code, only the round trip is measured.
+            response = requests.post(url, data={'user_id': user.id, 'token': token})
+            if response.status_code >= 500:
+                raise CommandError(f'Loopback validation failed with status {response.status_code}.')
+            return True
+        return validate
+
+    def run(self, user, password, logins):
+        client = Client(HTTP_HOST='localhost')
+        totp = pyotp.TOTP(user.otp_base32)
+        start = time.perf_counter()
+        for _ in range(logins):
+            code = totp.now()
+            client.post('/api/auth/login', {'username': user.username, 'password': password, 'code': code})
+            if '_auth_user_id' not in client.session:
+                raise CommandError('Login with a valid code was rejected.')
+            client.logout()
+            # The benchmark replays one code on purpose
+            forget_accepted(user)
+        return logins / (time.perf_counter() - start)
@@ -0,0 +1,34 @@
+import datetime
+import pyotp
+from pyotp import utils
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+# Codes from the previous, current and next 30 second step are accepted
+VALID_WINDOW = 1
+
+
+def _matching_step(totp, token):
+    # The time step the code belongs to, None when it matches no step in the window
+    step = totp.timecode(datetime.datetime.now())
+    for counter in range(step - VALID_WINDOW, step + VALID_WINDOW + 1):
+        if utils.strings_equal(str(token), totp.generate_otp(counter)):
+            return counter
+    return None
+
+
+def validate_otp(user, token) -> bool:
+    """Check a TOTP code for a user with verified OTP, accepting each code only once."""
+    if not user.otp_verified or not user.otp_base32 or not token:
+        return False
+    step = _matching_step(pyotp.TOTP(user.otp_base32), token)
+    if step is None:
+        return False
+    # Only a step later than the last accepted one is taken. The conditional update is atomic in the
+    # database, so a replayed code is rejected whichever process or server it is sent to.
+    accepted = get_user_model().objects.filter(pk=user.pk).filter(Q(otp_last_step__isnull=True) | Q(otp_last_step__lt=step))
+    return accepted.update(otp_last_step=step) == 1
+
+
+def forget_accepted(user):
+    get_user_model().objects.filter(pk=user.pk).update(otp_last_step=None)
@@ -1,3 +1,39 @@
+from datetime import datetime
+import pyotp
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+User = get_user_model()
+
+
+class OTPLoginTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('evelyn', password='keaumulig123')
+        self.user.otp_base32 = pyotp.random_base32()
+        self.user.otp_enabled = self.user.otp_verified = True
+        self.user.save()
+        self.totp = pyotp.TOTP(self.user.otp_base32)
+
+    def login(self, code):
+        self.client.post(reverse('mfa_app:login'), {'username': 'evelyn', 'password': 'keaumulig123', 'code': code})
+        logged_in = '_auth_user_id' in self.client.session
+        self.client.logout()
+        return logged_in
+
+    def test_login_validates_code_in_process(self):
+        self.assertFalse(self.login('000000' if self.totp.now() != '000000' else '111111'))
+        self.assertTrue(self.login(self.totp.now()))
+
+    def test_accepted_code_cannot_be_replayed(self):
+        code = self.totp.now()
+        self.assertTrue(self.login(code))
+        self.assertFalse(self.login(code))
+        response = self.client.post('/api/auth/otp/validate', {'user_id': self.user.pk, 'token': code})
+        self.assertEqual(response.status_code, 400)
+
+    def test_code_of_an_earlier_step_is_rejected(self):
+        now = datetime.now()
+        self.assertTrue(self.login(self.totp.at(now, 1)))
+        self.assertEqual(User.objects.get(pk=self.user.pk).otp_last_step, self.totp.timecode(now) + 1)
+        self.assertFalse(self.login(self.totp.at(now)))
@@ -4,10 +4,10 @@ from django.shortcuts import render, reverse, get_object_or_404, redirect
 from django.contrib.auth import authenticate, login, get_user_model
 from bank_app.models import User
 from .serializers import UserSerializer
+from .otp import validate_otp
 import pyotp
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-import requests
 from django.http import JsonResponse
 
 User = get_user_model()
@@ -22,19 +22,9 @@ def login_view(request):
         if user is not None:
 
             if user.otp_enabled:
-                data = {
-                    'user_id': user.id,
-                    'token': code
-                }
-                # Make a POST request to the API    
-                response = requests.post('http://localhost:8100/api/auth/otp/validate', data=data)
-                if response.status_code == 200:
-                    res_data = response.json()
-                    if res_data.get("otp_valid"):
-                        login(request, user)
-                        return redirect('bank_app:index')
-                    else:
-                        return redirect('bank_app:index')
+                if validate_otp(user, code):
+                    login(request, user)
+                    return redirect('bank_app:index')
                 else:
                     return redirect('bank_app:index')
             else:
@@ -145,8 +135,7 @@ class ValidateOTP(generics.GenericAPIView):
         if not user.otp_verified:
             return Response({"status": "fail", "message": "OTP must be verified first"}, status=status.HTTP_404_NOT_FOUND)
 
-        totp = pyotp.TOTP(user.otp_base32)
-        if not totp.verify(otp_token, valid_window=1):
+        if not validate_otp(user, otp_token):
             return Response({"status": "fail", "message": message}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'otp_valid': True})